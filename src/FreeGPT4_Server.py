@@ -7,6 +7,7 @@ GPT4Free Credits: github.com/xtekky/gpt4free
 
 import os
 import argparse
+import atexit
 import threading
 import getpass
 import json
@@ -19,9 +20,15 @@ from werkzeug.utils import secure_filename
 from g4f.api import run_api
 
 from config import config
-from database import db_manager
+from database import async_db_manager, db_manager
 from auth import auth_service, require_auth, require_token_auth
 from ai_service import ai_service
+from health_prober import health_prober
+from history_cache import history_cache
+from history_maintenance import history_maintenance
+from provider_state import provider_state
+from request_context import resolve_request_context
+from utils.cookies import cookie_store
 from utils.logging import logger, setup_logging
 from utils.exceptions import (
     FreeGPTException, 
@@ -38,8 +45,7 @@ from utils.validation import (
 )
 from utils.helpers import (
     generate_uuid,
-    load_json_file,
-    save_json_file,
+    atomic_write_bytes,
     parse_proxy_url,
     safe_filename
 )
@@ -151,6 +157,16 @@ class ServerArgumentParser:
             action='store_true',
             help="Gives the chance to create and manage new users",
         )
+        parser.add_argument(
+            "--enable-health-probe",
+            action='store_true',
+            help="Periodically send canary prompts to providers to keep health data warm",
+        )
+        parser.add_argument(
+            "--compress-history",
+            action='store_true',
+            help="Compress chat messages stored uncompressed and enable incremental auto-vacuum, then exit",
+        )
         
         return parser
     
@@ -244,6 +260,11 @@ class ServerManager:
         self.fast_api_thread = threading.Thread(target=run_api, name="fastapi", daemon=True)
         self.fast_api_thread.start()
     
+    def start_health_prober(self):
+        """Start background provider health probes."""
+        if self.args.enable_health_probe or config.probe.enabled:
+            health_prober.start()
+    
     def setup_password(self):
         """Set up admin password if GUI is enabled."""
         if not self.args.enable_gui:
@@ -328,9 +349,6 @@ def index():
     
     async def _async_index():
         try:
-            # Get current settings
-            settings = db_manager.get_settings()
-            
             # Extract question from request
             question = None
             if request.method == "GET":
@@ -351,9 +369,10 @@ def index():
             # Sanitize input
             question = sanitize_input(question, 10000)  # 10KB limit
             
-            # Verify token access
+            # Verify token access (database reads run off the event loop)
             token = request.args.get("token")
-            username = auth_service.verify_token_access(
+            username = await async_db_manager.run(
+                auth_service.verify_token_access,
                 token, 
                 server_manager.args.private_mode
             )
@@ -364,18 +383,38 @@ def index():
             if not username:
                 username = "admin"
             
+            # Honor client cache directives: no-cache skips lookup, no-store skips both
+            cache_control = request.headers.get("Cache-Control", "").lower()
+            no_store = "no-store" in cache_control
+            
+            # Resolve user, effective settings and history once for the whole request
+            context = await async_db_manager.run(
+                resolve_request_context, username, use_history=server_manager.args.enable_history
+            )
+            
             # Generate AI response
-            response_text = await ai_service.generate_response(
+            result = await ai_service.generate_response_with_meta(
                 message=question,
-                username=username,
-                use_history=server_manager.args.enable_history,
+                context=context,
                 remove_sources=server_manager.args.remove_sources,
                 use_proxies=server_manager.args.enable_proxies,
-                cookie_file=server_manager.args.cookie_file
+                cookie_file=server_manager.args.cookie_file,
+                read_cache=not no_store and "no-cache" not in cache_control,
+                write_cache=not no_store
             )
             
-            logger.info(f"Generated response for user '{username}' ({len(response_text)} chars)")
-            return response_text
+            headers = {"X-Cache": result.cache_status}
+            if result.coalesced:
+                headers["X-Coalesced"] = "1"
+            if result.stale_reason:
+                headers["X-Cache-Stale"] = result.stale_reason
+            if result.similarity is not None:
+                headers["X-Cache-Similarity"] = f"{result.similarity:.3f}"
+            if result.cache_age is not None:
+                headers["Age"] = str(int(result.cache_age))
+            
+            logger.info(f"Generated response for user '{username}' ({len(result.text)} chars, cache {result.cache_status})")
+            return result.text, 200, headers
             
         except FreeGPTException as e:
             logger.error(f"API error: {e}")
@@ -437,7 +476,9 @@ def settings():
         
         if not is_admin and username != "admin":
             # Regular user settings
-            user_data = db_manager.get_user_by_username(username)
+            user_data = db_manager.get_user_by_username(
+                username, fields=("token", "provider", "model", "system_prompt", "message_history", "username")
+            )
             if not user_data:
                 return render_template(
                     "login.html",
@@ -458,12 +499,11 @@ def settings():
             template_data["data"] = db_manager.get_settings()
             
             # Load proxies
-            proxies_path = Path(config.files.proxies_file)
-            template_data["proxies"] = load_json_file(proxies_path, [])
+            template_data["proxies"] = ai_service.proxy_pool.get_proxies()
             
             # Load users for virtual users feature
             if server_manager.args.enable_virtual_users:
-                template_data["users_data"] = db_manager.get_all_users()
+                template_data["users_data"] = db_manager.get_all_users(fields=("token", "username"))
         else:
             # User settings
             template_data["data"] = user_data
@@ -543,7 +583,9 @@ def save_settings():
                 
                 filename = safe_filename(file.filename)
                 file_path = Path(app.config['UPLOAD_FOLDER']) / filename
-                file.save(str(file_path))
+                # Requests in flight must never read a half-written cookie file
+                atomic_write_bytes(file_path, file.read())
+                cookie_store.invalidate(str(file_path))
                 settings_update["cookie_file"] = str(file_path)
         
         # Handle proxies
@@ -561,13 +603,16 @@ def save_settings():
                         proxies.append(proxy_dict)
                 i += 1
             
-            # Save proxies to file
-            proxies_path = Path(config.files.proxies_file)
-            save_json_file(proxies_path, proxies)
+            # Save proxies to file (atomically) and reload the proxy pool
+            ai_service.proxy_pool.save(proxies)
+            if config.proxy.probe_on_save and proxies:
+                ai_service.probe_proxies()
         
         # Handle virtual users
         if request.form.get("virtual_users") == "true":
-            current_users = {user["token"]: user["username"] for user in db_manager.get_all_users()}
+            current_users = {
+                user["token"]: user["username"] for user in db_manager.get_all_users(fields=("token", "username"))
+            }
             form_users = {}
             
             # Extract user data from form
@@ -584,11 +629,14 @@ def save_settings():
                     except ValidationError as e:
                         logger.warning(f"Could not create user '{username}': {e}")
             
+            # Queued chat messages must be stored under the old names before renames and deletes
+            history_cache.flush()
+            
             # Update existing users
             for token, username in form_users.items():
                 if token in current_users and username != current_users[token]:
                     try:
-                        user = db_manager.get_user_by_token(token)
+                        user = db_manager.get_user_by_token(token, fields=("username",))
                         if user:
                             db_manager.update_user_settings(user["username"], {"username": username})
                     except Exception as e:
@@ -598,7 +646,7 @@ def save_settings():
             for token in current_users:
                 if token not in form_users:
                     try:
-                        user = db_manager.get_user_by_token(token)
+                        user = db_manager.get_user_by_token(token, fields=("username",))
                         if user:
                             db_manager.delete_user(user["username"])
                     except Exception as e:
@@ -676,6 +724,42 @@ def get_models():
     provider = request.args.get("provider", "Auto")
     return jsonify(ai_service.get_available_models(provider))
 
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Get response cache statistics."""
+    if server_manager.args.private_mode and not auth_service.verify_token_access(
+        request.args.get("token"), server_manager.args.private_mode
+    ):
+        return jsonify({"error": "Invalid token"}), 401
+    stats = ai_service.response_cache.get_stats()
+    stats["coalesced_requests"] = ai_service.coalesced_requests
+    return jsonify(stats)
+
+@app.route("/history/search", methods=["GET"])
+def search_history():
+    """Search the chat history of the token's user."""
+    # Histories are private, so a token is required even outside private mode
+    username = auth_service.get_username_by_token(request.args.get("token"))
+    if not username:
+        return jsonify({"error": "Invalid token"}), 401
+    
+    query = sanitize_input(request.args.get("q", ""), 500)
+    if not query:
+        raise ValidationError("Missing search query")
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        raise ValidationError("limit and offset must be integers")
+    
+    results, has_more = db_manager.search_messages(username, query, limit=limit, offset=offset)
+    return jsonify({
+        "query": query,
+        "results": results,
+        "offset": offset,
+        "next_offset": offset + len(results) if has_more else None
+    })
+
 @app.route("/generatetoken", methods=["GET", "POST"])
 def generate_token():
     """Generate a new token."""
@@ -702,6 +786,11 @@ def main():
         arg_parser = ServerArgumentParser()
         args = arg_parser.parse_args()
         
+        if args.compress_history:
+            db_manager.compress_messages()
+            db_manager.close()
+            return
+        
         # Initialize server manager
         global server_manager
         server_manager = ServerManager(args)
@@ -709,6 +798,24 @@ def main():
         # Set up password if needed
         server_manager.setup_password()
         
+        # Finish queued database calls, store queued chat messages, then close
+        # pooled connections last (exit handlers run in reverse order)
+        atexit.register(db_manager.close)
+        atexit.register(history_cache.flush)
+        atexit.register(async_db_manager.shutdown)
+        
+        # Restore provider health from the last run and keep it snapshotted
+        provider_state.restore()
+        provider_state.start()
+        
+        # Prune chat history past its retention limits and compact the database when quiet
+        history_maintenance.start()
+        
+        # Warm up provider health data and upstream connections in the background
+        server_manager.start_health_prober()
+        ai_service.prewarm_connections()
+        atexit.register(ai_service.shutdown)
+        
         logger.info(f"Server configuration:")
         logger.info(f"  Port: {args.port}")
         logger.info(f"  Provider: {args.provider}")
@@ -718,6 +825,7 @@ def main():
         logger.info(f"  History enabled: {args.enable_history}")
         logger.info(f"  Proxies enabled: {args.enable_proxies}")
         logger.info(f"  Virtual users: {args.enable_virtual_users}")
+        logger.info(f"  Health probe: {args.enable_health_probe or config.probe.enabled}")
         
         # Start server
         app.run(
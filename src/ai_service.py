@@ -1,32 +1,254 @@
 """AI service for handling GPT interactions."""
 
-import json
+import asyncio
+import concurrent.futures
+import inspect
 import random
+import threading
+import time
+from dataclasses import dataclass
 from typing import Dict, List, Any, Optional, AsyncGenerator
-from pathlib import Path
 
 import g4f
 
 from config import config
-from database import db_manager
+from database import async_db_manager, db_manager
+from history_cache import history_cache
+from request_context import RequestContext, resolve_request_context
+from response_cache import response_cache
 from utils.exceptions import AIProviderError, ValidationError
 from utils.logging import logger
-from utils.http_utils import safe_api_call, TimeoutConfig
-from utils.helpers import (
-    load_json_file, 
-    clean_response_sources, 
-    select_random_proxy,
-    create_dummy_cookies
-)
+from utils.http_utils import safe_api_call, classify_error, extract_retry_after, TimeoutConfig
+from utils.helpers import clean_response_sources
 from utils.provider_monitor import provider_monitor
+from utils.cookies import CookieJar, CookiePool, cookie_store
+from utils.proxy_pool import ProxyPool
+from utils.session_pool import SessionPool
 from utils.validation import validate_provider, validate_model
 
+# Failures that say something about the proxy rather than the provider
+PROXY_ERROR_TYPES = ("timeout", "network")
+
+@dataclass
+class AIResponse:
+    """AI response text with how it was produced."""
+    text: str
+    cache_status: str = "MISS"   # HIT, STALE, MISS or BYPASS
+    cache_age: Optional[float] = None
+    coalesced: bool = False      # Shared the upstream call of an identical in-flight request
+    similarity: Optional[float] = None  # Match score when served for a near-duplicate prompt
+    stale_reason: Optional[str] = None  # "revalidating" or "error" when a stale answer was served
+
 class AIService:
     """Service for handling AI interactions."""
     
     def __init__(self):
         self.db = db_manager
+        self.async_db = async_db_manager  # Runs blocking database work off the event loop
         self.config = config
+        self.response_cache = response_cache
+        self.history_cache = history_cache
+        self.cookie_pool = CookiePool(config.files.cookie_pool_dir)
+        self.proxy_pool = ProxyPool(
+            config.files.proxies_file,
+            strategy=config.proxy.strategy,
+            eject_after=config.proxy.eject_after,
+            eject_cooldown=config.proxy.eject_cooldown,
+            probe_target=config.proxy.probe_target,
+            probe_timeout=config.proxy.probe_timeout
+        )
+        self.session_pool = SessionPool(
+            max_size=config.session_pool.max_size,
+            idle_timeout=config.session_pool.idle_timeout,
+            limit_per_host=config.session_pool.limit_per_host
+        )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._connector_support: Dict[Any, bool] = {}
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        self._inflight_lock = threading.Lock()
+        self.coalesced_requests = 0
+    
+    def get_service_loop(self) -> asyncio.AbstractEventLoop:
+        """Get the long-lived event loop for background work and shared upstream calls.
+        
+        Background refreshes, health probes and proxy probes run here. With
+        session_pool.shared_loop, calls to providers that take a pooled
+        connector run here too, so their keep-alive connections outlive the
+        per-request loop.
+        
+        Returns:
+            Running service event loop
+        """
+        with self._loop_lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="ai-service-loop", daemon=True).start()
+            return self._loop
+    
+    async def _run_on_service_loop(self, coro):
+        """Await a coroutine on the service loop from any other loop."""
+        loop = self.get_service_loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        
+        if running is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+    
+    def prewarm_connections(self):
+        """Open connections to the top-ranked providers in the background."""
+        if not (self.config.session_pool.shared_loop and self.config.session_pool.prewarm):
+            return
+        
+        try:
+            providers = self.config.available_providers
+            ranked = provider_monitor.get_reliable_providers(providers)[:self.config.session_pool.prewarm_providers]
+            urls = {name: getattr(providers[name], "url", None) for name in ranked}
+        except Exception as e:
+            logger.warning(f"Could not select providers to pre-warm: {e}")
+            return
+        
+        if urls:
+            logger.info(f"Pre-warming connections to: {', '.join(urls)}")
+            asyncio.run_coroutine_threadsafe(self.session_pool.prewarm(urls), self.get_service_loop())
+    
+    def probe_proxies(self):
+        """Check the connectivity of every configured proxy in the background.
+        
+        Unreachable proxies are ejected from the proxy pool for its cooldown.
+        """
+        async def run_probe():
+            results = await self.proxy_pool.probe()
+            reachable = sum(1 for ok in results.values() if ok)
+            logger.info(f"Proxy probe: {reachable}/{len(results)} proxies reachable")
+        
+        asyncio.run_coroutine_threadsafe(run_probe(), self.get_service_loop())
+    
+    def shutdown(self):
+        """Close pooled connections and stop the service loop."""
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is None or loop.is_closed():
+            return
+        
+        try:
+            asyncio.run_coroutine_threadsafe(self.session_pool.close(), loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"Could not close pooled connections: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+    
+    async def _call_coalesced(self, key: Optional[str], **call_args) -> tuple:
+        """Call the AI API, sharing one upstream call among identical in-flight requests.
+        
+        Callers may run on different event loops (one per Flask request): the
+        first caller makes the upstream call in a task on its own loop and the
+        others wait on a thread-safe future, so a cancelled caller does not
+        cancel the call for the others. The task does not outlive the first
+        caller's loop, though: when that request ends early (e.g. it is
+        cancelled) and its loop is closed, the call is cancelled and every
+        waiter falls back to making the call itself (one of them leading again).
+        
+        Args:
+            key: Request key (None disables coalescing)
+            **call_args: Arguments for _call_ai_api
+            
+        Returns:
+            Tuple of (response text, whether the call was shared)
+        """
+        if key is None:
+            return await self._call_ai_api(**call_args), False
+        
+        with self._inflight_lock:
+            shared = self._inflight.get(key)
+            coalesced = shared is not None
+            if coalesced:
+                self.coalesced_requests += 1
+            else:
+                shared = self._inflight[key] = concurrent.futures.Future()
+        
+        if coalesced:
+            logger.debug(f"Joining in-flight request {key[:12]}")
+            try:
+                return await asyncio.shield(asyncio.wrap_future(shared)), True
+            except asyncio.CancelledError:
+                if not shared.cancelled():
+                    raise  # This caller was cancelled, not the shared call
+                logger.debug(f"In-flight request {key[:12]} was cancelled with its loop, calling again")
+                return await self._call_coalesced(key, **call_args)
+        
+        task = asyncio.ensure_future(self._call_ai_api(**call_args))
+        
+        def publish(done: asyncio.Task):
+            with self._inflight_lock:
+                if self._inflight.get(key) is shared:
+                    del self._inflight[key]
+            if done.cancelled():
+                shared.cancel()
+            elif done.exception() is not None:
+                shared.set_exception(done.exception())
+            else:
+                shared.set_result(done.result())
+        
+        task.add_done_callback(publish)
+        return await asyncio.shield(task), False
+    
+    async def _revalidate(
+        self,
+        cache_key: str,
+        cache_scope: str,
+        message: str,
+        remove_sources: bool,
+        **call_args
+    ):
+        """Refresh a stale cached answer in the background.
+        
+        Runs on the service loop; joins an identical in-flight request if any.
+        
+        Args:
+            cache_key: Cache key of the stale answer
+            cache_scope: Near-duplicate scope of the answer
+            message: Latest user message
+            remove_sources: Whether sources are stripped from the answer
+            **call_args: Arguments for _call_ai_api
+        """
+        try:
+            response_text, coalesced = await self._call_coalesced(cache_key, **call_args)
+        except Exception as e:
+            logger.warning(f"Background refresh of cached response failed: {e}")
+            return
+        
+        if coalesced:
+            return  # The request we joined stores the answer
+        if remove_sources:
+            response_text = clean_response_sources(response_text)
+        await self.async_db.run(
+            self.response_cache.put,
+            cache_key, response_text, call_args["provider"], call_args["model"],
+            scope=cache_scope, prompt=message
+        )
+        logger.debug(f"Refreshed cached response {cache_key[:12]}")
+    
+    def _uses_service_loop(self, ai_provider) -> bool:
+        """Check whether calls to a provider run on the shared service loop with a pooled connector."""
+        return (
+            self.config.session_pool.shared_loop
+            and ai_provider is not None
+            and self._accepts_connector(ai_provider)
+        )
+    
+    def _accepts_connector(self, ai_provider) -> bool:
+        """Check whether a provider accepts an aiohttp connector argument."""
+        if ai_provider not in self._connector_support:
+            try:
+                method = getattr(ai_provider, "create_async_generator", None) or getattr(ai_provider, "create_async")
+                supported = "connector" in inspect.signature(method).parameters
+            except (AttributeError, TypeError, ValueError):
+                supported = False
+            self._connector_support[ai_provider] = supported
+        return self._connector_support[ai_provider]
     
     async def generate_response(
         self,
@@ -38,10 +260,47 @@ class AIService:
         use_history: bool = False,
         remove_sources: bool = True,
         use_proxies: bool = False,
-        cookie_file: Optional[str] = None
+        cookie_file: Optional[str] = None,
+        context: Optional[RequestContext] = None
     ) -> str:
         """Generate AI response.
         
+        See generate_response_with_meta for the arguments.
+        
+        Returns:
+            AI response text
+        """
+        result = await self.generate_response_with_meta(
+            message=message,
+            username=username,
+            provider=provider,
+            model=model,
+            system_prompt=system_prompt,
+            use_history=use_history,
+            remove_sources=remove_sources,
+            use_proxies=use_proxies,
+            cookie_file=cookie_file,
+            context=context
+        )
+        return result.text
+    
+    async def generate_response_with_meta(
+        self,
+        message: str,
+        username: str = "admin",
+        provider: Optional[str] = None,
+        model: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        use_history: bool = False,
+        remove_sources: bool = True,
+        use_proxies: bool = False,
+        cookie_file: Optional[str] = None,
+        read_cache: bool = True,
+        write_cache: bool = True,
+        context: Optional[RequestContext] = None
+    ) -> AIResponse:
+        """Generate AI response, serving stateless prompts from the response cache.
+        
         Args:
             message: User message
             username: Username for context
@@ -52,79 +311,139 @@ class AIService:
             remove_sources: Whether to remove source references
             use_proxies: Whether to use proxies
             cookie_file: Cookie file path
+            read_cache: Whether a cached answer may be returned
+            write_cache: Whether a fresh answer may be cached
+            context: Request context already resolved by the caller (resolved
+                here from username and the overrides if not given)
             
         Returns:
-            AI response text
+            AI response with cache status
             
         Raises:
             AIProviderError: If AI generation fails
             ValidationError: If parameters are invalid
         """
         try:
-            # Get user settings
-            if username == "admin":
-                settings = self.db.get_settings()
-                user_settings = {
-                    "provider": provider or settings.get("provider", self.config.api.default_provider),
-                    "model": model or settings.get("model", self.config.api.default_model),
-                    "system_prompt": system_prompt or settings.get("system_prompt", ""),
-                    "message_history": use_history and settings.get("message_history", False)
-                }
-            else:
-                user_data = self.db.get_user_by_username(username)
-                if not user_data:
-                    raise ValidationError(f"User '{username}' not found")
-                
-                user_settings = {
-                    "provider": provider or user_data.get("provider", self.config.api.default_provider),
-                    "model": model or user_data.get("model", self.config.api.default_model),
-                    "system_prompt": system_prompt or user_data.get("system_prompt", ""),
-                    "message_history": use_history and user_data.get("message_history", False)
-                }
+            # Resolve user, effective settings and history once
+            if context is None:
+                context = await self.async_db.run(
+                    resolve_request_context,
+                    username=username,
+                    use_history=use_history,
+                    provider=provider,
+                    model=model,
+                    system_prompt=system_prompt,
+                    db=self.db
+                )
+            username = context.username
             
             # Validate provider and model
-            is_valid, error_msg = validate_provider(user_settings["provider"], self.config.available_providers)
+            is_valid, error_msg = validate_provider(context.provider, self.config.available_providers)
             if not is_valid:
                 raise ValidationError(error_msg)
             
-            is_valid, error_msg = validate_model(user_settings["model"])
+            is_valid, error_msg = validate_model(context.model)
             if not is_valid:
                 raise ValidationError(error_msg)
             
             # Prepare chat history
-            chat_history = self._prepare_chat_history(
+            chat_history = await self._prepare_chat_history(
                 message=message,
                 username=username,
-                system_prompt=user_settings["system_prompt"],
-                use_history=user_settings["message_history"]
+                system_prompt=context.system_prompt,
+                use_history=context.message_history
             )
             
+            # Only stateless prompts are cacheable: their answer depends on nothing but the key
+            cache_key = cache_scope = None
+            if not context.message_history:
+                cache_key = self.response_cache.make_key(
+                    chat_history, context.provider, context.model, remove_sources
+                )
+                cache_scope = self.response_cache.make_key(
+                    chat_history[:-1], context.provider, context.model, remove_sources
+                )
+                if read_cache:
+                    cached = await self.async_db.run(
+                        self.response_cache.get,
+                        cache_key, max_stale=self.response_cache.config.stale_while_revalidate
+                    )
+                    if cached is not None and self.response_cache.is_fresh(cached):
+                        logger.info(f"Serving cached AI response for user '{username}'")
+                        return AIResponse(cached.response, cache_status="HIT", cache_age=cached.age)
+                    
+                    if cached is not None:
+                        logger.info(f"Serving stale AI response for user '{username}', refreshing in the background")
+                        asyncio.run_coroutine_threadsafe(self._revalidate(
+                            cache_key,
+                            cache_scope,
+                            message,
+                            chat_history=chat_history,
+                            provider=context.provider,
+                            model=context.model,
+                            cookies=self._load_cookies(cookie_file),
+                            proxy=self._get_proxy(context.provider) if use_proxies else None,
+                            remove_sources=remove_sources
+                        ), self.get_service_loop())
+                        return AIResponse(
+                            cached.response, cache_status="STALE", cache_age=cached.age, stale_reason="revalidating"
+                        )
+                    
+                    similar = await self.async_db.run(self.response_cache.get_similar, cache_scope, message)
+                    if similar is not None:
+                        cached, score = similar
+                        logger.info(f"Serving cached AI response for near-duplicate prompt (similarity {score:.2f}) for user '{username}'")
+                        return AIResponse(cached.response, cache_status="HIT", cache_age=cached.age, similarity=score)
+            
             # Prepare cookies
             cookies = self._load_cookies(cookie_file)
             
             # Prepare proxy
-            proxy = self._get_proxy() if use_proxies else None
-            
-            # Generate response
-            response_text = await self._call_ai_api(
-                chat_history=chat_history,
-                provider=user_settings["provider"],
-                model=user_settings["model"],
-                cookies=cookies,
-                proxy=proxy
-            )
+            proxy = self._get_proxy(context.provider) if use_proxies else None
+            
+            # Generate response (identical stateless requests in flight share one upstream call)
+            try:
+                response_text, coalesced = await self._call_coalesced(
+                    cache_key,
+                    chat_history=chat_history,
+                    provider=context.provider,
+                    model=context.model,
+                    cookies=cookies,
+                    proxy=proxy
+                )
+            except AIProviderError:
+                # Every provider failed: an old answer beats an error
+                stale = None
+                if cache_key and read_cache:
+                    stale = await self.async_db.run(self.response_cache.get_stale_if_error, cache_key)
+                if stale is None:
+                    raise
+                logger.warning(f"All providers failed, serving stale AI response for user '{username}'")
+                return AIResponse(stale.response, cache_status="STALE", cache_age=stale.age, stale_reason="error")
             
             # Clean response if needed
             if remove_sources:
                 response_text = clean_response_sources(response_text)
             
             # Save chat history if enabled
-            if user_settings["message_history"]:
-                chat_history.append({"role": "assistant", "content": response_text})
-                self.db.save_chat_history(username, json.dumps(chat_history))
+            if context.message_history:
+                # Only the new turn is written
+                new_turn = [chat_history[-1], {"role": "assistant", "content": response_text}]
+                await self.async_db.run(self.history_cache.append, username, new_turn)
             
-            logger.info(f"AI response generated for user '{username}' using provider '{user_settings['provider']}'")
-            return response_text
+            elif cache_key and write_cache and not coalesced:
+                await self.async_db.run(
+                    self.response_cache.put,
+                    cache_key, response_text, context.provider, context.model,
+                    scope=cache_scope, prompt=message
+                )
+            
+            logger.info(f"AI response generated for user '{username}' using provider '{context.provider}'")
+            return AIResponse(
+                response_text,
+                cache_status="MISS" if cache_key and read_cache and self.response_cache.config.enabled else "BYPASS",
+                coalesced=coalesced
+            )
             
         except (ValidationError, AIProviderError):
             raise
@@ -132,7 +451,7 @@ class AIService:
             logger.error(f"Failed to generate AI response: {e}")
             raise AIProviderError(f"AI generation failed: {e}")
     
-    def _prepare_chat_history(
+    async def _prepare_chat_history(
         self,
         message: str,
         username: str,
@@ -145,7 +464,7 @@ class AIService:
             message: Current user message
             username: Username
             system_prompt: System prompt
-            use_history: Whether to load previous history
+            use_history: Whether to include previous history
             
         Returns:
             List of chat messages
@@ -158,57 +477,41 @@ class AIService:
         
         # Load previous history if enabled
         if use_history:
-            history_json = self.db.get_chat_history(username)
-            if history_json:
-                try:
-                    previous_history = json.loads(history_json)
-                    # Remove system prompt from previous history to avoid duplication
-                    previous_history = [msg for msg in previous_history if msg.get("role") != "system"]
-                    chat_history.extend(previous_history)
-                except json.JSONDecodeError:
-                    logger.warning(f"Invalid chat history JSON for user '{username}'")
+            # Kept in memory and only topped up with messages added since the last turn
+            chat_history.extend(await self.async_db.run(self.history_cache.get_messages, username))
         
         # Add current message
         chat_history.append({"role": "user", "content": message})
         
         return chat_history
     
-    def _load_cookies(self, cookie_file: Optional[str]) -> Dict[str, str]:
+    def _load_cookies(self, cookie_file: Optional[str]) -> CookieJar:
         """Load cookies from file.
         
+        Jars are cached per file and only re-read when the file changes.
+        
         Args:
             cookie_file: Path to cookie file
             
         Returns:
-            Dictionary of cookies
+            Cookie jar with per-provider cookie sets
         """
-        if not cookie_file:
-            return create_dummy_cookies()
-        
-        cookie_path = Path(cookie_file)
-        cookies = load_json_file(cookie_path, {})
-        
-        if not cookies:
-            logger.warning(f"No cookies found in {cookie_file}, using dummy cookies")
-            return create_dummy_cookies()
-        
-        logger.debug(f"Loaded {len(cookies)} cookies from {cookie_file}")
-        return cookies
+        return cookie_store.get_jar(cookie_file)
     
-    def _get_proxy(self) -> Optional[str]:
-        """Get random proxy from configuration.
+    def _get_proxy(self, provider: Optional[str] = None) -> Optional[str]:
+        """Get the healthiest proxy for a provider from the proxy pool.
+        
+        Args:
+            provider: Requested provider
         
         Returns:
             Proxy URL or None
         """
-        proxies_path = Path(self.config.files.proxies_file)
-        proxies = load_json_file(proxies_path, [])
-        
-        if not proxies:
+        proxy_url = self.proxy_pool.select(provider)
+        if not proxy_url:
             logger.warning("No proxies configured")
             return None
         
-        proxy_url = select_random_proxy(proxies)
         if proxy_url:
             logger.debug(f"Using proxy: {proxy_url.split('@')[0]}@***")  # Mask credentials
         
@@ -219,7 +522,7 @@ class AIService:
         chat_history: List[Dict[str, str]],
         provider: str,
         model: str,
-        cookies: Dict[str, str],
+        cookies: CookieJar,
         proxy: Optional[str]
     ) -> str:
         """Call AI API to generate response.
@@ -228,7 +531,7 @@ class AIService:
             chat_history: Chat message history
             provider: AI provider
             model: AI model
-            cookies: Request cookies
+            cookies: Cookie jar (each provider gets its own cookie set)
             proxy: Proxy URL
             
         Returns:
@@ -250,21 +553,17 @@ class AIService:
             ai_provider = self.config.available_providers.get(provider)
             if ai_provider:
                 logger.info(f"Attempting with provider: {provider}")
-                response = await self._make_api_call(chat_history, ai_provider, model, cookies, proxy, provider)
+                response = await self._make_api_call(
+                    chat_history, ai_provider, model, cookies.for_provider(provider), proxy, provider
+                )
                 if response:
-                    provider_monitor.record_success(provider)
                     return response
-                else:
-                    provider_monitor.record_failure(provider, "no_response")
         
         # Try Auto mode
         logger.info("Attempting with Auto mode")
-        response = await self._make_api_call(chat_history, None, model, cookies, proxy, "Auto")
+        response = await self._make_api_call(chat_history, None, model, cookies.for_provider("Auto"), proxy, "Auto")
         if response:
-            provider_monitor.record_success("Auto")
             return response
-        else:
-            provider_monitor.record_failure("Auto", "no_response")
         
         # Try reliable providers as fallback
         logger.warning("Auto mode failed, trying reliable providers")
@@ -273,13 +572,12 @@ class AIService:
                 ai_provider = self.config.available_providers.get(fallback_provider)
                 if ai_provider:
                     logger.info(f"Attempting reliable fallback: {fallback_provider}")
-                    response = await self._make_api_call(chat_history, ai_provider, model, cookies, proxy, fallback_provider)
+                    response = await self._make_api_call(
+                        chat_history, ai_provider, model, cookies.for_provider(fallback_provider), proxy, fallback_provider
+                    )
                     if response:
-                        provider_monitor.record_success(fallback_provider)
                         logger.info(f"Successfully used reliable fallback: {fallback_provider}")
                         return response
-                    else:
-                        provider_monitor.record_failure(fallback_provider, "no_response")
             except Exception as e:
                 provider_monitor.record_failure(fallback_provider, "exception")
                 logger.warning(f"Reliable fallback {fallback_provider} failed: {e}")
@@ -297,13 +595,12 @@ class AIService:
                 ai_provider = self.config.available_providers.get(fallback_provider)
                 if ai_provider:
                     logger.info(f"Attempting healthy fallback: {fallback_provider}")
-                    response = await self._make_api_call(chat_history, ai_provider, model, cookies, proxy, fallback_provider)
+                    response = await self._make_api_call(
+                        chat_history, ai_provider, model, cookies.for_provider(fallback_provider), proxy, fallback_provider
+                    )
                     if response:
-                        provider_monitor.record_success(fallback_provider)
                         logger.info(f"Successfully used healthy fallback: {fallback_provider}")
                         return response
-                    else:
-                        provider_monitor.record_failure(fallback_provider, "no_response")
             except Exception as e:
                 provider_monitor.record_failure(fallback_provider, "exception")
                 logger.warning(f"Healthy fallback {fallback_provider} failed: {e}")
@@ -322,10 +619,18 @@ class AIService:
         model: str,
         cookies: Dict[str, str],
         proxy: Optional[str],
-        provider_name: str = "Unknown"
+        provider_name: str = "Unknown",
+        timeout: float = TimeoutConfig.DEFAULT_TIMEOUT,
+        probe: bool = False
     ) -> Optional[str]:
         """Make a single API call to g4f.
         
+        The outcome (success with latency, or each failed attempt) is recorded
+        in the provider monitor, which also bounds how many calls may be in
+        flight to the provider at once. Health probes only record their
+        outcome: they take no concurrency slot or pooled account and put
+        nothing on cooldown.
+        
         Args:
             chat_history: Chat message history
             ai_provider: AI provider object or None for Auto
@@ -333,6 +638,9 @@ class AIService:
             cookies: Request cookies
             proxy: Proxy URL
             provider_name: Name of provider for logging
+            timeout: Timeout in seconds for each attempt
+            probe: Whether this is a synthetic health probe (recorded separately, never retried,
+                no side effects on accounts, slots or cooldowns)
             
         Returns:
             AI response text or None if failed
@@ -346,7 +654,7 @@ class AIService:
                     cookies=cookies,
                     proxy=proxy
                 )
-            else:
+            elif not self._uses_service_loop(ai_provider):
                 return await g4f.ChatCompletion.create_async(
                     model=model,
                     provider=ai_provider,
@@ -354,17 +662,87 @@ class AIService:
                     cookies=cookies,
                     proxy=proxy
                 )
+            
+            # Pooled connectors belong to the service loop, so the whole call runs there
+            async def shared_request():
+                extra = {}
+                connector = self.session_pool.get_connector(provider_name, proxy)
+                if connector is not None:
+                    extra["connector"] = connector
+                response = await g4f.ChatCompletion.create_async(
+                    model=model,
+                    provider=ai_provider,
+                    messages=chat_history,
+                    cookies=cookies,
+                    proxy=proxy,
+                    **extra
+                )
+                if hasattr(response, "__aiter__"):
+                    return "".join([str(chunk) async for chunk in response])
+                return response
+            
+            return await self._run_on_service_loop(shared_request())
+        
+        errors = []
+        cookie_cooldowns = []
+        cookie_set = None
+        succeeded = False
+        
+        def apply_cooldown(error_type: str, error: BaseException):
+            # Auto rotates through providers itself: one of them being limited says nothing about the next
+            if ai_provider is None:
+                return
+            # With pooled cookies the account is limited, not the whole provider
+            if error_type == "rate_limited":
+                wait = extract_retry_after(error) or TimeoutConfig.RATE_LIMIT_COOLDOWN
+            elif error_type == "unauthorized" and cookie_set is not None:
+                wait = TimeoutConfig.UNAUTHORIZED_COOLDOWN
+            else:
+                return
+            if cookie_set is not None:
+                cookie_cooldowns.append(wait)
+            else:
+                provider_monitor.mark_unavailable(provider_name, wait, proxy=proxy, reason=str(error)[:200])
+        
+        def on_error(error_type: str, error: BaseException):
+            errors.append(error_type)
+            # The start time keeps retries and concurrent calls to one cut per congestion window
+            provider_monitor.record_failure(provider_name, error_type, probe=probe, started=started)
+            if not probe:
+                apply_cooldown(error_type, error)
+        
+        if not provider_monitor.is_available(provider_name, proxy):
+            remaining = provider_monitor.get_cooldown_remaining(provider_name, proxy)
+            logger.info(f"Provider {provider_name} is rate limited for another {remaining:.0f}s, skipping")
+            return None
+        
+        if not probe and not provider_monitor.try_acquire(provider_name):
+            logger.info(f"Provider {provider_name} is at its concurrency limit, skipping")
+            return None
         
+        started = time.monotonic()
         try:
+            # Rotate across the accounts in the cookie pool, if it has any for this provider
+            if not probe and ai_provider is not None and self.cookie_pool.has_sets(provider_name):
+                cookie_set = self.cookie_pool.acquire(provider_name)
+                if cookie_set is None:
+                    logger.info(f"All cookie sets for {provider_name} are cooling down, skipping")
+                    return None
+                cookies = dict(cookie_set.cookies)
+            
             # Use safe_api_call with timeout and retry logic
             response = await safe_api_call(
                 make_request,
-                timeout=TimeoutConfig.DEFAULT_TIMEOUT,
-                max_retries=1  # Only 1 retry per provider to fail fast
+                timeout=timeout,
+                max_retries=0 if probe else 1,  # Only 1 retry per provider to fail fast
+                on_error=on_error
             )
             
             if response is None:
                 logger.warning(f"Provider {provider_name} returned no response")
+                if not errors:
+                    errors.append("no_response")
+                    provider_monitor.record_failure(provider_name, "no_response", probe=probe)
                 return None
             
             # Collect response
@@ -373,7 +751,6 @@ class AIService:
             # Handle both string responses and async generators
             if hasattr(response, '__aiter__'):
                 # It's an async generator
-                import asyncio
                 try:
                     async for chunk in response:
                         response_text += str(chunk)
@@ -381,6 +758,7 @@ class AIService:
                         await asyncio.sleep(0.001)
                 except Exception as e:
                     logger.warning(f"Error reading streaming response from {provider_name}: {e}")
+                    on_error(classify_error(e), e)
                     return None
             else:
                 # It's already a string
@@ -388,33 +766,51 @@ class AIService:
             
             if not response_text or response_text.strip() == "":
                 logger.warning(f"Empty response from provider {provider_name}")
+                errors.append("no_response")
+                provider_monitor.record_failure(provider_name, "no_response", probe=probe)
                 return None
             
+            succeeded = True
+            provider_monitor.record_success(provider_name, latency=time.monotonic() - started, probe=probe)
             logger.debug(f"Received response of {len(response_text)} characters from {provider_name}")
             return response_text
             
         except Exception as e:
-            error_msg = str(e).lower()
-            error_type = "unknown"
+            error_type = classify_error(e)
             
-            if "401" in error_msg or "unauthorized" in error_msg:
-                error_type = "unauthorized"
+            if error_type == "unauthorized":
                 logger.warning(f"Provider {provider_name} returned unauthorized error: {e}")
-            elif "chrome" in error_msg or "browser" in error_msg:
-                error_type = "browser_required"
+            elif error_type == "browser_required":
                 logger.warning(f"Provider {provider_name} requires browser but none found: {e}")
-            elif "timeout" in error_msg or "too slow" in error_msg:
-                error_type = "timeout"
+            elif error_type == "rate_limited":
+                logger.warning(f"Provider {provider_name} rate limited: {e}")
+            elif error_type == "timeout":
                 logger.warning(f"Provider {provider_name} connection timeout: {e}")
-            elif "connection" in error_msg or "network" in error_msg:
-                error_type = "network"
+            elif error_type == "network":
                 logger.warning(f"Provider {provider_name} network error: {e}")
             else:
                 logger.warning(f"Provider {provider_name} failed with error: {e}")
             
             # Record failure in monitor
-            provider_monitor.record_failure(provider_name, error_type)
+            on_error(error_type, e)
             return None
+        finally:
+            if not probe:
+                provider_monitor.release(provider_name)
+            if proxy and not probe and (succeeded or (errors and errors[-1] in PROXY_ERROR_TYPES)):
+                self.proxy_pool.record(
+                    proxy,
+                    provider_name,
+                    succeeded,
+                    latency=time.monotonic() - started if succeeded else None,
+                    error_type=None if succeeded else errors[-1]
+                )
+            if cookie_set is not None:
+                self.cookie_pool.release(
+                    cookie_set,
+                    error_type=None if succeeded else (errors[-1] if errors else "unknown"),
+                    cooldown=max(cookie_cooldowns) if cookie_cooldowns and not succeeded else None
+                )
     
     def get_available_models(self, provider: str) -> List[str]:
         """Get available models for a provider.
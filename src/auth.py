@@ -51,25 +51,41 @@ class AuthService:
         Returns:
             User data or None if not found/invalid
         """
-        if not validate_token_format(token):
+        username = self.get_username_by_token(token)
+        if username is None:
             return None
         
         # Check if it's admin token
-        settings = self.db.get_settings()
-        if settings.get("token") == token:
+        if username == "admin":
             return {
                 "username": "admin",
                 "token": token,
                 "is_admin": True
             }
         
-        # Check regular users
-        user = self.db.get_user_by_token(token)
+        # Check regular users (the password hash is not needed here)
+        user = self.db.get_user_by_token(
+            token, fields=("token", "provider", "model", "system_prompt", "message_history", "username")
+        )
         if user:
             user["is_admin"] = False
         
         return user
     
+    def get_username_by_token(self, token: str) -> Optional[str]:
+        """Get the username a token belongs to from the in-memory token index.
+        
+        Args:
+            token: User token
+            
+        Returns:
+            Username ('admin' for the admin token) or None if not found/invalid
+        """
+        if not token or not validate_token_format(token):
+            return None
+        
+        return self.db.get_username_by_token(token)
+    
     def verify_token_access(self, token: str, private_mode: bool = False) -> Optional[str]:
         """Verify token access and return username.
         
@@ -86,8 +102,7 @@ class AuthService:
         if not token:
             return "admin" if not private_mode else None
         
-        user = self.get_user_by_token(token)
-        return user["username"] if user else None
+        return self.get_username_by_token(token)
 
 def require_auth(admin_only: bool = False):
     """Decorator to require authentication.
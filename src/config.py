@@ -18,6 +18,12 @@ DATA_DIR.mkdir(exist_ok=True)
 class DatabaseConfig:
     """Database configuration."""
     settings_file: str = str(DATA_DIR / "settings.db")
+    wal: bool = True                # Write-ahead log: readers never wait for a writer
+    synchronous: str = "NORMAL"     # Safe with WAL; only the last commits may be lost on power failure
+    busy_timeout: float = 5.0       # Seconds a write waits for another writer's lock
+    cached_statements: int = 256    # Prepared statements kept per connection
+    pool_size: int = 8              # Idle connections kept open for reuse
+    async_workers: int = 4          # Threads running database calls made from coroutines
     
 @dataclass
 class ServerConfig:
@@ -47,12 +53,88 @@ class FileConfig:
     upload_folder: str = str(DATA_DIR)
     cookies_file: str = str(DATA_DIR / "cookies.json")
     proxies_file: str = str(DATA_DIR / "proxies.json")
+    cookie_pool_dir: str = str(DATA_DIR / "cookie_pool")  # One cookie set per account and provider
     allowed_extensions: set = None
     
     def __post_init__(self):
         if self.allowed_extensions is None:
             self.allowed_extensions = {'json'}
 
+@dataclass
+class ProbeConfig:
+    """Background provider health probe configuration."""
+    enabled: bool = False
+    interval: float = 300.0          # Seconds between probe rounds
+    concurrency: int = 2             # Providers probed at the same time
+    max_probes_per_minute: int = 20  # Upper bound on canary traffic
+    timeout: float = 20.0            # Seconds before a probe counts as failed
+    prompt: str = "Reply with the single word OK."
+
+@dataclass
+class MonitorConfig:
+    """Provider monitor persistence configuration."""
+    snapshot_interval: float = 60.0   # Seconds between state snapshots
+    decay_half_life: float = 3600.0   # Restored counters count half after this many seconds
+    max_state_age: float = 86400.0    # Older snapshots are ignored on restore
+    shared: bool = False              # Share health between worker processes through settings.db
+    sync_interval: float = 1.0        # Seconds between shared state syncs
+
+@dataclass
+class SessionPoolConfig:
+    """Upstream connection pool configuration."""
+    max_size: int = 32            # Pooled connectors (one per provider/proxy pair)
+    idle_timeout: float = 90.0    # Seconds before an unused connector is closed
+    limit_per_host: int = 8       # Simultaneous connections per upstream host
+    shared_loop: bool = False     # Run calls to providers taking a pooled connector on one shared loop
+    prewarm: bool = True          # Open connections to top-ranked providers at startup (shared loop only)
+    prewarm_providers: int = 3    # How many top-ranked providers to pre-warm
+
+@dataclass
+class CacheConfig:
+    """Response cache configuration."""
+    enabled: bool = False           # Answer identical prompts from the cache (RESPONSE_CACHE)
+    ttl: float = 900.0              # Seconds a cached answer stays fresh
+    memory_entries: int = 1024      # In-memory LRU tier size
+    disk_entries: int = 20000       # Persistent SQLite tier size
+    prune_every: int = 100          # Stores between persistent tier prunes
+    stale_while_revalidate: float = 600.0  # Seconds past TTL served while refreshing in the background
+    stale_if_error: float = 86400.0        # Seconds past TTL served when every provider fails
+    similarity: bool = False        # Also serve near-duplicate prompts
+    similarity_threshold: float = 0.9
+    similarity_entries: int = 4096
+    similarity_max_chars: int = 4000  # Longer prompts only use exact matching
+    similarity_min_chars: int = 12    # Shorter prompts only use exact matching
+
+@dataclass
+class HistoryConfig:
+    """Chat history storage configuration."""
+    write_behind: bool = False        # Persist history in batches off the request path
+    flush_interval_ms: int = 200      # Longest time a message waits to be written
+    flush_messages: int = 256         # Pending messages that trigger an early write
+    max_pending_messages: int = 10000 # Writers wait once this many messages are pending
+    enqueue_timeout: float = 5.0      # Seconds a writer waits for room before failing
+    max_write_attempts: int = 5       # Failed writes of a message before it is dropped
+    compression: str = "zlib"         # Message compression: "zlib", "zstd" or "none"
+    compress_min_bytes: int = 256     # Shorter messages are stored uncompressed
+    max_messages_per_user: int = 0    # Oldest messages beyond this are pruned (0 keeps all)
+    max_age_days: float = 0.0         # Older messages are pruned (0 keeps all)
+    max_total_bytes: int = 0          # Oldest messages beyond this much content are pruned (0 keeps all)
+    retention_interval: float = 3600.0 # Seconds between pruning and compaction rounds
+    retention_batch: int = 200        # Messages deleted per transaction
+    quiet_seconds: float = 30.0       # Compaction waits for this long without database writes
+    cache_entries: int = 1024         # Users whose parsed chat history is kept in memory
+    cache_max_bytes: int = 64 * 1024 * 1024
+
+@dataclass
+class ProxyConfig:
+    """Proxy pool configuration."""
+    strategy: str = "weighted"        # "weighted" or "least_latency"
+    eject_after: int = 3              # Consecutive failures before a proxy is ejected
+    eject_cooldown: float = 300.0     # Seconds an ejected proxy is skipped
+    probe_on_save: bool = False       # Check connectivity of proxies when they are saved
+    probe_target: str = "www.google.com:443"  # Host:port requested through HTTP proxies
+    probe_timeout: float = 5.0
+
 class Config:
     """Main configuration class."""
     
@@ -62,6 +144,12 @@ class Config:
         self.security = SecurityConfig()
         self.api = APIConfig()
         self.files = FileConfig()
+        self.probe = ProbeConfig()
+        self.monitor = MonitorConfig()
+        self.session_pool = SessionPoolConfig()
+        self.cache = CacheConfig()
+        self.history = HistoryConfig()
+        self.proxy = ProxyConfig()
         
         # Load environment overrides
         self._load_env_overrides()
@@ -74,11 +162,97 @@ class Config:
         if os.getenv("DEBUG"):
             self.server.debug = os.getenv("DEBUG").lower() == "true"
             
+        # Database config
+        if os.getenv("DATABASE_WAL"):
+            self.database.wal = os.getenv("DATABASE_WAL").lower() == "true"
+        if os.getenv("DATABASE_BUSY_TIMEOUT"):
+            self.database.busy_timeout = float(os.getenv("DATABASE_BUSY_TIMEOUT"))
+            
+        # File config
+        if os.getenv("COOKIE_POOL_DIR"):
+            self.files.cookie_pool_dir = os.getenv("COOKIE_POOL_DIR")
+            
         # API config
         if os.getenv("DEFAULT_MODEL"):
             self.api.default_model = os.getenv("DEFAULT_MODEL")
         if os.getenv("DEFAULT_PROVIDER"):
             self.api.default_provider = os.getenv("DEFAULT_PROVIDER")
+        
+        # Health probe config
+        if os.getenv("HEALTH_PROBE"):
+            self.probe.enabled = os.getenv("HEALTH_PROBE").lower() == "true"
+        if os.getenv("HEALTH_PROBE_INTERVAL"):
+            self.probe.interval = float(os.getenv("HEALTH_PROBE_INTERVAL"))
+        if os.getenv("HEALTH_PROBE_CONCURRENCY"):
+            self.probe.concurrency = int(os.getenv("HEALTH_PROBE_CONCURRENCY"))
+        if os.getenv("HEALTH_PROBE_RATE"):
+            self.probe.max_probes_per_minute = int(os.getenv("HEALTH_PROBE_RATE"))
+        
+        # Provider monitor persistence config
+        if os.getenv("PROVIDER_STATE_INTERVAL"):
+            self.monitor.snapshot_interval = float(os.getenv("PROVIDER_STATE_INTERVAL"))
+        if os.getenv("PROVIDER_STATE_HALF_LIFE"):
+            self.monitor.decay_half_life = float(os.getenv("PROVIDER_STATE_HALF_LIFE"))
+        if os.getenv("PROVIDER_STATE_SHARED"):
+            self.monitor.shared = os.getenv("PROVIDER_STATE_SHARED").lower() == "true"
+        if os.getenv("PROVIDER_STATE_SYNC_INTERVAL"):
+            self.monitor.sync_interval = float(os.getenv("PROVIDER_STATE_SYNC_INTERVAL"))
+        
+        # Session pool config
+        if os.getenv("SESSION_POOL_SIZE"):
+            self.session_pool.max_size = int(os.getenv("SESSION_POOL_SIZE"))
+        if os.getenv("SESSION_IDLE_TIMEOUT"):
+            self.session_pool.idle_timeout = float(os.getenv("SESSION_IDLE_TIMEOUT"))
+        if os.getenv("SESSION_SHARED_LOOP"):
+            self.session_pool.shared_loop = os.getenv("SESSION_SHARED_LOOP").lower() == "true"
+        if os.getenv("SESSION_PREWARM"):
+            self.session_pool.prewarm = os.getenv("SESSION_PREWARM").lower() == "true"
+        
+        # Response cache config
+        if os.getenv("RESPONSE_CACHE"):
+            self.cache.enabled = os.getenv("RESPONSE_CACHE").lower() == "true"
+        if os.getenv("RESPONSE_CACHE_TTL"):
+            self.cache.ttl = float(os.getenv("RESPONSE_CACHE_TTL"))
+        if os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES"):
+            self.cache.memory_entries = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES"))
+        if os.getenv("RESPONSE_CACHE_DISK_ENTRIES"):
+            self.cache.disk_entries = int(os.getenv("RESPONSE_CACHE_DISK_ENTRIES"))
+        if os.getenv("RESPONSE_CACHE_STALE_WHILE_REVALIDATE"):
+            self.cache.stale_while_revalidate = float(os.getenv("RESPONSE_CACHE_STALE_WHILE_REVALIDATE"))
+        if os.getenv("RESPONSE_CACHE_STALE_IF_ERROR"):
+            self.cache.stale_if_error = float(os.getenv("RESPONSE_CACHE_STALE_IF_ERROR"))
+        if os.getenv("RESPONSE_CACHE_SIMILARITY"):
+            self.cache.similarity = os.getenv("RESPONSE_CACHE_SIMILARITY").lower() == "true"
+        if os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD"):
+            self.cache.similarity_threshold = float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD"))
+        
+        # Chat history storage config
+        if os.getenv("HISTORY_WRITE_BEHIND"):
+            self.history.write_behind = os.getenv("HISTORY_WRITE_BEHIND").lower() == "true"
+        if os.getenv("HISTORY_FLUSH_INTERVAL_MS"):
+            self.history.flush_interval_ms = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS"))
+        if os.getenv("HISTORY_FLUSH_MESSAGES"):
+            self.history.flush_messages = int(os.getenv("HISTORY_FLUSH_MESSAGES"))
+        if os.getenv("HISTORY_COMPRESSION"):
+            self.history.compression = os.getenv("HISTORY_COMPRESSION").lower()
+        if os.getenv("HISTORY_MAX_MESSAGES"):
+            self.history.max_messages_per_user = int(os.getenv("HISTORY_MAX_MESSAGES"))
+        if os.getenv("HISTORY_MAX_AGE_DAYS"):
+            self.history.max_age_days = float(os.getenv("HISTORY_MAX_AGE_DAYS"))
+        if os.getenv("HISTORY_MAX_BYTES"):
+            self.history.max_total_bytes = int(os.getenv("HISTORY_MAX_BYTES"))
+        if os.getenv("HISTORY_RETENTION_INTERVAL"):
+            self.history.retention_interval = float(os.getenv("HISTORY_RETENTION_INTERVAL"))
+        if os.getenv("HISTORY_CACHE_MAX_BYTES"):
+            self.history.cache_max_bytes = int(os.getenv("HISTORY_CACHE_MAX_BYTES"))
+        
+        # Proxy pool config
+        if os.getenv("PROXY_STRATEGY"):
+            self.proxy.strategy = os.getenv("PROXY_STRATEGY")
+        if os.getenv("PROXY_EJECT_COOLDOWN"):
+            self.proxy.eject_cooldown = float(os.getenv("PROXY_EJECT_COOLDOWN"))
+        if os.getenv("PROXY_PROBE_ON_SAVE"):
+            self.proxy.probe_on_save = os.getenv("PROXY_PROBE_ON_SAVE").lower() == "true"
             
     @property
     def available_providers(self) -> Dict[str, Any]:
@@ -1,9 +1,16 @@
 """Database models and operations for FreeGPT4 Web API."""
 
+import asyncio
+import functools
+import os
 import sqlite3
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Optional, Dict, Any, List, Tuple
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Sequence, Tuple
 from pathlib import Path
 from dataclasses import dataclass, asdict
 from uuid import uuid4
@@ -11,10 +18,36 @@ from uuid import uuid4
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from config import config
+from utils.compression import compress_text, decompress_text
 from utils.exceptions import DatabaseError, ValidationError
 from utils.logging import logger
+from utils.search import make_snippet, owner_token, parse_query, scope_query
 from utils.validation import validate_username, validate_password
 from utils.helpers import generate_uuid
+from utils.provider_monitor import merge_health_delta
+
+DEFAULT_CONVERSATION = "default"
+MESSAGE_INSERT_BATCH = 500  # Messages per INSERT statement (bounded by SQLite's variable limit)
+
+# User columns callers may select; history lives in the messages table
+USER_FIELDS = ("token", "provider", "model", "system_prompt", "message_history", "username", "password")
+SETTINGS_FIELDS = (
+    "keyword", "file_input", "port", "provider", "model", "cookie_file", "token", "remove_sources",
+    "system_prompt", "message_history", "proxies", "password", "fast_api", "virtual_users"
+)
+_BOOLEAN_FIELDS = {"file_input", "remove_sources", "message_history", "proxies", "fast_api", "virtual_users"}
+
+def _select_list(fields: Optional[Sequence[str]], allowed: Tuple[str, ...]) -> str:
+    """Build a column list from requested fields (all allowed fields if None)."""
+    fields = fields or allowed
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return ", ".join(fields)
+
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    """Convert a projected row, turning boolean columns into bools."""
+    return {key: bool(row[key]) if key in _BOOLEAN_FIELDS else row[key] for key in row.keys()}
 
 @dataclass
 class UserSettings:
@@ -58,6 +91,18 @@ class DatabaseManager:
             db_path: Path to database file
         """
         self.db_path = db_path or config.database.settings_file
+        self._settings_lock = threading.Lock()
+        self._settings_cache: Optional[MappingProxyType] = None
+        self._settings_version: Optional[int] = None
+        self._token_index: Optional[Dict[str, str]] = None
+        self._users_version: Optional[int] = None
+        self._data_version: Optional[int] = None
+        self._watch_conn: Optional[sqlite3.Connection] = None
+        self._local = threading.local()
+        self._idle_connections: List[sqlite3.Connection] = []
+        self._pool_lock = threading.Lock()
+        self._pool_pid = os.getpid()
+        self._search_enabled = False
         self._ensure_db_directory()
         self.initialize_database()
     
@@ -65,27 +110,106 @@ class DatabaseManager:
         """Ensure database directory exists."""
         Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
     
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection configured for concurrent use.
+        
+        Returns:
+            New database connection
+        """
+        db_config = config.database
+        is_new = not os.path.exists(self.db_path) or os.path.getsize(self.db_path) == 0
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=db_config.busy_timeout,
+            cached_statements=db_config.cached_statements,
+            check_same_thread=False  # Pooled connections move between threads
+        )
+        conn.row_factory = sqlite3.Row  # Enable column access by name
+        conn.execute(f"PRAGMA busy_timeout = {int(db_config.busy_timeout * 1000)}")
+        if is_new:
+            # Lets compact() release free pages; must be set before WAL mode writes
+            # the header (compact() converts older databases)
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        if db_config.wal:
+            mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if mode.lower() != "wal":
+                logger.warning(f"Could not enable WAL mode for {self.db_path}, using '{mode}' journal")
+        conn.execute(f"PRAGMA synchronous = {db_config.synchronous}")
+        return conn
+    
+    def _checkout(self) -> sqlite3.Connection:
+        """Take a connection for the calling thread (nested calls share it)."""
+        local = self._local
+        if getattr(local, "conn", None) is not None:
+            local.depth += 1
+            return local.conn
+        
+        conn = None
+        with self._pool_lock:
+            if self._pool_pid != os.getpid():
+                # Connections inherited across a fork belong to the parent
+                self._idle_connections = []
+                self._pool_pid = os.getpid()
+            if self._idle_connections:
+                conn = self._idle_connections.pop()
+        local.conn = conn or self._connect()
+        local.depth = 1
+        return local.conn
+    
+    def _checkin(self, conn: sqlite3.Connection):
+        """Return the calling thread's connection to the pool once its outermost use ends."""
+        local = self._local
+        local.depth -= 1
+        if local.depth > 0:
+            return
+        local.conn = None
+        
+        if conn.in_transaction:
+            conn.rollback()  # Changes the caller did not commit are discarded
+        with self._pool_lock:
+            if len(self._idle_connections) < config.database.pool_size:
+                self._idle_connections.append(conn)
+                return
+        conn.close()
+    
     @contextmanager
     def get_connection(self):
         """Get database connection context manager.
         
+        Connections are long-lived and pooled, so prepared statements and
+        the page cache are reused across queries; a thread gets the same
+        connection for nested uses.
+        
         Yields:
             Database connection and cursor
         """
-        conn = None
+        conn = self._checkout()
+        cursor = None
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row  # Enable column access by name
             cursor = conn.cursor()
             yield conn, cursor
         except sqlite3.Error as e:
-            if conn:
-                conn.rollback()
+            conn.rollback()
             logger.error(f"Database error: {e}")
             raise DatabaseError(f"Database operation failed: {e}")
         finally:
-            if conn:
+            if cursor is not None:
+                cursor.close()  # Reset the statement so no read snapshot stays open
+            self._checkin(conn)
+    
+    def close(self):
+        """Close the idle pooled connections and the settings watch connection."""
+        with self._pool_lock:
+            connections, self._idle_connections = self._idle_connections, []
+        with self._settings_lock:
+            if self._watch_conn is not None:
+                connections.append(self._watch_conn)
+                self._watch_conn = None
+        for conn in connections:
+            try:
                 conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to close database connection: {e}")
     
     def initialize_database(self):
         """Initialize database tables."""
@@ -127,6 +251,69 @@ class DatabaseManager:
                     )
                 """)
                 
+                # Create provider health snapshot table
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS provider_health (
+                        provider TEXT PRIMARY KEY,
+                        status TEXT NOT NULL,
+                        success_count INTEGER NOT NULL DEFAULT 0,
+                        failure_count INTEGER NOT NULL DEFAULT 0,
+                        probe_success_count INTEGER NOT NULL DEFAULT 0,
+                        probe_failure_count INTEGER NOT NULL DEFAULT 0,
+                        consecutive_failures INTEGER NOT NULL DEFAULT 0,
+                        last_success REAL,
+                        last_failure REAL,
+                        error_types TEXT NOT NULL DEFAULT '[]',
+                        concurrency_limit REAL,
+                        latency_ewma REAL,
+                        min_latency REAL,
+                        cooldown_until REAL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+                self._ensure_columns(cursor, "provider_health", {"cooldown_until": "REAL"})
+                
+                # Create response cache table (persistent tier of the response cache)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS response_cache (
+                        key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        provider TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                """)
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache (created_at)")
+                
+                # Create chat message table (one row per message, appended per turn)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS messages (
+                        id INTEGER PRIMARY KEY,
+                        username TEXT NOT NULL,
+                        conversation_id TEXT NOT NULL,
+                        seq INTEGER NOT NULL,
+                        role TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        UNIQUE (username, conversation_id, seq)
+                    )
+                """)
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_created ON messages (created_at)")
+                self._create_message_stats(cursor)
+                self._create_search_index(cursor)
+                self._migrate_chat_history(cursor)
+                
+                # Create settings version counter (bumped on every settings change)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS settings_version (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        version INTEGER NOT NULL,
+                        users_version INTEGER NOT NULL DEFAULT 0
+                    )
+                """)
+                self._ensure_columns(cursor, "settings_version", {"users_version": "INTEGER NOT NULL DEFAULT 0"})
+                cursor.execute("INSERT OR IGNORE INTO settings_version (id, version) VALUES (1, 0)")
+                
                 # Insert default settings if not exists
                 cursor.execute("SELECT COUNT(*) FROM settings")
                 if cursor.fetchone()[0] == 0:
@@ -140,6 +327,162 @@ class DatabaseManager:
             logger.error(f"Failed to initialize database: {e}")
             raise DatabaseError(f"Database initialization failed: {e}")
     
+    def _ensure_columns(self, cursor, table: str, columns: Dict[str, str]):
+        """Add columns missing from a table created by an older version.
+        
+        Args:
+            cursor: Database cursor
+            table: Table name
+            columns: Mapping of column name to column definition
+        """
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row["name"] for row in cursor.fetchall()}
+        for name, definition in columns.items():
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                logger.info(f"Added column '{name}' to table '{table}'")
+    
+    def _create_message_stats(self, cursor):
+        """Create the running total of stored message bytes, kept up to date by triggers.
+        
+        Existing messages are summed once, when the total is created.
+        
+        Args:
+            cursor: Database cursor
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS message_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_bytes INTEGER NOT NULL
+            )
+        """)
+        cursor.execute("""
+            INSERT OR IGNORE INTO message_stats (id, total_bytes)
+            SELECT 1, COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0) FROM messages
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_bytes_insert AFTER INSERT ON messages BEGIN
+                UPDATE message_stats SET total_bytes = total_bytes + LENGTH(CAST(NEW.content AS BLOB)) WHERE id = 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_bytes_delete AFTER DELETE ON messages BEGIN
+                UPDATE message_stats SET total_bytes = total_bytes - LENGTH(CAST(OLD.content AS BLOB)) WHERE id = 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_bytes_update AFTER UPDATE OF content ON messages BEGIN
+                UPDATE message_stats SET total_bytes = total_bytes
+                    - LENGTH(CAST(OLD.content AS BLOB)) + LENGTH(CAST(NEW.content AS BLOB)) WHERE id = 1;
+            END
+        """)
+    
+    def _create_search_index(self, cursor):
+        """Create the full-text index of messages, indexing existing ones when it is new.
+        
+        The index is contentless (message content is stored, possibly
+        compressed, in the messages table only) and keyed by message id.
+        Each entry also holds its owner's token, so a search only reads the
+        searching user's entries. An index created without owners is rebuilt.
+        
+        Args:
+            cursor: Database cursor
+        """
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'messages_fts'")
+        row = cursor.fetchone()
+        exists = row is not None and "owner" in row["sql"]
+        try:
+            if row is not None and not exists:
+                cursor.execute("DROP TABLE messages_fts")
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(owner, content, content='')")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Chat history search disabled, SQLite has no FTS5 support: {e}")
+            return
+        self._search_enabled = True
+        
+        if not exists:
+            cursor.execute("SELECT id, username, content FROM messages")
+            rows = [
+                (row["id"], owner_token(row["username"]), decompress_text(row["content"]))
+                for row in cursor.fetchall()
+            ]
+            cursor.executemany("INSERT INTO messages_fts (rowid, owner, content) VALUES (?, ?, ?)", rows)
+            if rows:
+                logger.info(f"Indexed {len(rows)} chat messages for search")
+    
+    def _delete_message_rows(self, cursor, where: str, params: Sequence[Any]) -> int:
+        """Delete messages and their search index entries (inside the writing transaction).
+        
+        Entries of a contentless index are removed by passing the indexed
+        text again, so the deleted messages are read first.
+        
+        Args:
+            cursor: Database cursor
+            where: SQL condition on the messages table
+            params: Parameters of the condition
+            
+        Returns:
+            Number of deleted messages
+        """
+        if self._search_enabled:
+            cursor.execute(f"SELECT id, username, content FROM messages WHERE {where}", params)
+            cursor.executemany(
+                "INSERT INTO messages_fts (messages_fts, rowid, owner, content) VALUES ('delete', ?, ?, ?)",
+                [
+                    (row["id"], owner_token(row["username"]), decompress_text(row["content"]))
+                    for row in cursor.fetchall()
+                ]
+            )
+        cursor.execute(f"DELETE FROM messages WHERE {where}", params)
+        return cursor.rowcount
+    
+    def _reindex_owner(self, cursor, username: str, new_username: str):
+        """Move a user's search index entries to a new username (inside the writing transaction).
+        
+        Args:
+            cursor: Database cursor
+            username: Current username
+            new_username: Username the messages are moved to
+        """
+        cursor.execute("SELECT id, content FROM messages WHERE username = ?", (username,))
+        rows = [(row["id"], decompress_text(row["content"])) for row in cursor.fetchall()]
+        old_owner, new_owner = owner_token(username), owner_token(new_username)
+        cursor.executemany(
+            "INSERT INTO messages_fts (messages_fts, rowid, owner, content) VALUES ('delete', ?, ?, ?)",
+            [(message_id, old_owner, content) for message_id, content in rows]
+        )
+        cursor.executemany(
+            "INSERT INTO messages_fts (rowid, owner, content) VALUES (?, ?, ?)",
+            [(message_id, new_owner, content) for message_id, content in rows]
+        )
+    
+    def _migrate_chat_history(self, cursor):
+        """Move chat histories stored as JSON columns into the messages table.
+        
+        Args:
+            cursor: Database cursor
+        """
+        cursor.execute("SELECT 'admin' AS username, chat_history FROM settings WHERE id = 1 AND chat_history NOT IN ('', '[]')")
+        rows = cursor.fetchall()
+        cursor.execute("SELECT username, chat_history FROM personal WHERE chat_history NOT IN ('', '[]')")
+        rows.extend(cursor.fetchall())
+        
+        for row in rows:
+            try:
+                messages = json.loads(row["chat_history"])
+            except json.JSONDecodeError:
+                logger.warning(f"Invalid chat history JSON for user '{row['username']}', not migrated")
+                continue
+            messages = [msg for msg in messages if isinstance(msg, dict) and msg.get("role") != "system"]
+            if messages:
+                self._insert_messages(cursor, row["username"], DEFAULT_CONVERSATION, messages)
+            
+            if row["username"] == "admin":
+                cursor.execute("UPDATE settings SET chat_history = '' WHERE id = 1")
+            else:
+                cursor.execute("UPDATE personal SET chat_history = '' WHERE username = ?", (row["username"],))
+            logger.info(f"Migrated {len(messages)} chat messages of user '{row['username']}'")
+    
     def _create_default_settings(self, cursor):
         """Create default settings."""
         default_settings = ServerSettings()
@@ -169,36 +512,159 @@ class DatabaseManager:
         ))
         logger.info("Default settings created")
     
-    def get_settings(self) -> Dict[str, Any]:
+    def _get_watch_connection(self) -> sqlite3.Connection:
+        """Get the long-lived connection used to detect settings changes (lock held)."""
+        if self._watch_conn is None:
+            self._watch_conn = sqlite3.connect(self.db_path, timeout=config.database.busy_timeout, check_same_thread=False)
+        return self._watch_conn
+    
+    def data_version(self) -> int:
+        """Get a counter that changes whenever any other connection commits."""
+        with self._settings_lock:
+            return self._get_watch_connection().execute("PRAGMA data_version").fetchone()[0]
+    
+    def invalidate_settings_cache(self):
+        """Drop the cached settings snapshot and token index."""
+        with self._settings_lock:
+            self._settings_cache = None
+            self._token_index = None
+    
+    def _check_versions(self):
+        """Drop cached settings or tokens changed by any connection (lock held).
+        
+        ``PRAGMA data_version`` on a long-lived connection tells cheaply whether
+        anything was committed since the last check; only then are the version
+        counters read.
+        """
+        try:
+            watch = self._get_watch_connection()
+            data_version = watch.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return
+            
+            version, users_version = watch.execute(
+                "SELECT version, users_version FROM settings_version WHERE id = 1"
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Settings version check failed, reloading settings: {e}")
+            self._settings_cache = self._token_index = None
+            self._data_version = None
+            return
+        
+        if version != self._settings_version:
+            self._settings_cache = self._token_index = None
+            self._settings_version = version
+        if users_version != self._users_version:
+            self._token_index = None
+            self._users_version = users_version
+        self._data_version = data_version
+    
+    def _bump_users_version(self, cursor) -> int:
+        """Record a change to user tokens or usernames (inside the writing transaction).
+        
+        Returns:
+            New users version
+        """
+        cursor.execute("UPDATE settings_version SET users_version = users_version + 1 WHERE id = 1")
+        cursor.execute("SELECT users_version FROM settings_version WHERE id = 1")
+        return cursor.fetchone()[0]
+    
+    def get_settings(self) -> MappingProxyType:
         """Get server settings.
         
+        The settings row is cached as a read-only snapshot that is reloaded
+        only when the settings version counter changes.
+        
+        Returns:
+            Read-only mapping with server settings
+        """
+        with self._settings_lock:
+            self._check_versions()
+            if self._settings_cache is None:
+                self._settings_cache = MappingProxyType(self._load_settings())
+            return self._settings_cache
+    
+    def get_username_by_token(self, token: str) -> Optional[str]:
+        """Resolve an access token to a username without querying user rows.
+        
+        Args:
+            token: Access token
+            
+        Returns:
+            'admin' for the admin token, the username for a user token, or None
+        """
+        with self._settings_lock:
+            self._check_versions()
+            if self._token_index is None:
+                self._token_index = self._load_token_index()
+            return self._token_index.get(token)
+    
+    def _load_token_index(self) -> Dict[str, str]:
+        """Build the token-to-username index (settings lock held)."""
+        index = {}
+        try:
+            with self.get_connection() as (conn, cursor):
+                cursor.execute("SELECT token, username FROM personal")
+                for row in cursor.fetchall():
+                    if row["token"]:
+                        index[row["token"]] = row["username"]
+                cursor.execute("SELECT token FROM settings WHERE id = 1")
+                row = cursor.fetchone()
+                if row and row["token"]:
+                    index[row["token"]] = "admin"
+        except Exception as e:
+            logger.error(f"Failed to load token index: {e}")
+            raise DatabaseError(f"Failed to load token index: {e}")
+        return index
+    
+    def _update_token_index(
+        self,
+        version: int,
+        username: str,
+        token: Optional[str] = None,
+        new_username: Optional[str] = None
+    ):
+        """Apply a local user change to the token index.
+        
+        Args:
+            version: Users version written by the change
+            username: Username whose entry changes
+            token: New token (keeps the current one if None)
+            new_username: New username (keeps the current one if None), '' to delete
+        """
+        with self._settings_lock:
+            if self._token_index is None:
+                return
+            if version != self._users_version + 1:
+                # Another connection changed users too; rebuild on next lookup
+                self._token_index = None
+                return
+            self._users_version = version
+            current = [t for t, name in self._token_index.items() if name == username]
+            for old_token in current:
+                del self._token_index[old_token]
+            if new_username == "":
+                return
+            
+            tokens = [token] if token else current
+            for new_token in tokens:
+                self._token_index[new_token] = new_username or username
+    
+    def _load_settings(self) -> Dict[str, Any]:
+        """Read server settings from the database.
+        
         Returns:
             Dictionary with server settings
         """
         try:
             with self.get_connection() as (conn, cursor):
-                cursor.execute("SELECT * FROM settings WHERE id = 1")
+                cursor.execute(f"SELECT {_select_list(None, SETTINGS_FIELDS)} FROM settings WHERE id = 1")
                 row = cursor.fetchone()
                 
                 if not row:
                     raise DatabaseError("Settings not found")
                 
-                return {
-                    "keyword": row["keyword"],
-                    "file_input": bool(row["file_input"]),
-                    "port": row["port"],
-                    "provider": row["provider"],
-                    "model": row["model"],
-                    "cookie_file": row["cookie_file"],
-                    "token": row["token"],
-                    "remove_sources": bool(row["remove_sources"]),
-                    "system_prompt": row["system_prompt"],
-                    "message_history": bool(row["message_history"]),
-                    "proxies": bool(row["proxies"]),
-                    "password": row["password"],
-                    "fast_api": bool(row["fast_api"]),
-                    "virtual_users": bool(row["virtual_users"])
-                }
+                return _row_to_dict(row)
         except DatabaseError:
             raise
         except Exception as e:
@@ -227,7 +693,9 @@ class DatabaseManager:
                 if update_fields:
                     query = f"UPDATE settings SET {', '.join(update_fields)} WHERE id = 1"
                     cursor.execute(query, values)
+                    cursor.execute("UPDATE settings_version SET version = version + 1 WHERE id = 1")
                     conn.commit()
+                    self.invalidate_settings_cache()
                     logger.info("Settings updated successfully")
         except DatabaseError:
             raise
@@ -321,7 +789,9 @@ class DatabaseManager:
                     user_settings.password,
                     user_settings.chat_history
                 ))
+                users_version = self._bump_users_version(cursor)
                 conn.commit()
+                self._update_token_index(users_version, username, token=token)
                 logger.info(f"User '{username}' created successfully")
                 return token
         except sqlite3.IntegrityError as e:
@@ -332,64 +802,42 @@ class DatabaseManager:
             logger.error(f"Failed to create user '{username}': {e}")
             raise DatabaseError(f"Failed to create user: {e}")
     
-    def get_user_by_token(self, token: str) -> Optional[Dict[str, Any]]:
+    def get_user_by_token(self, token: str, fields: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
         """Get user by token.
         
         Args:
             token: User token
+            fields: Columns to read (see USER_FIELDS; all of them if None)
             
         Returns:
             User data dictionary or None if not found
         """
+        columns = _select_list(fields, USER_FIELDS)
         try:
             with self.get_connection() as (conn, cursor):
-                cursor.execute("SELECT * FROM personal WHERE token = ?", (token,))
+                cursor.execute(f"SELECT {columns} FROM personal WHERE token = ?", (token,))
                 row = cursor.fetchone()
-                
-                if not row:
-                    return None
-                
-                return {
-                    "token": row["token"],
-                    "provider": row["provider"],
-                    "model": row["model"],
-                    "system_prompt": row["system_prompt"],
-                    "message_history": bool(row["message_history"]),
-                    "username": row["username"],
-                    "password": row["password"],
-                    "chat_history": row["chat_history"]
-                }
+                return _row_to_dict(row) if row else None
         except Exception as e:
             logger.error(f"Failed to get user by token: {e}")
             return None
     
-    def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+    def get_user_by_username(self, username: str, fields: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
         """Get user by username.
         
         Args:
             username: Username
+            fields: Columns to read (see USER_FIELDS; all of them if None)
             
         Returns:
             User data dictionary or None if not found
         """
+        columns = _select_list(fields, USER_FIELDS)
         try:
             with self.get_connection() as (conn, cursor):
-                cursor.execute("SELECT * FROM personal WHERE username = ?", (username,))
+                cursor.execute(f"SELECT {columns} FROM personal WHERE username = ?", (username,))
                 row = cursor.fetchone()
-                
-                if not row:
-                    return None
-                
-                return {
-                    "token": row["token"],
-                    "provider": row["provider"],
-                    "model": row["model"],
-                    "system_prompt": row["system_prompt"],
-                    "message_history": bool(row["message_history"]),
-                    "username": row["username"],
-                    "password": row["password"],
-                    "chat_history": row["chat_history"]
-                }
+                return _row_to_dict(row) if row else None
         except Exception as e:
             logger.error(f"Failed to get user by username: {e}")
             return None
@@ -405,7 +853,7 @@ class DatabaseManager:
             True if password is correct, False otherwise
         """
         try:
-            user = self.get_user_by_username(username)
+            user = self.get_user_by_username(username, fields=("password",))
             if not user:
                 return False
             
@@ -438,7 +886,20 @@ class DatabaseManager:
                     values.append(username)  # Add username for WHERE clause
                     query = f"UPDATE personal SET {', '.join(update_fields)} WHERE username = ?"
                     cursor.execute(query, values)
+                    if settings.get("username") and settings["username"] != username:
+                        if self._search_enabled:
+                            self._reindex_owner(cursor, username, settings["username"])
+                        cursor.execute(
+                            "UPDATE messages SET username = ? WHERE username = ?", (settings["username"], username)
+                        )
+                    users_version = None
+                    if "token" in settings or "username" in settings:
+                        users_version = self._bump_users_version(cursor)
                     conn.commit()
+                    if users_version is not None:
+                        self._update_token_index(
+                            users_version, username, token=settings.get("token"), new_username=settings.get("username")
+                        )
                     logger.info(f"User '{username}' settings updated successfully")
         except Exception as e:
             logger.error(f"Failed to update user settings: {e}")
@@ -453,55 +914,468 @@ class DatabaseManager:
         try:
             with self.get_connection() as (conn, cursor):
                 cursor.execute("DELETE FROM personal WHERE username = ?", (username,))
+                self._delete_message_rows(cursor, "username = ?", (username,))
+                users_version = self._bump_users_version(cursor)
                 conn.commit()
+                self._update_token_index(users_version, username, new_username="")
                 logger.info(f"User '{username}' deleted successfully")
         except Exception as e:
             logger.error(f"Failed to delete user '{username}': {e}")
             raise DatabaseError(f"Failed to delete user: {e}")
     
-    def get_all_users(self) -> List[Dict[str, Any]]:
+    def get_all_users(self, fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
         """Get all users.
         
+        Args:
+            fields: Columns to read (see USER_FIELDS; all of them if None)
+        
         Returns:
             List of user dictionaries
         """
+        columns = _select_list(fields, USER_FIELDS)
         try:
             with self.get_connection() as (conn, cursor):
-                cursor.execute("SELECT * FROM personal")
-                rows = cursor.fetchall()
-                
-                users = []
-                for row in rows:
-                    users.append({
-                        "token": row["token"],
-                        "provider": row["provider"],
-                        "model": row["model"],
-                        "system_prompt": row["system_prompt"],
-                        "message_history": bool(row["message_history"]),
-                        "username": row["username"],
-                        "password": row["password"],
-                        "chat_history": row["chat_history"]
-                    })
-                
-                return users
+                cursor.execute(f"SELECT {columns} FROM personal")
+                return [_row_to_dict(row) for row in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Failed to get all users: {e}")
             raise DatabaseError(f"Failed to get all users: {e}")
     
+    def _compress(self, content: str):
+        """Encode message content for storage."""
+        return compress_text(content, config.history.compression, config.history.compress_min_bytes)
+    
+    def _insert_messages(
+        self,
+        cursor,
+        username: str,
+        conversation_id: str,
+        messages: List[Dict[str, str]]
+    ) -> int:
+        """Insert messages after the last one of a conversation (inside the writing transaction).
+        
+        The next sequence number is computed by the insert itself, so a turn
+        is one statement and concurrent writers never read the conversation first.
+        
+        Returns:
+            Sequence number of the first inserted message
+        """
+        created_at = time.time()
+        first_seq = None
+        for start in range(0, len(messages), MESSAGE_INSERT_BATCH):
+            batch = messages[start:start + MESSAGE_INSERT_BATCH]
+            values = ", ".join(["(?, ?, ?)"] * len(batch))
+            params: List[Any] = [username, conversation_id, created_at, username, conversation_id]
+            contents = [str(msg.get("content", "")) for msg in batch]
+            for offset, (msg, content) in enumerate(zip(batch, contents)):
+                params.extend([offset, msg.get("role", "user"), self._compress(content)])
+            cursor.execute(f"""
+                INSERT INTO messages (username, conversation_id, seq, role, content, created_at)
+                SELECT ?, ?, base.next_seq + batch.column1, batch.column2, batch.column3, ?
+                FROM (
+                    SELECT COALESCE(MAX(seq), 0) + 1 AS next_seq FROM messages
+                    WHERE username = ? AND conversation_id = ?
+                ) AS base, (VALUES {values}) AS batch
+                RETURNING id, seq
+            """, params)
+            inserted = cursor.fetchall()
+            batch_first = min(row["seq"] for row in inserted)
+            if self._search_enabled:
+                owner = owner_token(username)
+                index_params: List[Any] = []
+                for row in inserted:
+                    index_params.extend([row["id"], owner, contents[row["seq"] - batch_first]])
+                cursor.execute(
+                    f"INSERT INTO messages_fts (rowid, owner, content) VALUES {', '.join(['(?, ?, ?)'] * len(inserted))}",
+                    index_params
+                )
+            if first_seq is None:
+                first_seq = batch_first
+        return first_seq
+    
+    def append_messages(
+        self,
+        username: str,
+        messages: List[Dict[str, str]],
+        conversation_id: str = DEFAULT_CONVERSATION
+    ) -> Optional[int]:
+        """Append messages to a conversation.
+        
+        Only the new messages are written, whatever the length of the conversation.
+        
+        Args:
+            username: Username ('admin' for admin user)
+            messages: Messages with role and content
+            conversation_id: Conversation to append to
+            
+        Returns:
+            Sequence number of the first appended message, or None if there was nothing to append
+        """
+        if not messages:
+            return None
+        
+        try:
+            with self.get_connection() as (conn, cursor):
+                first_seq = self._insert_messages(cursor, username, conversation_id, messages)
+                conn.commit()
+                logger.debug(f"Appended {len(messages)} chat messages for user '{username}'")
+                return first_seq
+        except Exception as e:
+            logger.error(f"Failed to append chat messages for user '{username}': {e}")
+            raise DatabaseError(f"Failed to append chat messages: {e}")
+    
+    def append_message_batch(self, batch: Dict[Tuple[str, str], List[Dict[str, str]]]) -> Dict[Tuple[str, str], int]:
+        """Append messages to several conversations in one transaction.
+        
+        Args:
+            batch: Messages to append per (username, conversation_id)
+            
+        Returns:
+            Sequence number of the first appended message per conversation
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                first_seqs = {
+                    (username, conversation_id): self._insert_messages(cursor, username, conversation_id, messages)
+                    for (username, conversation_id), messages in batch.items()
+                    if messages
+                }
+                conn.commit()
+                return first_seqs
+        except Exception as e:
+            logger.error(f"Failed to append chat messages for {len(batch)} conversations: {e}")
+            raise DatabaseError(f"Failed to append chat messages: {e}")
+    
+    def get_messages(
+        self,
+        username: str,
+        conversation_id: str = DEFAULT_CONVERSATION,
+        after_seq: int = 0,
+        limit: Optional[int] = None,
+        anchor_seq: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Read messages of a conversation in order with one index range scan.
+        
+        Args:
+            username: Username ('admin' for admin user)
+            conversation_id: Conversation to read
+            after_seq: Only return messages after this sequence number
+            limit: Only return the most recent messages, at most this many
+            anchor_seq: Also return the message with this sequence number, so a
+                caller holding a copy can check that it still starts there
+            
+        Returns:
+            List of dictionaries with seq, role and content
+        """
+        query = "SELECT seq, role, content FROM messages WHERE username = ? AND conversation_id = ? AND "
+        params: List[Any] = [username, conversation_id]
+        if anchor_seq is not None:
+            query += "(seq > ? OR seq = ?)"
+            params.extend([after_seq, anchor_seq])
+        else:
+            query += "seq > ?"
+            params.append(after_seq)
+        if limit is not None:
+            query += " ORDER BY seq DESC LIMIT ?"
+            params.append(limit)
+        else:
+            query += " ORDER BY seq"
+        
+        try:
+            with self.get_connection() as (conn, cursor):
+                cursor.execute(query, params)
+                messages = [
+                    {"seq": row["seq"], "role": row["role"], "content": decompress_text(row["content"])}
+                    for row in cursor.fetchall()
+                ]
+                if limit is not None:
+                    messages.reverse()
+                return messages
+        except Exception as e:
+            logger.error(f"Failed to get chat messages for user '{username}': {e}")
+            raise DatabaseError(f"Failed to get chat messages: {e}")
+    
+    def _delete_message_ids(self, ids: List[int]) -> int:
+        """Delete messages by id in one short transaction."""
+        with self.get_connection() as (conn, cursor):
+            deleted = self._delete_message_rows(cursor, f"id IN ({', '.join(['?'] * len(ids))})", ids)
+            conn.commit()
+            return deleted
+    
+    def prune_messages(
+        self,
+        max_messages_per_user: int = 0,
+        max_age: float = 0.0,
+        max_total_bytes: int = 0,
+        batch_size: int = 200,
+        pause: float = 0.0
+    ) -> int:
+        """Delete the oldest messages beyond the retention limits.
+        
+        Messages are deleted in batches of their own transactions, so
+        requests only ever wait for one small batch.
+        
+        Args:
+            max_messages_per_user: Messages kept per user (0 keeps all)
+            max_age: Seconds messages are kept (0 keeps all)
+            max_total_bytes: Stored bytes of message content kept overall (0 keeps all)
+            batch_size: Messages deleted per transaction
+            pause: Seconds to wait between batches
+            
+        Returns:
+            Number of deleted messages
+        """
+        deleted = 0
+        
+        def delete_batch(ids: List[int]) -> bool:
+            nonlocal deleted
+            if not ids:
+                return False
+            deleted += self._delete_message_ids(ids)
+            if pause:
+                time.sleep(pause)
+            return True
+        
+        try:
+            if max_age:
+                cutoff = time.time() - max_age
+                while True:
+                    with self.get_connection() as (conn, cursor):
+                        cursor.execute(
+                            "SELECT id FROM messages WHERE created_at < ? ORDER BY created_at LIMIT ?",
+                            (cutoff, batch_size)
+                        )
+                        ids = [row["id"] for row in cursor.fetchall()]
+                    if not delete_batch(ids) or len(ids) < batch_size:
+                        break
+            
+            if max_messages_per_user:
+                with self.get_connection() as (conn, cursor):
+                    cursor.execute(
+                        "SELECT username, COUNT(*) AS count FROM messages GROUP BY username HAVING count > ?",
+                        (max_messages_per_user,)
+                    )
+                    excess_by_user = [(row["username"], row["count"] - max_messages_per_user) for row in cursor.fetchall()]
+                for username, excess in excess_by_user:
+                    while excess > 0:
+                        with self.get_connection() as (conn, cursor):
+                            cursor.execute(
+                                "SELECT id FROM messages WHERE username = ? ORDER BY id LIMIT ?",
+                                (username, min(excess, batch_size))
+                            )
+                            ids = [row["id"] for row in cursor.fetchall()]
+                        if not delete_batch(ids):
+                            break
+                        excess -= len(ids)
+            
+            if max_total_bytes:
+                with self.get_connection() as (conn, cursor):
+                    cursor.execute("SELECT total_bytes FROM message_stats WHERE id = 1")
+                    excess = cursor.fetchone()[0] - max_total_bytes
+                while excess > 0:
+                    with self.get_connection() as (conn, cursor):
+                        cursor.execute(
+                            "SELECT id, LENGTH(CAST(content AS BLOB)) AS size FROM messages ORDER BY id LIMIT ?",
+                            (batch_size,)
+                        )
+                        ids = []
+                        for row in cursor.fetchall():
+                            if excess <= 0:
+                                break
+                            ids.append(row["id"])
+                            excess -= row["size"]
+                    if not delete_batch(ids):
+                        break
+            
+            if deleted:
+                logger.info(f"Pruned {deleted} chat messages past the retention limits")
+            return deleted
+        except Exception as e:
+            logger.error(f"Failed to prune chat messages: {e}")
+            raise DatabaseError(f"Failed to prune chat messages: {e}")
+    
+    def compact(self, max_pages: int = 0) -> int:
+        """Return free pages to the filesystem and refresh query planner statistics.
+        
+        Free pages are only released in databases using incremental
+        auto-vacuum (new ones do; compress_messages converts older ones),
+        since converting takes a full VACUUM that locks the database.
+        
+        Args:
+            max_pages: Free pages released at most (0 releases all)
+            
+        Returns:
+            Number of free pages before compaction
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                cursor.execute("PRAGMA auto_vacuum")
+                incremental = cursor.fetchone()[0] == 2
+                
+                if self._search_enabled:
+                    # Merge index segments left behind by many small appends and deletes
+                    cursor.execute("INSERT INTO messages_fts (messages_fts, rank) VALUES ('merge', 500)")
+                    conn.commit()
+                
+                cursor.execute("PRAGMA freelist_count")
+                free_pages = cursor.fetchone()[0]
+                if incremental:
+                    # Each step of the pragma frees one page; executescript runs it to completion
+                    conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)})")
+                cursor.execute("PRAGMA optimize")
+                logger.debug(f"Compacted database ({free_pages} free pages)")
+                return free_pages
+        except Exception as e:
+            logger.error(f"Failed to compact database: {e}")
+            raise DatabaseError(f"Failed to compact database: {e}")
+    
+    def compress_messages(self, batch_size: int = 500) -> Tuple[int, int, int]:
+        """Compress messages stored as plain text, then vacuum the database.
+        
+        Rows are rewritten in small transactions, so the server can keep
+        running while it migrates. The final VACUUM also switches older
+        databases to incremental auto-vacuum, so compact() can release
+        pages afterwards.
+        
+        Args:
+            batch_size: Rows per transaction
+            
+        Returns:
+            Tuple of (rows compressed, bytes before, bytes after)
+        """
+        compressed = bytes_before = bytes_after = 0
+        last_id = 0
+        try:
+            while True:
+                with self.get_connection() as (conn, cursor):
+                    cursor.execute("""
+                        SELECT id, content FROM messages
+                        WHERE id > ? AND typeof(content) = 'text'
+                        ORDER BY id LIMIT ?
+                    """, (last_id, batch_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    last_id = rows[-1]["id"]
+                    
+                    updates = []
+                    for row in rows:
+                        stored = self._compress(row["content"])
+                        if isinstance(stored, bytes):
+                            updates.append((stored, row["id"]))
+                            bytes_before += len(row["content"].encode("utf-8"))
+                            bytes_after += len(stored)
+                    if updates:
+                        cursor.executemany("UPDATE messages SET content = ? WHERE id = ?", updates)
+                        conn.commit()
+                        compressed += len(updates)
+            
+            with self.get_connection() as (conn, cursor):
+                cursor.execute("PRAGMA auto_vacuum")
+                convert = cursor.fetchone()[0] != 2
+                if compressed or convert:
+                    # Return the freed pages to the filesystem
+                    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                    cursor.execute("VACUUM")
+            logger.info(f"Compressed {compressed} chat messages ({bytes_before} -> {bytes_after} bytes)")
+            return compressed, bytes_before, bytes_after
+        except Exception as e:
+            logger.error(f"Failed to compress chat messages: {e}")
+            raise DatabaseError(f"Failed to compress chat messages: {e}")
+    
+    def delete_messages(self, username: str, conversation_id: Optional[str] = None):
+        """Delete a user's messages.
+        
+        Args:
+            username: Username ('admin' for admin user)
+            conversation_id: Conversation to delete (all conversations if None)
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if conversation_id is None:
+                    self._delete_message_rows(cursor, "username = ?", (username,))
+                else:
+                    self._delete_message_rows(
+                        cursor, "username = ? AND conversation_id = ?", (username, conversation_id)
+                    )
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to delete chat messages for user '{username}': {e}")
+            raise DatabaseError(f"Failed to delete chat messages: {e}")
+    
+    def search_messages(
+        self,
+        username: str,
+        query: str,
+        limit: int = 20,
+        offset: int = 0,
+        snippet_chars: int = 160
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """Search a user's messages, best matches first.
+        
+        Args:
+            username: Username ('admin' for admin user)
+            query: Search text; messages containing every word match
+            limit: Results per page
+            offset: Results to skip
+            snippet_chars: Length of the snippet returned per message
+            
+        Returns:
+            Tuple of (results with conversation_id, seq, role, created_at,
+            score and snippet; whether more results follow)
+        """
+        if not self._search_enabled:
+            raise DatabaseError("Chat history search requires SQLite with FTS5")
+        match, terms = parse_query(query)
+        if not match:
+            return [], False
+        
+        try:
+            with self.get_connection() as (conn, cursor):
+                # The owner token limits the match to this user's entries; bm25() is
+                # lower for better matches and only weighs the content column
+                cursor.execute("""
+                    SELECT m.conversation_id, m.seq, m.role, m.content, m.created_at,
+                           bm25(messages_fts, 0.0, 1.0) AS score
+                    FROM messages_fts JOIN messages AS m ON m.id = messages_fts.rowid
+                    WHERE messages_fts MATCH ? AND m.username = ?
+                    ORDER BY score, m.id DESC
+                    LIMIT ? OFFSET ?
+                """, (scope_query(match, username), username, limit + 1, offset))
+                rows = cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Failed to search chat messages for user '{username}': {e}")
+            raise DatabaseError(f"Failed to search chat messages: {e}")
+        
+        results = [
+            {
+                "conversation_id": row["conversation_id"],
+                "seq": row["seq"],
+                "role": row["role"],
+                "created_at": row["created_at"],
+                "score": -row["score"],
+                "snippet": make_snippet(decompress_text(row["content"]), terms, snippet_chars)
+            }
+            for row in rows[:limit]
+        ]
+        return results, len(rows) > limit
+    
     def save_chat_history(self, username: str, chat_history: str):
-        """Save chat history for user or admin.
+        """Replace the chat history of user or admin.
         
         Args:
             username: Username ('admin' for admin user)
             chat_history: Chat history JSON string
         """
         try:
+            messages = json.loads(chat_history) if chat_history else []
+            messages = [msg for msg in messages if isinstance(msg, dict) and msg.get("role") != "system"]
             with self.get_connection() as (conn, cursor):
-                if username == "admin":
-                    cursor.execute("UPDATE settings SET chat_history = ? WHERE id = 1", (chat_history,))
-                else:
-                    cursor.execute("UPDATE personal SET chat_history = ? WHERE username = ?", (chat_history, username))
-                
+                self._delete_message_rows(
+                    cursor, "username = ? AND conversation_id = ?", (username, DEFAULT_CONVERSATION)
+                )
+                if messages:
+                    self._insert_messages(cursor, username, DEFAULT_CONVERSATION, messages)
                 conn.commit()
                 logger.debug(f"Chat history saved for user '{username}'")
         except Exception as e:
@@ -517,18 +1391,233 @@ class DatabaseManager:
         Returns:
             Chat history JSON string
         """
+        try:
+            messages = self.get_messages(username)
+        except DatabaseError:
+            return ""
+        if not messages:
+            return ""
+        return json.dumps([{"role": msg["role"], "content": msg["content"]} for msg in messages])
+
+    def save_provider_health(self, rows: List[Dict[str, Any]]):
+        """Save a snapshot of provider health state.
+        
+        Args:
+            rows: Rows produced by ProviderMonitor.export_state
+        """
+        if not rows:
+            return
+        
         try:
             with self.get_connection() as (conn, cursor):
-                if username == "admin":
-                    cursor.execute("SELECT chat_history FROM settings WHERE id = 1")
-                else:
-                    cursor.execute("SELECT chat_history FROM personal WHERE username = ?", (username,))
+                cursor.executemany("""
+                    INSERT OR REPLACE INTO provider_health (
+                        provider, status, success_count, failure_count,
+                        probe_success_count, probe_failure_count, consecutive_failures,
+                        last_success, last_failure, error_types, concurrency_limit,
+                        latency_ewma, min_latency, cooldown_until, updated_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [self._provider_health_params(row) for row in rows])
+                conn.commit()
+                logger.debug(f"Provider health snapshot saved ({len(rows)} providers)")
+        except Exception as e:
+            logger.error(f"Failed to save provider health: {e}")
+            raise DatabaseError(f"Failed to save provider health: {e}")
+    
+    def sync_provider_health(self, deltas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Merge this worker's pending changes into shared provider health.
+        
+        Runs as a single write transaction, so concurrent workers serialize
+        their merges instead of overwriting each other.
+        
+        Args:
+            deltas: Pending changes produced by ProviderMonitor.take_deltas
+            
+        Returns:
+            All shared provider health rows after the merge
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if deltas:
+                    cursor.execute("BEGIN IMMEDIATE")
+                
+                cursor.execute("SELECT * FROM provider_health")
+                rows = {row["provider"]: self._provider_health_row(row) for row in cursor.fetchall()}
                 
+                if deltas:
+                    for delta in deltas:
+                        rows[delta["provider"]] = merge_health_delta(rows.get(delta["provider"]), delta)
+                    
+                    cursor.executemany("""
+                        INSERT OR REPLACE INTO provider_health (
+                            provider, status, success_count, failure_count,
+                            probe_success_count, probe_failure_count, consecutive_failures,
+                            last_success, last_failure, error_types, concurrency_limit,
+                            latency_ewma, min_latency, cooldown_until, updated_at
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, [self._provider_health_params(rows[delta["provider"]]) for delta in deltas])
+                    conn.commit()
+                
+                return list(rows.values())
+        except Exception as e:
+            logger.error(f"Failed to sync provider health: {e}")
+            raise DatabaseError(f"Failed to sync provider health: {e}")
+    
+    def _provider_health_params(self, row: Dict[str, Any]) -> Tuple:
+        """Build provider_health insert parameters from a row dictionary."""
+        return (
+            row["provider"],
+            row["status"],
+            row["success_count"],
+            row["failure_count"],
+            row["probe_success_count"],
+            row["probe_failure_count"],
+            row["consecutive_failures"],
+            row["last_success"],
+            row["last_failure"],
+            json.dumps(sorted(row["error_types"])),
+            row.get("concurrency_limit"),
+            row.get("latency_ewma"),
+            row.get("min_latency"),
+            row.get("cooldown_until"),
+            row["updated_at"]
+        )
+    
+    def _provider_health_row(self, row: sqlite3.Row) -> Dict[str, Any]:
+        """Convert a provider_health row to a dictionary."""
+        data = dict(row)
+        data["error_types"] = json.loads(data["error_types"] or "[]")
+        return data
+    
+    def load_provider_health(self) -> List[Dict[str, Any]]:
+        """Load the last provider health snapshot.
+        
+        Returns:
+            List of provider health rows
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                cursor.execute("SELECT * FROM provider_health")
+                return [self._provider_health_row(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to load provider health: {e}")
+            return []
+
+    def get_cached_response(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached AI response.
+        
+        Args:
+            key: Cache key
+            
+        Returns:
+            Cached entry or None if not found
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                cursor.execute(
+                    "SELECT response, provider, model, created_at FROM response_cache WHERE key = ?",
+                    (key,)
+                )
                 row = cursor.fetchone()
-                return row["chat_history"] if row else ""
+                return dict(row) if row else None
         except Exception as e:
-            logger.error(f"Failed to get chat history for user '{username}': {e}")
-            return ""
+            logger.error(f"Failed to read response cache: {e}")
+            return None
+    
+    def put_cached_response(self, key: str, response: str, provider: str, model: str, created_at: float):
+        """Store an AI response in the cache.
+        
+        Args:
+            key: Cache key
+            response: Response text
+            provider: Provider that produced the response
+            model: Model that produced the response
+            created_at: Unix timestamp of the response
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                cursor.execute("""
+                    INSERT OR REPLACE INTO response_cache (key, response, provider, model, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (key, response, provider, model, created_at))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to write response cache: {e}")
+    
+    def prune_response_cache(self, max_entries: int, expired_before: float) -> int:
+        """Remove expired entries and cap the response cache size.
+        
+        Args:
+            max_entries: Number of newest entries to keep
+            expired_before: Entries created before this timestamp are removed
+            
+        Returns:
+            Number of entries removed
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                cursor.execute("DELETE FROM response_cache WHERE created_at < ?", (expired_before,))
+                removed = cursor.rowcount
+                cursor.execute("""
+                    DELETE FROM response_cache WHERE key IN (
+                        SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (max_entries,))
+                removed += cursor.rowcount
+                conn.commit()
+                return removed
+        except Exception as e:
+            logger.error(f"Failed to prune response cache: {e}")
+            return 0
+
+class AsyncDatabaseManager:
+    """Awaitable access to the database for coroutines.
+    
+    SQLite calls block the calling thread; made from a coroutine they would
+    stall every other coroutine on the event loop. Here they run on a
+    dedicated thread pool instead. Every DatabaseManager method is available
+    as a coroutine (``await async_db.get_messages(...)``), and ``run`` offloads
+    any other blocking callable that reads or writes the database.
+    """
+    
+    def __init__(self, db: DatabaseManager, max_workers: int = 4):
+        """Initialize async database manager.
+        
+        Args:
+            db: Database manager to run calls on
+            max_workers: Threads running database calls
+        """
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+    
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking callable on the database threads.
+        
+        Args:
+            func: Callable to run
+            *args: Positional arguments
+            **kwargs: Keyword arguments
+        
+        Returns:
+            The callable's result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+    
+    def __getattr__(self, name: str):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+        
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        return call
+    
+    def shutdown(self, wait: bool = True):
+        """Stop the database threads after the calls already queued."""
+        self._executor.shutdown(wait=wait)
 
-# Global database manager instance
+# Global database manager instances
 db_manager = DatabaseManager()
+async_db_manager = AsyncDatabaseManager(db_manager, max_workers=config.database.async_workers)
@@ -0,0 +1,158 @@
+"""Background provider health prober.
+
+Sends cheap canary prompts to enabled providers on a schedule so the
+provider monitor already knows which providers are up before real users
+hit them (e.g. right after a restart or after a provider recovers).
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import config
+from utils.helpers import create_dummy_cookies
+from utils.logging import logger
+from utils.provider_monitor import provider_monitor
+
+class HealthProber:
+    """Periodically probe providers with synthetic canary prompts."""
+    
+    def __init__(self, service=None, probe_config=None):
+        """Initialize health prober.
+        
+        Args:
+            service: AI service used to make calls (defaults to the global one)
+            probe_config: Probe configuration (defaults to config.probe)
+        """
+        self._service = service
+        self.config = probe_config or config.probe
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._next_slot = 0.0
+    
+    @property
+    def service(self):
+        """AI service used for probe calls."""
+        if self._service is None:
+            from ai_service import ai_service
+            self._service = ai_service
+        return self._service
+    
+    def start(self):
+        """Start probing in a background thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="health-prober", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Health prober started (interval: {self.config.interval}s, "
+            f"concurrency: {self.config.concurrency})"
+        )
+    
+    def stop(self):
+        """Stop probing."""
+        self._stop_event.set()
+    
+    def _run(self):
+        """Thread entry point: run probe rounds on the service loop until stopped."""
+        while not self._stop_event.is_set():
+            try:
+                future = asyncio.run_coroutine_threadsafe(self.run_round(), self.service.get_service_loop())
+                future.result()
+            except Exception as e:
+                logger.warning(f"Health probe round failed: {e}")
+            self._stop_event.wait(self.config.interval)
+    
+    def get_probe_targets(self) -> List[str]:
+        """Get providers that need a probe this round.
+        
+        Providers that are blacklisted, rate limited, or that already saw
+        traffic during the last half interval are skipped.
+        """
+        targets = []
+        recent = time.time() - self.config.interval / 2
+        
+        for provider_name in self.service.config.available_providers:
+            if provider_name == "Auto" or provider_monitor.is_provider_blacklisted(provider_name):
+                continue
+            if not provider_monitor.is_available(provider_name):
+                continue
+            
+            health = provider_monitor.get_provider_health(provider_name)
+            last_seen = max(health.last_success or 0, health.last_failure or 0)
+            if last_seen >= recent:
+                continue
+            
+            targets.append(provider_name)
+        
+        return targets
+    
+    async def _wait_for_rate_slot(self):
+        """Space probe starts according to max_probes_per_minute."""
+        if self.config.max_probes_per_minute <= 0:
+            return
+        
+        spacing = 60.0 / self.config.max_probes_per_minute
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + spacing
+        if slot > now:
+            await asyncio.sleep(slot - now)
+    
+    async def probe_provider(self, provider_name: str) -> bool:
+        """Send one canary prompt to a provider.
+        
+        Args:
+            provider_name: Provider name
+        
+        Returns:
+            True if the provider answered
+        """
+        ai_provider = self.service.config.available_providers.get(provider_name)
+        if not ai_provider:
+            return False
+        
+        response = await self.service._make_api_call(
+            [{"role": "user", "content": self.config.prompt}],
+            ai_provider,
+            self.service.config.api.default_model,
+            create_dummy_cookies(),
+            None,
+            provider_name,
+            timeout=self.config.timeout,
+            probe=True
+        )
+        logger.debug(f"Health probe for {provider_name}: {'ok' if response else 'failed'}")
+        return response is not None
+    
+    async def run_round(self) -> Dict[str, bool]:
+        """Probe every target provider once.
+        
+        Returns:
+            Mapping of provider name to probe outcome
+        """
+        semaphore = asyncio.Semaphore(max(1, self.config.concurrency))
+        results: Dict[str, bool] = {}
+        
+        async def probe(provider_name: str):
+            async with semaphore:
+                await self._wait_for_rate_slot()
+                try:
+                    results[provider_name] = await self.probe_provider(provider_name)
+                except Exception as e:
+                    logger.warning(f"Health probe for {provider_name} raised: {e}")
+                    results[provider_name] = False
+        
+        targets = self.get_probe_targets()
+        await asyncio.gather(*(probe(name) for name in targets))
+        
+        if results:
+            healthy = sum(1 for ok in results.values() if ok)
+            logger.info(f"Health probe round: {healthy}/{len(results)} providers answered")
+        return results
+
+# Global health prober instance
+health_prober = HealthProber()
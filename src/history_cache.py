@@ -0,0 +1,162 @@
+"""Cache of users' chat histories.
+
+Messages are stored one row per message. The cache keeps each user's
+conversation in memory together with the sequence numbers of its first and
+last message; a turn then only reads the rows added since (normally none),
+plus the first row to check the cached copy still starts where it did.
+
+With a history writer, appends are queued and stored in batches; reads add
+the queued messages to the stored ones.
+"""
+
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from config import config
+from database import DEFAULT_CONVERSATION, db_manager
+from history_writer import HistoryWriter
+from utils.lru import LRUCache
+
+@dataclass
+class _HistoryEntry:
+    """Messages of a conversation with the sequence numbers they span."""
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    first_seq: Optional[int] = None
+    last_seq: int = 0
+    size: int = 0
+    
+    def extend(self, rows: List[Dict[str, Any]]):
+        """Add rows read or written after last_seq (rows already held are skipped)."""
+        for row in rows:
+            if row["seq"] <= self.last_seq:
+                continue
+            self.messages.append({"role": row["role"], "content": row["content"]})
+            self.size += len(row["content"]) + 64  # Plus dict and string overhead
+            if self.first_seq is None:
+                self.first_seq = row["seq"]
+            self.last_seq = row["seq"]
+
+def _sizeof_entry(entry: _HistoryEntry) -> int:
+    return entry.size
+
+class HistoryCache:
+    """Per-user LRU of chat histories, bounded by approximate size."""
+    
+    def __init__(self, db=None, history_config=None, writer: Optional[HistoryWriter] = None):
+        """Initialize history cache.
+        
+        Args:
+            db: Database manager (defaults to the global one)
+            history_config: History storage configuration (defaults to config.history)
+            writer: Write-behind queue for appends (appends are written immediately if None)
+        """
+        self.db = db or db_manager
+        self.config = history_config or config.history
+        self.writer = writer
+        self._entries = LRUCache(
+            max_entries=self.config.cache_entries,
+            max_bytes=self.config.cache_max_bytes,
+            sizeof=_sizeof_entry
+        )
+        self._lock = threading.Lock()
+    
+    def get_messages(self, username: str, conversation_id: str = DEFAULT_CONVERSATION) -> List[Dict[str, str]]:
+        """Get the messages of a user's conversation.
+        
+        Args:
+            username: Username
+            conversation_id: Conversation to read
+        
+        Returns:
+            Previous messages (a new list; the message dicts are shared)
+        """
+        if self.writer is None:
+            return self._stored_messages(username, conversation_id)
+        
+        key = (username, conversation_id)
+        while True:
+            flushes = self.writer.flush_count(key)
+            stored = self._stored_messages(username, conversation_id)
+            pending = self.writer.pending_messages(key, flushes)
+            if pending is not None:
+                return stored + pending
+            # Queued messages were stored while reading; read again to include them once
+    
+    def _stored_messages(self, username: str, conversation_id: str) -> List[Dict[str, str]]:
+        """Get the stored messages of a conversation, topping up the cached copy."""
+        key = (username, conversation_id)
+        with self._lock:
+            entry = self._entries.get(key)
+        
+        if entry is not None and entry.first_seq is not None:
+            rows = self.db.get_messages(
+                username, conversation_id, after_seq=entry.last_seq, anchor_seq=entry.first_seq
+            )
+            anchor = entry.messages[0]
+            if rows and rows[0]["seq"] == entry.first_seq and rows[0]["role"] == anchor["role"] \
+                    and rows[0]["content"] == anchor["content"]:
+                with self._lock:
+                    entry.extend(rows[1:])
+                    self._entries.resize(key)
+                    return list(entry.messages)
+            # The conversation was trimmed or replaced; read it again in full
+            entry = None
+        
+        rows = self.db.get_messages(username, conversation_id)
+        with self._lock:
+            entry = _HistoryEntry()
+            entry.extend(rows)
+            self._entries.put(key, entry)
+            return list(entry.messages)
+    
+    def append(
+        self,
+        username: str,
+        new_messages: List[Dict[str, str]],
+        conversation_id: str = DEFAULT_CONVERSATION
+    ):
+        """Append messages to a user's conversation.
+        
+        Only the new messages are written (or queued, with a writer); the
+        cached copy is extended when no other writer appended in between
+        (otherwise the next read catches up).
+        
+        Args:
+            username: Username
+            new_messages: Messages to append
+            conversation_id: Conversation to append to
+        """
+        if self.writer is not None:
+            self.writer.enqueue(
+                (username, conversation_id),
+                [{"role": msg["role"], "content": str(msg["content"])} for msg in new_messages]
+            )
+            return
+        
+        first_seq = self.db.append_messages(username, new_messages, conversation_id)
+        if first_seq is None:
+            return
+        
+        key = (username, conversation_id)
+        with self._lock:
+            entry = self._entries.peek(key)
+            if entry is not None and entry.last_seq == first_seq - 1:
+                entry.extend([
+                    {"seq": first_seq + i, "role": msg["role"], "content": str(msg["content"])}
+                    for i, msg in enumerate(new_messages)
+                ])
+                self._entries.resize(key)
+    
+    def flush(self):
+        """Store queued messages now (no-op without a writer)."""
+        if self.writer is not None:
+            self.writer.flush()
+    
+    def invalidate(self, username: str, conversation_id: str = DEFAULT_CONVERSATION):
+        """Forget a user's cached conversation."""
+        with self._lock:
+            self._entries.pop((username, conversation_id))
+
+# Global history cache instance
+history_cache = HistoryCache(writer=HistoryWriter() if config.history.write_behind else None)
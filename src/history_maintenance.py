@@ -0,0 +1,103 @@
+"""Background retention and compaction of stored chat history.
+
+Every retention interval the oldest messages beyond the configured limits
+(messages per user, age, total bytes) are deleted in small transactions.
+Free pages are then returned to the filesystem and planner statistics
+refreshed, once the database has seen no writes for a while. Nothing runs
+unless a limit is configured.
+"""
+
+import atexit
+import threading
+import time
+from typing import Optional
+
+from config import config
+from database import db_manager
+from utils.logging import logger
+
+class HistoryMaintenance:
+    """Prune chat history past its retention limits and compact the database."""
+    
+    def __init__(self, db=None, history_config=None):
+        """Initialize history maintenance.
+        
+        Args:
+            db: Database manager (defaults to the global one)
+            history_config: History storage configuration (defaults to config.history)
+        """
+        self.db = db or db_manager
+        self.config = history_config or config.history
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+    
+    @property
+    def enabled(self) -> bool:
+        """Whether any retention limit is configured."""
+        return bool(self.config.max_messages_per_user or self.config.max_age_days or self.config.max_total_bytes)
+    
+    def prune(self) -> int:
+        """Delete messages beyond the retention limits.
+        
+        Returns:
+            Number of deleted messages
+        """
+        try:
+            return self.db.prune_messages(
+                max_messages_per_user=self.config.max_messages_per_user,
+                max_age=self.config.max_age_days * 86400,
+                max_total_bytes=self.config.max_total_bytes,
+                batch_size=self.config.retention_batch,
+                pause=0.01
+            )
+        except Exception as e:
+            logger.warning(f"Could not prune chat history: {e}")
+            return 0
+    
+    def compact(self):
+        """Release free pages and refresh query planner statistics."""
+        try:
+            self.db.compact()
+        except Exception as e:
+            logger.warning(f"Could not compact database: {e}")
+    
+    def start(self):
+        """Start periodic maintenance, if a retention limit is configured."""
+        if not self.enabled:
+            logger.debug("No chat history retention limit configured, maintenance not started")
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="history-maintenance", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+    
+    def stop(self):
+        """Stop periodic maintenance."""
+        self._stop_event.set()
+    
+    def _run(self):
+        """Thread entry point: prune every interval, compact when the database is quiet."""
+        next_prune = time.monotonic() + self.config.quiet_seconds
+        compact_due = False
+        last_version = self.db.data_version()
+        while not self._stop_event.wait(self.config.quiet_seconds):
+            version = self.db.data_version()
+            quiet, last_version = version == last_version, version
+            
+            if time.monotonic() >= next_prune:
+                self.prune()
+                compact_due = True
+                next_prune = time.monotonic() + self.config.retention_interval
+            elif compact_due and quiet:
+                self.compact()
+                compact_due = False
+            else:
+                continue
+            # Our own writes are not traffic
+            last_version = self.db.data_version()
+
+# Global history maintenance instance
+history_maintenance = HistoryMaintenance()
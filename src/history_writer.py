@@ -0,0 +1,187 @@
+"""Write-behind persistence of chat history.
+
+Appending a turn commits (and fsyncs) a transaction. With write-behind
+enabled, new messages are queued in memory instead and a background thread
+writes everything queued in one transaction every flush interval, or as soon
+as enough messages are waiting. Reads merge the queued messages, so a user
+always sees their own latest turn.
+"""
+
+import atexit
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import config
+from database import db_manager
+from utils.exceptions import DatabaseError
+from utils.logging import logger
+
+ConversationKey = Tuple[str, str]  # (username, conversation_id)
+
+class HistoryWriter:
+    """Bounded queue of chat messages written to the database in batches."""
+    
+    def __init__(self, db=None, history_config=None):
+        """Initialize history writer.
+        
+        Args:
+            db: Database manager (defaults to the global one)
+            history_config: History storage configuration (defaults to config.history)
+        """
+        self.db = db or db_manager
+        self.config = history_config or config.history
+        self._pending: Dict[ConversationKey, List[Dict[str, str]]] = {}
+        self._inflight: Dict[ConversationKey, List[Dict[str, str]]] = {}
+        self._pending_count = 0
+        self._flushes: Dict[ConversationKey, int] = {}  # Completed writes per conversation
+        self._failures: Dict[ConversationKey, int] = {}  # Failed writes of queued messages per conversation
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._atexit_registered = False
+    
+    def enqueue(self, key: ConversationKey, messages: List[Dict[str, str]]):
+        """Queue messages to append to a conversation.
+        
+        Blocks while max_pending_messages are already waiting to be written,
+        for at most enqueue_timeout seconds.
+        
+        Args:
+            key: (username, conversation_id)
+            messages: Messages to append
+        
+        Raises:
+            DatabaseError: The queue stayed full (the database is not keeping up or failing)
+        """
+        if not messages:
+            return
+        
+        self._ensure_started()
+        with self._cond:
+            deadline = time.monotonic() + self.config.enqueue_timeout
+            while self._pending_count >= self.config.max_pending_messages and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.error(f"Chat history queue stayed full for {self.config.enqueue_timeout}s")
+                    raise DatabaseError("Chat history could not be saved: the write queue is full")
+                self._cond.notify_all()
+                self._cond.wait(remaining)
+            self._pending.setdefault(key, []).extend(messages)
+            self._pending_count += len(messages)
+            if self._pending_count >= self.config.flush_messages:
+                self._cond.notify_all()
+    
+    def flush_count(self, key: ConversationKey) -> int:
+        """Number of completed writes of a conversation (changes whenever its queued messages are stored)."""
+        with self._cond:
+            return self._flushes.get(key, 0)
+    
+    def pending_messages(self, key: ConversationKey, flush_count: int) -> Optional[List[Dict[str, str]]]:
+        """Get the messages of a conversation not yet stored.
+        
+        Waits for a write of the conversation that is in progress.
+        
+        Args:
+            key: (username, conversation_id)
+            flush_count: flush_count() taken before the caller read the stored messages
+        
+        Returns:
+            Queued messages, or None if a write completed since flush_count
+            (the caller's stored messages are out of date)
+        """
+        with self._cond:
+            while key in self._inflight:
+                self._cond.wait()
+            if self._flushes.get(key, 0) != flush_count:
+                return None
+            return list(self._pending.get(key, ()))
+    
+    def flush(self) -> int:
+        """Write everything queued now.
+        
+        Returns:
+            Number of messages written
+        """
+        with self._cond:
+            # Only one batch is written at a time
+            while self._inflight:
+                self._cond.wait()
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+        if not batch:
+            return 0
+        
+        count = sum(len(messages) for messages in batch.values())
+        try:
+            self.db.append_message_batch(batch)
+        except Exception as e:
+            logger.error(f"Could not write {count} queued chat messages: {e}")
+            with self._cond:
+                dropped = 0
+                for key, messages in batch.items():
+                    self._failures[key] = self._failures.get(key, 0) + 1
+                    if self._failures[key] < self.config.max_write_attempts:
+                        self._pending[key] = messages + self._pending.get(key, [])
+                        continue
+                    # Give up on these messages so the queue cannot stay full forever
+                    del self._failures[key]
+                    self._flushes[key] = self._flushes.get(key, 0) + 1
+                    dropped += len(messages)
+                self._pending_count -= dropped
+                self._inflight = {}
+                self._cond.notify_all()
+            if dropped:
+                logger.error(f"Dropped {dropped} chat messages after {self.config.max_write_attempts} failed writes")
+            return 0
+        
+        with self._cond:
+            for key in batch:
+                self._flushes[key] = self._flushes.get(key, 0) + 1
+                self._failures.pop(key, None)
+            self._inflight = {}
+            self._pending_count -= count
+            self._cond.notify_all()
+        logger.debug(f"Wrote {count} queued chat messages for {len(batch)} conversations")
+        return count
+    
+    def _ensure_started(self):
+        """Start the background writer on first use."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+    
+    def _run(self):
+        """Thread entry point: write queued messages until stopped."""
+        interval = self.config.flush_interval_ms / 1000
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + interval
+                while not self._stopping and self._pending_count < self.config.flush_messages:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                stopping = self._stopping
+            if not self.flush() and self._pending and not stopping:
+                time.sleep(interval)  # The write failed; do not spin on it
+            if stopping:
+                return
+    
+    def stop(self):
+        """Stop the background writer after writing everything queued."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=10)
+        self.flush()
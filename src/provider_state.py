@@ -0,0 +1,109 @@
+"""Persistence of provider health state across restarts and processes.
+
+Snapshots the global provider monitor into settings.db periodically and on
+shutdown, and restores it at startup so routing starts from the last known
+provider health instead of treating every provider as unknown.
+
+In shared mode every worker process pushes its pending changes to the same
+table about once a second and pulls back the merged state, so a failure seen
+by one worker is visible to all of them while routing keeps reading the
+in-memory monitor.
+"""
+
+import atexit
+import threading
+from typing import Optional
+
+from config import config
+from database import db_manager
+from utils.logging import logger
+from utils.provider_monitor import provider_monitor
+
+class ProviderStateStore:
+    """Save and restore provider monitor state."""
+    
+    def __init__(self, db=None, monitor=None, monitor_config=None):
+        """Initialize provider state store.
+        
+        Args:
+            db: Database manager (defaults to the global one)
+            monitor: Provider monitor (defaults to the global one)
+            monitor_config: Persistence configuration (defaults to config.monitor)
+        """
+        self.db = db or db_manager
+        self.monitor = monitor or provider_monitor
+        self.config = monitor_config or config.monitor
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+    
+    def restore(self) -> int:
+        """Restore the last snapshot into the provider monitor.
+        
+        Returns:
+            Number of providers restored
+        """
+        rows = self.db.load_provider_health()
+        restored = self.monitor.restore_state(
+            rows,
+            half_life=self.config.decay_half_life,
+            max_age=self.config.max_state_age
+        )
+        if restored:
+            logger.info(f"Restored health state for {restored} providers")
+        return restored
+    
+    def save(self):
+        """Snapshot the provider monitor into the database."""
+        try:
+            self.db.save_provider_health(self.monitor.export_state())
+        except Exception as e:
+            logger.warning(f"Could not save provider health snapshot: {e}")
+    
+    def sync(self):
+        """Push local changes to the shared table and pull everyone else's."""
+        deltas = self.monitor.take_deltas()
+        try:
+            rows = self.db.sync_provider_health(deltas)
+        except Exception as e:
+            logger.warning(f"Could not sync shared provider health ({len(deltas)} pending changes dropped): {e}")
+            return
+        
+        self.monitor.apply_shared_state(
+            rows,
+            half_life=self.config.decay_half_life,
+            max_age=self.config.max_state_age
+        )
+    
+    def start(self):
+        """Start periodic snapshots (or shared syncs) and save once more on shutdown."""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        if self.config.shared:
+            self.monitor.track_deltas = True
+            logger.info(f"Sharing provider health across workers (sync every {self.config.sync_interval}s)")
+        
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="provider-state", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+    
+    def stop(self):
+        """Stop periodic snapshots and write a final one."""
+        self._stop_event.set()
+        if self.config.shared:
+            self.sync()
+        else:
+            self.save()
+    
+    def _run(self):
+        """Thread entry point: snapshot (or sync) until stopped."""
+        if self.config.shared:
+            while not self._stop_event.wait(self.config.sync_interval):
+                self.sync()
+        else:
+            while not self._stop_event.wait(self.config.snapshot_interval):
+                self.save()
+
+# Global provider state store instance
+provider_state = ProviderStateStore()
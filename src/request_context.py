@@ -0,0 +1,73 @@
+"""Per-request context resolved once and passed down the request pipeline."""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from config import config
+from database import db_manager
+from utils.exceptions import ValidationError
+
+@dataclass(frozen=True)
+class RequestContext:
+    """Who is asking and with which effective settings."""
+    username: str
+    provider: str
+    model: str
+    system_prompt: str = ""
+    message_history: bool = False  # Whether the conversation history is sent and extended
+
+def resolve_request_context(
+    username: str = "admin",
+    use_history: bool = False,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    system_prompt: Optional[str] = None,
+    db=None
+) -> RequestContext:
+    """Resolve a user's effective settings with as few reads as possible.
+    
+    Admin settings come from the cached settings snapshot; a virtual user's
+    settings come from a single row read. The conversation history itself is
+    read from the history cache only when it is used.
+    
+    Args:
+        username: Username ('admin' for the admin user)
+        use_history: Whether the server allows chat history
+        provider: AI provider override
+        model: AI model override
+        system_prompt: System prompt override
+        db: Database manager (defaults to the global one)
+    
+    Returns:
+        Resolved request context
+    
+    Raises:
+        ValidationError: If the user does not exist
+    """
+    db = db or db_manager
+    
+    if username == "admin":
+        settings = db.get_settings()
+        history_enabled = use_history and settings.get("message_history", False)
+        return RequestContext(
+            username=username,
+            provider=provider or settings.get("provider", config.api.default_provider),
+            model=model or settings.get("model", config.api.default_model),
+            system_prompt=system_prompt or settings.get("system_prompt", ""),
+            message_history=history_enabled
+        )
+    
+    user_data = db.get_user_by_username(
+        username, fields=("provider", "model", "system_prompt", "message_history")
+    )
+    if not user_data:
+        raise ValidationError(f"User '{username}' not found")
+    
+    history_enabled = use_history and user_data.get("message_history", False)
+    return RequestContext(
+        username=username,
+        provider=provider or user_data.get("provider", config.api.default_provider),
+        model=model or user_data.get("model", config.api.default_model),
+        system_prompt=system_prompt or user_data.get("system_prompt", ""),
+        message_history=history_enabled
+    )
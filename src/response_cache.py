@@ -0,0 +1,235 @@
+"""Two-tier response cache for stateless prompts.
+
+Identical prompts sent to the same provider and model are answered from an
+in-memory LRU first and from a SQLite table second, so repeated questions do
+not cost an upstream call. Only requests without chat history are cached:
+their answer depends on nothing but the messages that make up the key.
+
+Optionally, a MinHash index also matches prompts that differ only in
+casing, punctuation, whitespace or small wording changes.
+
+Expired answers are kept for a while: they can be served immediately while
+a background refresh runs (stale-while-revalidate), or when every provider
+fails (stale-if-error).
+"""
+
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import config
+from database import db_manager
+from utils.logging import logger
+from utils.lru import LRUCache
+from utils.similarity import MinHashIndex
+
+@dataclass
+class CachedResponse:
+    """Cached AI answer."""
+    response: str
+    provider: str
+    model: str
+    created_at: float
+    
+    @property
+    def age(self) -> float:
+        """Seconds since the answer was generated."""
+        return time.time() - self.created_at
+
+class ResponseCache:
+    """In-memory LRU in front of a persistent SQLite response table."""
+    
+    def __init__(self, db=None, cache_config=None):
+        """Initialize response cache.
+        
+        Args:
+            db: Database manager for the persistent tier (defaults to the global one)
+            cache_config: Cache configuration (defaults to config.cache)
+        """
+        self.db = db or db_manager
+        self.config = cache_config or config.cache
+        self.memory = LRUCache(max_entries=self.config.memory_entries)
+        self._lock = threading.Lock()
+        self._stores_since_prune = 0
+        self.similar = MinHashIndex(
+            threshold=self.config.similarity_threshold,
+            max_entries=self.config.similarity_entries,
+            min_chars=self.config.similarity_min_chars
+        ) if self.config.similarity else None
+        self.stats = {
+            "memory_hits": 0, "disk_hits": 0, "similar_hits": 0, "stale_hits": 0,
+            "stale_if_error": 0, "misses": 0, "stores": 0
+        }
+    
+    @staticmethod
+    def make_key(messages: List[Dict[str, str]], provider: str, model: str, remove_sources: bool) -> str:
+        """Build the cache key for a request.
+        
+        Args:
+            messages: Messages sent upstream (system prompt included)
+            provider: Requested provider
+            model: Requested model
+            remove_sources: Whether sources are stripped from the answer
+        
+        Returns:
+            Hex digest identifying the request
+        """
+        payload = json.dumps(
+            {"messages": messages, "provider": provider, "model": model, "remove_sources": remove_sources},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+    
+    def is_fresh(self, entry: CachedResponse) -> bool:
+        """Check whether an answer is still within its TTL."""
+        return entry.age <= self.config.ttl
+    
+    def _lookup(self, key: str, max_stale: float) -> Tuple[Optional[CachedResponse], str]:
+        """Find an answer no older than the TTL plus max_stale.
+        
+        Returns:
+            Tuple of (entry or None, tier it came from)
+        """
+        max_age = self.config.ttl + max_stale
+        entry = self.memory.get(key)
+        if entry is not None and entry.age <= max_age:
+            return entry, "memory"
+        
+        row = self.db.get_cached_response(key)
+        if row:
+            entry = CachedResponse(row["response"], row["provider"], row["model"], row["created_at"])
+            if entry.age <= max_age:
+                self.memory.put(key, entry)
+                return entry, "disk"
+        return None, ""
+    
+    def get(self, key: str, max_stale: float = 0.0) -> Optional[CachedResponse]:
+        """Look up a cached answer.
+        
+        Args:
+            key: Cache key from make_key
+            max_stale: Seconds past the TTL an answer may still be returned
+        
+        Returns:
+            Cached answer (check is_fresh) or None on a miss
+        """
+        if not self.config.enabled:
+            return None
+        
+        entry, tier = self._lookup(key, max_stale)
+        if entry is None:
+            self._count("misses")
+        elif not self.is_fresh(entry):
+            self._count("stale_hits")
+        else:
+            self._count(f"{tier}_hits")
+        return entry
+    
+    def get_stale_if_error(self, key: str) -> Optional[CachedResponse]:
+        """Look up an expired answer to serve when every provider failed.
+        
+        Args:
+            key: Cache key from make_key
+        
+        Returns:
+            Cached answer within the stale-if-error window, or None
+        """
+        if not self.config.enabled or self.config.stale_if_error <= 0:
+            return None
+        
+        entry, _ = self._lookup(key, self.config.stale_if_error)
+        if entry is not None:
+            self._count("stale_if_error")
+        return entry
+    
+    def get_similar(self, scope: str, prompt: str) -> Optional[Tuple[CachedResponse, float]]:
+        """Look up a fresh cached answer to a near-duplicate prompt.
+        
+        Args:
+            scope: Key of everything but the prompt (see make_key)
+            prompt: Latest user message
+        
+        Returns:
+            Tuple of (cached answer, similarity score) or None
+        """
+        if not self.config.enabled or self.similar is None or len(prompt) > self.config.similarity_max_chars:
+            return None
+        
+        match = self.similar.query(scope, prompt)
+        if match is None:
+            return None
+        
+        key, score = match
+        entry, _ = self._lookup(key, 0.0)
+        if entry is None:
+            self.similar.remove(key)
+            return None
+        
+        self._count("similar_hits")
+        return entry, score
+    
+    def put(
+        self,
+        key: str,
+        response: str,
+        provider: str,
+        model: str,
+        scope: Optional[str] = None,
+        prompt: Optional[str] = None
+    ):
+        """Store an answer in both tiers.
+        
+        Args:
+            key: Cache key from make_key
+            response: Answer text
+            provider: Provider that was requested
+            model: Model that was requested
+            scope: Key of everything but the prompt, for near-duplicate matching
+            prompt: Latest user message, for near-duplicate matching
+        """
+        if not self.config.enabled or not response:
+            return
+        
+        entry = CachedResponse(response, provider, model, time.time())
+        self.memory.put(key, entry)
+        self.db.put_cached_response(key, response, provider, model, entry.created_at)
+        self._count("stores")
+        
+        if self.similar is not None and scope and prompt and len(prompt) <= self.config.similarity_max_chars:
+            self.similar.add(scope, prompt, key)
+        
+        with self._lock:
+            self._stores_since_prune += 1
+            prune = self._stores_since_prune >= self.config.prune_every
+            if prune:
+                self._stores_since_prune = 0
+        if prune:
+            # Keep expired answers around for as long as they may still be served stale
+            max_age = self.config.ttl + max(self.config.stale_while_revalidate, self.config.stale_if_error)
+            removed = self.db.prune_response_cache(self.config.disk_entries, time.time() - max_age)
+            if removed:
+                logger.debug(f"Pruned {removed} response cache entries")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache hit/miss statistics."""
+        with self._lock:
+            stats = dict(self.stats)
+        # Near-duplicate lookups only follow exact misses, so they are not extra lookups
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["stale_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"] + stats["stale_hits"] + stats["similar_hits"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        stats["similarity_entries"] = len(self.similar) if self.similar is not None else 0
+        stats["enabled"] = self.config.enabled
+        return stats
+
+# Global response cache instance
+response_cache = ResponseCache()
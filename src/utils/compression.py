@@ -0,0 +1,71 @@
+"""Compression of stored text with a leading format version byte.
+
+Plain strings are stored as TEXT and returned unchanged, so rows written
+before compression stay readable. Compressed values are BLOBs whose first
+byte names the codec.
+"""
+
+import zlib
+from typing import Union
+
+from .logging import logger
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+FORMAT_ZLIB = 1
+FORMAT_ZSTD = 2
+
+StoredText = Union[str, bytes]
+
+def compress_text(text: str, codec: str = "zlib", min_size: int = 256, level: int = 6) -> StoredText:
+    """Compress text for storage.
+    
+    Args:
+        text: Text to store
+        codec: "zlib", "zstd" (falls back to zlib if not installed) or "none"
+        min_size: Shorter texts (in bytes) are stored as they are
+        level: Compression level
+    
+    Returns:
+        Version byte and compressed data, or the text itself when
+        compression is disabled or would not make it smaller
+    """
+    data = text.encode("utf-8")
+    if codec == "none" or len(data) < min_size:
+        return text
+    
+    if codec == "zstd" and zstandard is not None:
+        stored = bytes([FORMAT_ZSTD]) + zstandard.ZstdCompressor(level=level).compress(data)
+    else:
+        stored = bytes([FORMAT_ZLIB]) + zlib.compress(data, level)
+    return stored if len(stored) < len(data) else text
+
+def decompress_text(stored: StoredText) -> str:
+    """Read text stored by compress_text.
+    
+    Args:
+        stored: Stored value (plain text or version byte and compressed data)
+    
+    Returns:
+        Original text
+    
+    Raises:
+        ValueError: Unknown format, or zstd data without zstandard installed
+    """
+    if isinstance(stored, str):
+        return stored
+    if not stored:
+        return ""
+    
+    version, data = stored[0], bytes(stored[1:])
+    if version == FORMAT_ZLIB:
+        return zlib.decompress(data).decode("utf-8")
+    if version == FORMAT_ZSTD:
+        if zstandard is None:
+            logger.error("Stored text is zstd-compressed but the zstandard module is not installed")
+            raise ValueError("zstd-compressed text requires the zstandard module")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    raise ValueError(f"Unknown stored text format {version}")
@@ -0,0 +1,304 @@
+"""Cached cookie jars loaded from cookie files, and a rotating pool of account cookies."""
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .helpers import create_dummy_cookies
+from .logging import logger
+
+DEFAULT_SET = "default"
+
+@dataclass
+class CookieJar:
+    """Cookie sets from one cookie file.
+    
+    A cookie file holds either one flat ``{"name": "value"}`` set used for
+    every provider, a browser export (list of ``{"name", "value"}`` objects),
+    or per-provider sets such as ``{"OpenaiChat": {...}, "default": {...}}``.
+    """
+    sets: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    
+    def for_provider(self, provider_name: Optional[str]) -> Dict[str, str]:
+        """Get the cookies to send to a provider.
+        
+        Args:
+            provider_name: Provider name
+        
+        Returns:
+            The provider's own set, the default set, or dummy cookies
+        """
+        if provider_name and provider_name in self.sets:
+            return dict(self.sets[provider_name])
+        return dict(self.sets.get(DEFAULT_SET) or create_dummy_cookies())
+    
+    def __len__(self) -> int:
+        return sum(len(cookies) for cookies in self.sets.values())
+
+def _flatten(value: Any) -> Dict[str, str]:
+    """Turn a flat mapping or a browser cookie export into name/value pairs."""
+    if isinstance(value, dict):
+        return {str(name): str(cookie) for name, cookie in value.items()}
+    if isinstance(value, list):
+        return {
+            str(item["name"]): str(item.get("value", ""))
+            for item in value
+            if isinstance(item, dict) and "name" in item
+        }
+    return {}
+
+def parse_cookie_data(data: Any) -> CookieJar:
+    """Parse the content of a cookie file.
+    
+    Args:
+        data: Decoded JSON content
+    
+    Returns:
+        Cookie jar (empty if the content holds no cookies)
+    """
+    if isinstance(data, dict) and data and all(isinstance(value, (dict, list)) for value in data.values()):
+        sets = {name: _flatten(value) for name, value in data.items()}
+        return CookieJar({name: cookies for name, cookies in sets.items() if cookies})
+    
+    cookies = _flatten(data)
+    return CookieJar({DEFAULT_SET: cookies} if cookies else {})
+
+class CookieStore:
+    """Cookie jars cached per file, reloaded when the file changes."""
+    
+    def __init__(self, check_interval: float = 1.0):
+        """Initialize cookie store.
+        
+        Args:
+            check_interval: Minimum seconds between checks of a file for changes
+        """
+        self.check_interval = check_interval
+        self._jars: Dict[str, Tuple[Optional[Tuple[int, int]], float, CookieJar]] = {}
+        self._lock = threading.Lock()
+    
+    def get_jar(self, cookie_file: Optional[str]) -> CookieJar:
+        """Get the cookie jar of a file.
+        
+        The file is only re-read when its modification time or size changed;
+        it is stat'ed at most once per check_interval.
+        
+        Args:
+            cookie_file: Cookie file path or None
+        
+        Returns:
+            Cookie jar (empty when there is no usable cookie file)
+        """
+        if not cookie_file:
+            return CookieJar()
+        
+        now = time.monotonic()
+        with self._lock:
+            cached = self._jars.get(cookie_file)
+            if cached and now - cached[1] < self.check_interval:
+                return cached[2]
+            
+            try:
+                stat = os.stat(cookie_file)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature = None
+            
+            if cached and cached[0] == signature:
+                self._jars[cookie_file] = (signature, now, cached[2])
+                return cached[2]
+            
+            jar = self._load(cookie_file) if signature else CookieJar()
+            if not jar:
+                logger.warning(f"No cookies found in {cookie_file}, using dummy cookies")
+            else:
+                logger.debug(f"Loaded {len(jar)} cookies from {cookie_file}")
+            self._jars[cookie_file] = (signature, now, jar)
+            return jar
+    
+    def _load(self, cookie_file: str) -> CookieJar:
+        """Read and parse a cookie file."""
+        try:
+            with open(cookie_file, 'r', encoding='utf-8') as f:
+                return parse_cookie_data(json.load(f))
+        except (json.JSONDecodeError, IOError, UnicodeDecodeError) as e:
+            logger.warning(f"Failed to load cookie file {cookie_file}: {e}")
+            return CookieJar()
+    
+    def invalidate(self, cookie_file: Optional[str] = None):
+        """Forget cached jars so the next request re-reads the file.
+        
+        Args:
+            cookie_file: File to forget (all files if None)
+        """
+        with self._lock:
+            if cookie_file is None:
+                self._jars.clear()
+            else:
+                self._jars.pop(cookie_file, None)
+
+@dataclass
+class CookieSet:
+    """One account's cookies for one provider, with usage and health."""
+    name: str
+    provider: str
+    cookies: Dict[str, str]
+    in_flight: int = 0
+    last_used: float = 0.0
+    cooldown_until: float = 0.0
+    success_count: int = 0
+    failure_count: int = 0
+    consecutive_failures: int = 0
+    last_error: Optional[str] = None
+    
+    def is_available(self, now: Optional[float] = None) -> bool:
+        """Check whether the set is outside its cooldown."""
+        return (now or time.monotonic()) >= self.cooldown_until
+
+class CookiePool:
+    """Rotate requests across several accounts' cookie sets.
+    
+    Each ``*.json`` file in the pool directory is one cookie set. The provider
+    it belongs to is read from a ``{"provider": ..., "cookies": ...}`` wrapper,
+    or else from the file name prefix (``OpenaiChat.alice.json``). Requests get
+    the least loaded, then least recently used, set that is not cooling down.
+    """
+    
+    def __init__(self, directory: Optional[str] = None, check_interval: float = 5.0):
+        """Initialize cookie pool.
+        
+        Args:
+            directory: Pool directory (no pool if None or missing)
+            check_interval: Minimum seconds between scans of the directory for changes
+        """
+        self.directory = directory
+        self.check_interval = check_interval
+        self._sets: Dict[str, CookieSet] = {}
+        self._signature: Optional[Tuple] = None
+        self._last_check = float("-inf")
+        self._lock = threading.Lock()
+    
+    def _scan(self):
+        """Reload cookie sets if the directory content changed (lock held)."""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        
+        directory = Path(self.directory) if self.directory else None
+        try:
+            files = sorted(directory.glob("*.json")) if directory and directory.is_dir() else []
+            signature = tuple((f.name, f.stat().st_mtime_ns, f.stat().st_size) for f in files)
+        except OSError as e:
+            logger.warning(f"Failed to scan cookie pool {self.directory}: {e}")
+            return
+        if signature == self._signature:
+            return
+        self._signature = signature
+        
+        sets = {}
+        for cookie_file in files:
+            try:
+                data = json.loads(cookie_file.read_text(encoding="utf-8"))
+            except (json.JSONDecodeError, IOError, UnicodeDecodeError) as e:
+                logger.warning(f"Skipping cookie set {cookie_file.name}: {e}")
+                continue
+            
+            if isinstance(data, dict) and "cookies" in data:
+                provider, cookies = data.get("provider") or cookie_file.name.split(".")[0], _flatten(data["cookies"])
+            else:
+                provider, cookies = cookie_file.name.split(".")[0], _flatten(data)
+            if not cookies:
+                continue
+            
+            # Keep usage and health of sets that survive a reload
+            previous = self._sets.get(cookie_file.name)
+            cookie_set = CookieSet(name=cookie_file.name, provider=provider, cookies=cookies)
+            if previous and previous.provider == provider:
+                for attr in ("in_flight", "last_used", "cooldown_until", "success_count",
+                             "failure_count", "consecutive_failures", "last_error"):
+                    setattr(cookie_set, attr, getattr(previous, attr))
+            sets[cookie_file.name] = cookie_set
+        
+        self._sets = sets
+        logger.info(f"Cookie pool loaded {len(sets)} cookie sets from {self.directory}")
+    
+    def has_sets(self, provider_name: str) -> bool:
+        """Check whether the pool holds any cookie set for a provider."""
+        with self._lock:
+            self._scan()
+            return any(cookie_set.provider == provider_name for cookie_set in self._sets.values())
+    
+    def acquire(self, provider_name: str) -> Optional[CookieSet]:
+        """Pick a cookie set for a request.
+        
+        Args:
+            provider_name: Provider name
+        
+        Returns:
+            Cookie set (release it when done), or None if none is available
+        """
+        with self._lock:
+            self._scan()
+            now = time.monotonic()
+            candidates = [
+                cookie_set for cookie_set in self._sets.values()
+                if cookie_set.provider == provider_name and cookie_set.is_available(now)
+            ]
+            if not candidates:
+                return None
+            
+            chosen = min(candidates, key=lambda cookie_set: (cookie_set.in_flight, cookie_set.last_used))
+            chosen.in_flight += 1
+            chosen.last_used = now
+            return chosen
+    
+    def release(self, cookie_set: CookieSet, error_type: Optional[str] = None, cooldown: Optional[float] = None):
+        """Return a cookie set after a request and record the outcome.
+        
+        Args:
+            cookie_set: Set returned by acquire
+            error_type: Classified error, or None on success
+            cooldown: Seconds to rest the set (e.g. from Retry-After)
+        """
+        with self._lock:
+            cookie_set.in_flight = max(0, cookie_set.in_flight - 1)
+            if error_type is None:
+                cookie_set.success_count += 1
+                cookie_set.consecutive_failures = 0
+                return
+            
+            cookie_set.failure_count += 1
+            cookie_set.consecutive_failures += 1
+            cookie_set.last_error = error_type
+            if cooldown:
+                cookie_set.cooldown_until = max(cookie_set.cooldown_until, time.monotonic() + cooldown)
+                logger.warning(
+                    f"Cookie set {cookie_set.name} for {cookie_set.provider} cooling down "
+                    f"for {cooldown:.0f}s after {error_type}"
+                )
+    
+    def get_status(self) -> List[Dict[str, Any]]:
+        """Get usage and health of every cookie set (cookie values excluded)."""
+        with self._lock:
+            self._scan()
+            now = time.monotonic()
+            return [
+                {
+                    "name": cookie_set.name,
+                    "provider": cookie_set.provider,
+                    "in_flight": cookie_set.in_flight,
+                    "success_count": cookie_set.success_count,
+                    "failure_count": cookie_set.failure_count,
+                    "consecutive_failures": cookie_set.consecutive_failures,
+                    "last_error": cookie_set.last_error,
+                    "cooldown_remaining": max(0.0, cookie_set.cooldown_until - now)
+                }
+                for cookie_set in self._sets.values()
+            ]
+
+# Global cookie store instance
+cookie_store = CookieStore()
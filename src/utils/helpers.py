@@ -1,8 +1,10 @@
 """Utility functions for FreeGPT4 Web API."""
 
 import json
+import os
 import random
 import re
+import tempfile
 from typing import Optional, Dict, Any, List
 from uuid import uuid4
 from pathlib import Path
@@ -36,8 +38,33 @@ def load_json_file(file_path: Path, default: Any = None) -> Any:
     
     return default
 
+def atomic_write_bytes(file_path: Path, data: bytes):
+    """Write a file so readers see either the old or the new content, never a mix.
+    
+    Args:
+        file_path: Destination path
+        data: File content
+        
+    Raises:
+        OSError: If the file cannot be written
+    """
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def save_json_file(file_path: Path, data: Any) -> bool:
-    """Save data to JSON file.
+    """Save data to JSON file atomically.
     
     Args:
         file_path: Path to JSON file
@@ -47,9 +74,7 @@ def save_json_file(file_path: Path, data: Any) -> bool:
         True if successful, False otherwise
     """
     try:
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        atomic_write_bytes(file_path, json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8'))
         return True
     except (IOError, TypeError) as e:
         logger.error(f"Failed to save JSON file {file_path}: {e}")
@@ -1,7 +1,9 @@
 """HTTP utilities for handling timeouts and retries."""
 
 import asyncio
+import re
 import time
+from email.utils import parsedate_to_datetime
 from typing import Optional, Dict, Any, Callable, Awaitable
 from functools import wraps
 
@@ -16,6 +18,112 @@ class TimeoutConfig:
     MAX_RETRIES = 3       # Maximum number of retries
     RETRY_DELAY = 2       # Delay between retries in seconds
     BACKOFF_FACTOR = 2    # Exponential backoff factor
+    RATE_LIMIT_COOLDOWN = 60      # Default wait when a provider rate-limits without a hint
+    MAX_RATE_LIMIT_COOLDOWN = 3600  # Upper bound for upstream-provided wait hints
+    UNAUTHORIZED_COOLDOWN = 1800  # Rest for a cookie set whose session was rejected
+
+_RATE_LIMIT_MARKERS = ("too many requests", "rate limit", "ratelimit", "rate-limit", "quota")
+# A 429 in the message only counts as a status code, not inside ids, ports or token counts
+_STATUS_429_PATTERN = re.compile(
+    r"(?:\b(?:status(?:[ _]?code)?|http(?:/[\d.]+)?|response|error|code)\W{0,3}|^\W*)429\b",
+    re.IGNORECASE
+)
+_RETRY_AFTER_HEADERS = ("retry-after", "x-ratelimit-reset", "x-ratelimit-reset-requests", "ratelimit-reset")
+_RETRY_HINT_PATTERN = re.compile(
+    r'(?:retry[- ]after|try again in|reset(?:s)? in)[:\s]*(\d+(?:\.\d+)?)\s*(ms|milliseconds?|s|secs?|seconds?|m|mins?|minutes?|h|hours?)?',
+    re.IGNORECASE
+)
+
+def classify_error(error: BaseException) -> str:
+    """Classify an upstream error into a coarse error type.
+    
+    Args:
+        error: Exception raised by the provider call
+        
+    Returns:
+        One of 'timeout', 'rate_limited', 'unauthorized', 'browser_required',
+        'network' or 'unknown'
+    """
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status", None) or getattr(response, "status_code", None)
+    if status == 429:
+        return "rate_limited"
+    
+    error_msg = str(error).lower()
+    if any(marker in error_msg for marker in _RATE_LIMIT_MARKERS) or _STATUS_429_PATTERN.search(error_msg):
+        return "rate_limited"
+    if "401" in error_msg or "unauthorized" in error_msg:
+        return "unauthorized"
+    if "chrome" in error_msg or "browser" in error_msg:
+        return "browser_required"
+    if "timeout" in error_msg or "too slow" in error_msg:
+        return "timeout"
+    if "connection" in error_msg or "network" in error_msg:
+        return "network"
+    return "unknown"
+
+def _parse_retry_value(value: str) -> Optional[float]:
+    """Parse a Retry-After / reset header value into seconds from now."""
+    value = str(value).strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        # HTTP-date form of Retry-After
+        try:
+            return parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    
+    # Large values are absolute epoch timestamps (x-ratelimit-reset style)
+    if seconds > 1_000_000_000:
+        return seconds - time.time()
+    return seconds
+
+def extract_retry_after(error: BaseException) -> Optional[float]:
+    """Extract an upstream wait hint from a rate-limit error.
+    
+    Looks at response headers exposed by aiohttp / curl_cffi / requests
+    exceptions first, then falls back to hints in the error message such as
+    "retry after 30s" or "try again in 2 minutes".
+    
+    Args:
+        error: Exception raised by the provider call
+        
+    Returns:
+        Seconds to wait, or None if no hint was found
+    """
+    header_sources = (getattr(error, "headers", None), getattr(getattr(error, "response", None), "headers", None))
+    for headers in header_sources:
+        if not headers:
+            continue
+        try:
+            lowered = {str(key).lower(): value for key, value in headers.items()}
+        except AttributeError:
+            continue
+        for header in _RETRY_AFTER_HEADERS:
+            if header in lowered:
+                seconds = _parse_retry_value(lowered[header])
+                if seconds is not None:
+                    return min(max(seconds, 0.0), TimeoutConfig.MAX_RATE_LIMIT_COOLDOWN)
+    
+    match = _RETRY_HINT_PATTERN.search(str(error))
+    if match:
+        seconds = float(match.group(1))
+        unit = (match.group(2) or "s").lower()
+        if unit.startswith("ms") or unit.startswith("milli"):
+            seconds /= 1000
+        elif unit.startswith("m"):
+            seconds *= 60
+        elif unit.startswith("h"):
+            seconds *= 3600
+        return min(seconds, TimeoutConfig.MAX_RATE_LIMIT_COOLDOWN)
+    
+    return None
 
 def timeout_handler(timeout_seconds: float = TimeoutConfig.DEFAULT_TIMEOUT):
     """Decorator to add timeout handling to async functions."""
@@ -72,6 +180,7 @@ async def safe_api_call(
     *args,
     timeout: float = TimeoutConfig.DEFAULT_TIMEOUT,
     max_retries: int = TimeoutConfig.MAX_RETRIES,
+    on_error: Optional[Callable[[str, BaseException], None]] = None,
     **kwargs
 ) -> Optional[Any]:
     """Safely call an API function with timeout and retry logic.
@@ -81,6 +190,7 @@ async def safe_api_call(
         *args: Positional arguments for the function
         timeout: Timeout in seconds
         max_retries: Maximum number of retries
+        on_error: Optional callback invoked with (error_type, exception) for every failed attempt
         **kwargs: Keyword arguments for the function
         
     Returns:
@@ -91,19 +201,26 @@ async def safe_api_call(
     for attempt in range(max_retries + 1):
         try:
             return await asyncio.wait_for(api_func(*args, **kwargs), timeout=timeout)
-        except asyncio.TimeoutError:
+        except asyncio.TimeoutError as e:
             logger.warning(f"API call timed out (attempt {attempt + 1}/{max_retries + 1})")
+            if on_error:
+                on_error("timeout", e)
         except Exception as e:
-            error_msg = str(e).lower()
+            error_type = classify_error(e)
+            if on_error:
+                on_error(error_type, e)
             
             # Check for specific error types
-            if "401" in error_msg or "unauthorized" in error_msg:
+            if error_type == "unauthorized":
                 logger.warning(f"API call returned unauthorized error: {e}")
                 return None  # Don't retry auth errors
-            elif "chrome" in error_msg or "browser" in error_msg:
+            elif error_type == "browser_required":
                 logger.warning(f"API call requires browser: {e}")
                 return None  # Don't retry browser errors
-            elif "too slow" in error_msg or "timeout" in error_msg:
+            elif error_type == "rate_limited":
+                logger.warning(f"API call was rate limited: {e}")
+                return None  # Retrying straight away only burns more quota
+            elif error_type == "timeout":
                 logger.warning(f"API call connection timeout (attempt {attempt + 1}/{max_retries + 1}): {e}")
             else:
                 logger.warning(f"API call failed (attempt {attempt + 1}/{max_retries + 1}): {e}")
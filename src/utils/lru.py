@@ -0,0 +1,105 @@
+"""Bounded, thread-safe LRU cache."""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+class LRUCache:
+    """Least-recently-used cache bounded by entry count and, optionally, size."""
+    
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None
+    ):
+        """Initialize LRU cache.
+        
+        Args:
+            max_entries: Maximum number of entries
+            max_bytes: Optional maximum total size of the entries
+            sizeof: Function estimating the size of a value (required with max_bytes)
+            on_evict: Called with (key, value) when an entry is evicted for space
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda value: 0)
+        self._on_evict = on_evict
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value and mark it as recently used."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+    
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value without changing its recency."""
+        with self._lock:
+            return self._data.get(key, default)
+    
+    def put(self, key: Hashable, value: Any):
+        """Insert or replace a value, evicting least recently used entries."""
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.total_bytes -= self._sizes.pop(key)
+                del self._data[key]
+            
+            # Values larger than the whole budget are not cached at all
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            
+            self._data[key] = value
+            self._sizes[key] = size
+            self.total_bytes += size
+            self._evict()
+    
+    def resize(self, key: Hashable):
+        """Re-measure a value that was changed in place."""
+        with self._lock:
+            if key not in self._data:
+                return
+            size = self._sizeof(self._data[key])
+            self.total_bytes += size - self._sizes[key]
+            self._sizes[key] = size
+            self._evict()
+    
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a value and return it."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self.total_bytes -= self._sizes.pop(key)
+            return self._data.pop(key)
+    
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+    
+    def _evict(self):
+        """Drop least recently used entries until within bounds (lock held)."""
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            key, value = self._data.popitem(last=False)
+            self.total_bytes -= self._sizes.pop(key)
+            if self._on_evict:
+                self._on_evict(key, value)
+    
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+    
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,8 +1,10 @@
 """Provider health monitoring and management."""
 
+import math
+import threading
 import time
-from typing import Dict, List, Optional, Set
-from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
 from enum import Enum
 
 from .logging import logger
@@ -14,6 +16,86 @@ class ProviderStatus(Enum):
     UNHEALTHY = "unhealthy"
     UNKNOWN = "unknown"
 
+# Error types that signal the provider is overloaded rather than broken
+CONGESTION_ERRORS = {"timeout", "rate_limited"}
+
+@dataclass
+class AdaptiveLimit:
+    """AIMD concurrency limit learned from congestion errors.
+    
+    A provider starts unlimited (up to max_limit). On a congestion signal
+    (timeout, rate limit) the limit is cut multiplicatively, at most once
+    per window: signals from calls started before the last cut belong to
+    the same congestion and are ignored. It never drops below the most
+    calls that were in flight before the first congestion, grows by roughly
+    one slot per window of successful calls, and is lifted again once no
+    cut happened for relax_after seconds. Latency is only tracked for
+    statistics: it follows the length of the answer, so it says little
+    about queueing upstream.
+    """
+    limit: Optional[float] = None  # None until the first congestion signal
+    min_limit: float = 1.0
+    max_limit: float = 64.0
+    backoff_ratio: float = 0.5
+    relax_after: float = 300.0
+    in_flight: int = 0
+    peak_in_flight: int = 0        # Most calls in flight while unlimited
+    floor: float = 1.0             # Lowest limit, set at the first congestion
+    last_cut: Optional[float] = None  # Monotonic time of the last cut
+    latency_ewma: Optional[float] = None
+    min_latency: Optional[float] = None
+    
+    @property
+    def headroom(self) -> int:
+        """Number of additional concurrent calls currently allowed."""
+        self._relax()
+        limit = self.max_limit if self.limit is None else self.limit
+        return max(0, int(limit) - self.in_flight)
+    
+    def acquire(self):
+        """Count a call that was let through."""
+        self.in_flight += 1
+        if self.limit is None:
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+    
+    def _relax(self):
+        """Lift a limit that has not been cut for relax_after seconds."""
+        if self.limit is not None and self.last_cut is not None \
+                and time.monotonic() - self.last_cut >= self.relax_after:
+            self.limit = None
+            self.peak_in_flight = self.in_flight
+    
+    def on_success(self, latency: Optional[float] = None):
+        """Record the call latency and grow a learned limit additively."""
+        if latency is not None:
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+            self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+        
+        if self.limit is not None:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+    
+    def on_congestion(self, started: Optional[float] = None) -> bool:
+        """Shrink the limit multiplicatively, once per congestion window.
+        
+        Args:
+            started: Monotonic start time of the congested call (None cuts unconditionally)
+        
+        Returns:
+            Whether the limit was cut
+        """
+        self._relax()
+        if started is not None and self.last_cut is not None and started <= self.last_cut:
+            return False
+        
+        if self.limit is None:
+            self.floor = max(self.min_limit, float(self.peak_in_flight))
+            current = max(self.floor, float(self.in_flight))
+        else:
+            current = self.limit
+        self.limit = max(self.floor, current * self.backoff_ratio)
+        self.last_cut = time.monotonic()
+        return True
+
 @dataclass
 class ProviderHealth:
     """Provider health information."""
@@ -24,7 +106,11 @@ class ProviderHealth:
     last_success: Optional[float] = None
     last_failure: Optional[float] = None
     consecutive_failures: int = 0
+    probe_success_count: int = 0
+    probe_failure_count: int = 0
+    last_probe: Optional[float] = None
     error_types: Set[str] = None
+    concurrency: AdaptiveLimit = field(default_factory=AdaptiveLimit)
     
     def __post_init__(self):
         if self.error_types is None:
@@ -32,11 +118,12 @@ class ProviderHealth:
     
     @property
     def success_rate(self) -> float:
-        """Calculate success rate."""
-        total = self.success_count + self.failure_count
+        """Calculate success rate over user traffic and health probes."""
+        successes = self.success_count + self.probe_success_count
+        total = successes + self.failure_count + self.probe_failure_count
         if total == 0:
             return 0.0
-        return self.success_count / total
+        return successes / total
     
     @property
     def is_reliable(self) -> bool:
@@ -62,11 +149,73 @@ class ProviderHealth:
         else:
             self.status = ProviderStatus.UNKNOWN
 
+def merge_health_delta(row: Optional[Dict[str, Any]], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """Fold one worker's pending changes into a shared provider health row.
+    
+    Args:
+        row: Current shared row, or None if the provider has no row yet
+        delta: Pending changes produced by ProviderMonitor.take_deltas
+        
+    Returns:
+        Updated row
+    """
+    merged = dict(row) if row else {
+        "provider": delta["provider"],
+        "success_count": 0,
+        "failure_count": 0,
+        "probe_success_count": 0,
+        "probe_failure_count": 0,
+        "consecutive_failures": 0,
+        "last_success": None,
+        "last_failure": None,
+        "error_types": [],
+        "cooldown_until": None
+    }
+    
+    for counter in ("success_count", "failure_count", "probe_success_count", "probe_failure_count"):
+        merged[counter] = (merged.get(counter) or 0) + delta.get(counter, 0)
+    
+    # A success anywhere resets the streak; otherwise streaks add up across workers
+    if delta.get("reset"):
+        merged["consecutive_failures"] = delta.get("consecutive_failures", 0)
+    else:
+        merged["consecutive_failures"] = (merged.get("consecutive_failures") or 0) + delta.get("consecutive_failures", 0)
+    
+    for latest in ("last_success", "last_failure", "cooldown_until"):
+        values = [value for value in (merged.get(latest), delta.get(latest)) if value is not None]
+        merged[latest] = max(values) if values else None
+    
+    merged["error_types"] = sorted(set(merged.get("error_types") or []) | set(delta.get("error_types") or []))
+    for local in ("concurrency_limit", "latency_ewma", "min_latency"):
+        if delta.get(local) is not None:
+            merged[local] = delta[local]
+    
+    health = ProviderHealth(name=merged["provider"])
+    health.success_count = merged["success_count"]
+    health.failure_count = merged["failure_count"]
+    health.probe_success_count = merged["probe_success_count"]
+    health.probe_failure_count = merged["probe_failure_count"]
+    health.consecutive_failures = merged["consecutive_failures"]
+    health.update_status()
+    merged["status"] = health.status.value
+    merged["updated_at"] = time.time()
+    return merged
+
+def _round_limit(limit: Optional[float]) -> Optional[float]:
+    """Round a concurrency limit for display (None means unlimited)."""
+    return None if limit is None else round(limit, 2)
+
 class ProviderMonitor:
     """Monitor and manage provider health."""
     
     def __init__(self):
         self.providers: Dict[str, ProviderHealth] = {}
+        self._lock = threading.RLock()
+        # (provider, proxy) -> monotonic deadline; proxy None means the whole provider
+        self.cooldowns: Dict[Tuple[str, Optional[str]], float] = {}
+        # Changes not yet pushed to shared state (only tracked when sharing is enabled)
+        self.track_deltas = False
+        self._deltas: Dict[str, Dict[str, Any]] = {}
         self.blacklisted_providers: Set[str] = {
             "Chatai",  # Known to return 401 errors
             "OpenaiChat",  # Requires Chrome browser
@@ -74,31 +223,170 @@ class ProviderMonitor:
     
     def get_provider_health(self, provider_name: str) -> ProviderHealth:
         """Get health information for a provider."""
-        if provider_name not in self.providers:
-            self.providers[provider_name] = ProviderHealth(name=provider_name)
-        return self.providers[provider_name]
+        health = self.providers.get(provider_name)
+        if health is None:
+            with self._lock:
+                health = self.providers.setdefault(provider_name, ProviderHealth(name=provider_name))
+        return health
+    
+    def _delta(self, provider_name: str) -> Dict[str, Any]:
+        """Get the pending shared-state delta for a provider (call with lock held)."""
+        delta = self._deltas.get(provider_name)
+        if delta is None:
+            delta = self._deltas[provider_name] = {
+                "provider": provider_name,
+                "success_count": 0,
+                "failure_count": 0,
+                "probe_success_count": 0,
+                "probe_failure_count": 0,
+                "consecutive_failures": 0,
+                "reset": False,
+                "error_types": set()
+            }
+        return delta
+    
+    def take_deltas(self) -> List[Dict[str, Any]]:
+        """Take the changes recorded since the last call, for pushing to shared state.
+        
+        Returns:
+            One delta per provider that changed, including its local concurrency statistics
+        """
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+            for provider_name, delta in deltas.items():
+                concurrency = self.get_provider_health(provider_name).concurrency
+                delta["concurrency_limit"] = concurrency.limit
+                delta["latency_ewma"] = concurrency.latency_ewma
+                delta["min_latency"] = concurrency.min_latency
+        return list(deltas.values())
+    
+    def try_acquire(self, provider_name: str) -> bool:
+        """Reserve a concurrency slot for a provider call.
+        
+        Returns:
+            True if the provider has headroom, False if it is at its limit
+        """
+        health = self.get_provider_health(provider_name)
+        with self._lock:
+            if health.concurrency.headroom <= 0:
+                return False
+            health.concurrency.acquire()
+            return True
+    
+    def release(self, provider_name: str):
+        """Release a concurrency slot reserved with try_acquire."""
+        health = self.get_provider_health(provider_name)
+        with self._lock:
+            health.concurrency.in_flight = max(0, health.concurrency.in_flight - 1)
     
-    def record_success(self, provider_name: str):
-        """Record a successful API call."""
+    def get_headroom(self, provider_name: str) -> int:
+        """Get the number of additional concurrent calls a provider accepts."""
+        return self.get_provider_health(provider_name).concurrency.headroom
+    
+    def record_success(self, provider_name: str, latency: Optional[float] = None, probe: bool = False):
+        """Record a successful API call.
+        
+        Args:
+            provider_name: Provider name
+            latency: Call duration in seconds
+            probe: Whether the call was a synthetic health probe rather than user traffic
+        """
         health = self.get_provider_health(provider_name)
-        health.success_count += 1
-        health.last_success = time.time()
-        health.consecutive_failures = 0
-        health.update_status()
+        with self._lock:
+            now = time.time()
+            if probe:
+                health.probe_success_count += 1
+                health.last_probe = now
+            else:
+                health.success_count += 1
+                health.concurrency.on_success(latency)
+            health.last_success = now
+            health.consecutive_failures = 0
+            health.update_status()
+            
+            if self.track_deltas:
+                delta = self._delta(provider_name)
+                delta["probe_success_count" if probe else "success_count"] += 1
+                delta["reset"] = True
+                delta["consecutive_failures"] = 0
+                delta["last_success"] = now
         
         logger.debug(f"Provider {provider_name}: success recorded (rate: {health.success_rate:.2f})")
     
-    def record_failure(self, provider_name: str, error_type: str = "unknown"):
-        """Record a failed API call."""
+    def record_failure(self, provider_name: str, error_type: str = "unknown", probe: bool = False,
+                       started: Optional[float] = None):
+        """Record a failed API call.
+        
+        Args:
+            provider_name: Provider name
+            error_type: Classified error type
+            probe: Whether the call was a synthetic health probe rather than user traffic
+            started: Monotonic start time of the call; congestion errors of calls
+                started before the last limit cut do not cut it again
+        """
         health = self.get_provider_health(provider_name)
-        health.failure_count += 1
-        health.last_failure = time.time()
-        health.consecutive_failures += 1
-        health.error_types.add(error_type)
-        health.update_status()
+        with self._lock:
+            now = time.time()
+            if probe:
+                health.probe_failure_count += 1
+                health.last_probe = now
+            else:
+                health.failure_count += 1
+            health.last_failure = now
+            health.consecutive_failures += 1
+            health.error_types.add(error_type)
+            # Congestion behind Auto belongs to whichever provider it picked internally
+            if error_type in CONGESTION_ERRORS and not probe and provider_name != "Auto":
+                health.concurrency.on_congestion(started)
+            health.update_status()
+            
+            if self.track_deltas:
+                delta = self._delta(provider_name)
+                delta["probe_failure_count" if probe else "failure_count"] += 1
+                delta["consecutive_failures"] += 1
+                delta["last_failure"] = now
+                delta["error_types"].add(error_type)
         
         logger.debug(f"Provider {provider_name}: failure recorded (rate: {health.success_rate:.2f}, consecutive: {health.consecutive_failures})")
     
+    def mark_unavailable(self, provider_name: str, seconds: float, proxy: Optional[str] = None, reason: str = ""):
+        """Keep a provider (or a provider through one proxy) out of routing for a while.
+        
+        Args:
+            provider_name: Provider name
+            seconds: How long to skip the provider
+            proxy: Proxy URL the limit applies to, or None for the provider as a whole
+            reason: Reason for logging
+        """
+        deadline = time.monotonic() + max(0.0, seconds)
+        key = (provider_name, proxy)
+        with self._lock:
+            now = time.monotonic()
+            for expired in [k for k, until in self.cooldowns.items() if until <= now]:
+                del self.cooldowns[expired]
+            self.cooldowns[key] = max(deadline, self.cooldowns.get(key, 0.0))
+            
+            if self.track_deltas and proxy is None:
+                delta = self._delta(provider_name)
+                delta["cooldown_until"] = max(delta.get("cooldown_until") or 0.0, time.time() + seconds)
+        
+        scope = " via proxy" if proxy else ""
+        logger.warning(f"Provider {provider_name}{scope} unavailable for {seconds:.0f}s: {reason or 'cooldown'}")
+    
+    def get_cooldown_remaining(self, provider_name: str, proxy: Optional[str] = None) -> float:
+        """Get seconds until a provider may be used again (0 if available)."""
+        now = time.monotonic()
+        deadline = self.cooldowns.get((provider_name, None), 0.0)
+        if proxy is not None:
+            deadline = max(deadline, self.cooldowns.get((provider_name, proxy), 0.0))
+        return max(0.0, deadline - now)
+    
+    def is_available(self, provider_name: str, proxy: Optional[str] = None) -> bool:
+        """Check that a provider is not cooling down after a rate limit."""
+        if not self.cooldowns:
+            return True
+        return self.get_cooldown_remaining(provider_name, proxy) <= 0
+    
     def get_healthy_providers(self, available_providers: Dict[str, any]) -> List[str]:
         """Get list of healthy providers."""
         healthy = []
@@ -110,6 +398,9 @@ class ProviderMonitor:
             if provider_name in self.blacklisted_providers:
                 continue
             
+            if not self.is_available(provider_name):
+                continue
+            
             health = self.get_provider_health(provider_name)
             
             # Include provider if it's healthy or unknown (give it a chance)
@@ -119,6 +410,9 @@ class ProviderMonitor:
                 # Give degraded providers a chance if not too many consecutive failures
                 healthy.append(provider_name)
         
+        # Prefer providers with the most spare capacity (stable for ties)
+        healthy.sort(key=self.get_headroom, reverse=True)
+        
         return healthy
     
     def get_reliable_providers(self, available_providers: Dict[str, any]) -> List[str]:
@@ -132,6 +426,9 @@ class ProviderMonitor:
             if provider_name in self.blacklisted_providers:
                 continue
             
+            if not self.is_available(provider_name):
+                continue
+            
             health = self.get_provider_health(provider_name)
             if health.is_reliable:
                 reliable.append(provider_name)
@@ -143,7 +440,8 @@ class ProviderMonitor:
         if not reliable:
             fallback_providers = ["DuckDuckGo", "Blackbox", "DeepInfra", "PerplexityLabs"]
             for provider in fallback_providers:
-                if provider in available_providers and provider not in self.blacklisted_providers:
+                if (provider in available_providers and provider not in self.blacklisted_providers
+                        and self.is_available(provider)):
                     reliable.append(provider)
         
         return reliable
@@ -157,13 +455,126 @@ class ProviderMonitor:
         self.blacklisted_providers.add(provider_name)
         logger.warning(f"Provider {provider_name} blacklisted: {reason}")
     
+    def export_state(self) -> List[Dict[str, Any]]:
+        """Export health counters, latency statistics and limits for persistence.
+        
+        Returns:
+            One row per provider
+        """
+        rows = []
+        with self._lock:
+            for provider_name, health in self.providers.items():
+                rows.append({
+                    "provider": provider_name,
+                    "status": health.status.value,
+                    "success_count": health.success_count,
+                    "failure_count": health.failure_count,
+                    "probe_success_count": health.probe_success_count,
+                    "probe_failure_count": health.probe_failure_count,
+                    "consecutive_failures": health.consecutive_failures,
+                    "last_success": health.last_success,
+                    "last_failure": health.last_failure,
+                    "error_types": sorted(health.error_types),
+                    "concurrency_limit": health.concurrency.limit,
+                    "latency_ewma": health.concurrency.latency_ewma,
+                    "min_latency": health.concurrency.min_latency,
+                    "cooldown_until": self._cooldown_until(provider_name),
+                    "updated_at": time.time()
+                })
+        return rows
+    
+    def _cooldown_until(self, provider_name: str) -> Optional[float]:
+        """Get the wall-clock end of a provider-wide cooldown, if one is active."""
+        remaining = self.get_cooldown_remaining(provider_name)
+        return time.time() + remaining if remaining > 0 else None
+    
+    def restore_state(self, rows: List[Dict[str, Any]], half_life: float = 3600, max_age: float = 86400) -> int:
+        """Restore state exported by export_state, trusting old data less.
+        
+        Counters and the learned concurrency limit are decayed towards their
+        defaults with the given half-life; rows older than max_age are ignored.
+        
+        Args:
+            rows: Rows produced by export_state
+            half_life: Seconds after which restored counters count half
+            max_age: Seconds after which a row is discarded
+            
+        Returns:
+            Number of providers restored
+        """
+        return self._apply_rows(rows, half_life, max_age, include_limits=True)
+    
+    def apply_shared_state(self, rows: List[Dict[str, Any]], half_life: float = 3600, max_age: float = 86400) -> int:
+        """Replace local health counters with state shared by all workers.
+        
+        Concurrency limits and in-flight counts stay local to this process.
+        
+        Args:
+            rows: Shared provider health rows
+            half_life: Seconds after which idle counters count half
+            max_age: Seconds after which a row is ignored
+            
+        Returns:
+            Number of providers updated
+        """
+        return self._apply_rows(rows, half_life, max_age, include_limits=False)
+    
+    def _apply_rows(self, rows: List[Dict[str, Any]], half_life: float, max_age: float, include_limits: bool) -> int:
+        """Apply persisted or shared rows to the local provider health."""
+        now = time.time()
+        applied = 0
+        
+        with self._lock:
+            for row in rows:
+                age = max(0.0, now - (row.get("updated_at") or 0))
+                if age > max_age:
+                    continue
+                
+                weight = math.pow(0.5, age / half_life) if half_life > 0 else 1.0
+                health = self.get_provider_health(row["provider"])
+                health.success_count = round((row.get("success_count") or 0) * weight)
+                health.failure_count = round((row.get("failure_count") or 0) * weight)
+                health.probe_success_count = round((row.get("probe_success_count") or 0) * weight)
+                health.probe_failure_count = round((row.get("probe_failure_count") or 0) * weight)
+                health.consecutive_failures = round((row.get("consecutive_failures") or 0) * weight)
+                health.last_success = row.get("last_success")
+                health.last_failure = row.get("last_failure")
+                health.error_types = set(row.get("error_types") or [])
+                
+                if include_limits:
+                    # An old limit relaxes back towards unlimited
+                    limit = row.get("concurrency_limit")
+                    if limit and weight > 0:
+                        limit /= weight
+                    health.concurrency.limit = limit if limit and limit < health.concurrency.max_limit else None
+                    if health.concurrency.limit is not None:
+                        health.concurrency.last_cut = time.monotonic()  # Relaxes like a fresh cut
+                    health.concurrency.latency_ewma = row.get("latency_ewma")
+                    health.concurrency.min_latency = row.get("min_latency")
+                
+                cooldown_until = row.get("cooldown_until")
+                if cooldown_until and cooldown_until > now:
+                    key = (health.name, None)
+                    deadline = time.monotonic() + (cooldown_until - now)
+                    self.cooldowns[key] = max(deadline, self.cooldowns.get(key, 0.0))
+                
+                health.update_status()
+                applied += 1
+        
+        return applied
+    
     def get_status_summary(self) -> Dict[str, any]:
         """Get summary of all provider statuses."""
         summary = {
             "healthy": [],
             "degraded": [],
             "unhealthy": [],
-            "blacklisted": list(self.blacklisted_providers)
+            "blacklisted": list(self.blacklisted_providers),
+            "cooling_down": [
+                {"name": name, "via_proxy": proxy is not None, "remaining": round(self.get_cooldown_remaining(name, proxy), 1)}
+                for (name, proxy) in list(self.cooldowns)
+                if self.get_cooldown_remaining(name, proxy) > 0
+            ]
         }
         
         for provider_name, health in self.providers.items():
@@ -171,13 +582,16 @@ class ProviderMonitor:
                 summary["healthy"].append({
                     "name": provider_name,
                     "success_rate": health.success_rate,
-                    "total_calls": health.success_count + health.failure_count
+                    "total_calls": health.success_count + health.failure_count,
+                    "probe_calls": health.probe_success_count + health.probe_failure_count,
+                    "concurrency_limit": _round_limit(health.concurrency.limit)
                 })
             elif health.status == ProviderStatus.DEGRADED:
                 summary["degraded"].append({
                     "name": provider_name,
                     "success_rate": health.success_rate,
-                    "consecutive_failures": health.consecutive_failures
+                    "consecutive_failures": health.consecutive_failures,
+                    "concurrency_limit": _round_limit(health.concurrency.limit)
                 })
             elif health.status == ProviderStatus.UNHEALTHY:
                 summary["unhealthy"].append({
@@ -0,0 +1,318 @@
+"""Health-scored pool of upstream proxies, reloaded when the proxy file changes."""
+
+import asyncio
+import base64
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from .helpers import format_proxy_url, load_json_file, save_json_file
+from .logging import logger
+
+# Latency assumed for a proxy that has not answered yet, so new proxies get tried
+_DEFAULT_LATENCY = 1.0
+_LATENCY_SMOOTHING = 0.3
+
+@dataclass
+class ProxyStats:
+    """Outcome counters and smoothed latency of requests through a proxy."""
+    success_count: int = 0
+    failure_count: int = 0
+    latency: Optional[float] = None  # Exponentially weighted moving average in seconds
+    
+    def record(self, success: bool, latency: Optional[float] = None):
+        """Record the outcome of one request."""
+        if success:
+            self.success_count += 1
+        else:
+            self.failure_count += 1
+        if latency is not None:
+            self.latency = latency if self.latency is None else (
+                _LATENCY_SMOOTHING * latency + (1 - _LATENCY_SMOOTHING) * self.latency
+            )
+    
+    @property
+    def success_rate(self) -> float:
+        """Success rate with one success and one failure assumed (Laplace smoothing)."""
+        return (self.success_count + 1) / (self.success_count + self.failure_count + 2)
+    
+    def score(self) -> float:
+        """Expected successes per second of waiting; higher is better."""
+        return self.success_rate / max(self.latency or _DEFAULT_LATENCY, 0.01)
+
+@dataclass
+class ProxyEntry:
+    """One configured proxy with its health."""
+    url: str
+    config: Dict[str, str]
+    stats: ProxyStats = field(default_factory=ProxyStats)
+    providers: Dict[str, ProxyStats] = field(default_factory=dict)
+    consecutive_failures: int = 0
+    ejected_until: float = 0.0
+    last_error: Optional[str] = None
+    
+    def is_available(self, now: Optional[float] = None) -> bool:
+        """Check whether the proxy is outside its ejection cooldown."""
+        return (now or time.monotonic()) >= self.ejected_until
+    
+    def stats_for(self, provider_name: Optional[str]) -> ProxyStats:
+        """Get the provider's stats for this proxy, or the overall stats if there are none yet."""
+        if provider_name and provider_name in self.providers:
+            return self.providers[provider_name]
+        return self.stats
+
+class ProxyPool:
+    """Pick upstream proxies by observed health instead of at random.
+    
+    The proxy file is kept in memory and only re-read when its modification
+    time or size changed. Each request through a proxy records its outcome and
+    latency, overall and per provider; proxies failing several times in a row
+    are skipped for a cooldown.
+    """
+    
+    def __init__(
+        self,
+        proxies_file: Optional[str] = None,
+        strategy: str = "weighted",
+        eject_after: int = 3,
+        eject_cooldown: float = 300.0,
+        probe_target: str = "www.google.com:443",
+        probe_timeout: float = 5.0,
+        check_interval: float = 1.0
+    ):
+        """Initialize proxy pool.
+        
+        Args:
+            proxies_file: Proxy list JSON file
+            strategy: "weighted" (random, weighted by health) or "least_latency"
+            eject_after: Consecutive failures before a proxy is ejected
+            eject_cooldown: Seconds an ejected proxy is skipped
+            probe_target: Host:port requested through HTTP proxies by the probe
+            probe_timeout: Default seconds per proxy for the probe
+            check_interval: Minimum seconds between checks of the file for changes
+        """
+        self.proxies_file = proxies_file
+        self.strategy = strategy
+        self.eject_after = eject_after
+        self.eject_cooldown = eject_cooldown
+        self.probe_target = probe_target
+        self.probe_timeout = probe_timeout
+        self.check_interval = check_interval
+        self._entries: Dict[str, ProxyEntry] = {}
+        self._signature: Optional[Tuple[int, int]] = None
+        self._last_check = float("-inf")
+        self._lock = threading.Lock()
+    
+    def _reload(self):
+        """Re-read the proxy file if it changed (lock held)."""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        
+        try:
+            stat = os.stat(self.proxies_file) if self.proxies_file else None
+            signature = (stat.st_mtime_ns, stat.st_size) if stat else None
+        except OSError:
+            signature = None
+        if signature == self._signature:
+            return
+        self._signature = signature
+        
+        proxies = load_json_file(Path(self.proxies_file), []) if signature else []
+        entries = {}
+        for proxy in proxies if isinstance(proxies, list) else []:
+            try:
+                url = format_proxy_url(proxy)
+            except (KeyError, TypeError):
+                logger.warning(f"Skipping malformed proxy entry in {self.proxies_file}")
+                continue
+            # Keep the health of proxies that survive a reload
+            entries[url] = self._entries.get(url) or ProxyEntry(url=url, config=dict(proxy))
+        
+        self._entries = entries
+        logger.debug(f"Proxy pool loaded {len(entries)} proxies from {self.proxies_file}")
+    
+    def get_proxies(self) -> List[Dict[str, str]]:
+        """Get the configured proxies as stored in the proxy file."""
+        with self._lock:
+            self._reload()
+            return [dict(entry.config) for entry in self._entries.values()]
+    
+    def save(self, proxies: List[Dict[str, str]]):
+        """Write the proxy list atomically and load it into the pool.
+        
+        Args:
+            proxies: Proxy configurations
+        """
+        with self._lock:
+            save_json_file(Path(self.proxies_file), proxies)
+            self._last_check = float("-inf")
+            self._reload()
+    
+    def select(self, provider_name: Optional[str] = None) -> Optional[str]:
+        """Pick a proxy for a request.
+        
+        Ejected proxies are skipped; if every proxy is ejected, the one
+        whose cooldown ends first is used rather than none.
+        
+        Args:
+            provider_name: Provider the request goes to, for per-provider stats
+        
+        Returns:
+            Proxy URL, or None if no proxy is configured
+        """
+        with self._lock:
+            self._reload()
+            if not self._entries:
+                return None
+            
+            now = time.monotonic()
+            candidates = [entry for entry in self._entries.values() if entry.is_available(now)]
+            if not candidates:
+                return min(self._entries.values(), key=lambda entry: entry.ejected_until).url
+            
+            if self.strategy == "least_latency":
+                # Proxies without a measurement yet go first so they get one
+                return min(
+                    candidates,
+                    key=lambda entry: (entry.stats_for(provider_name).latency or 0.0) / entry.stats_for(provider_name).success_rate
+                ).url
+            
+            weights = [entry.stats_for(provider_name).score() for entry in candidates]
+            return random.choices(candidates, weights=weights)[0].url
+    
+    def record(
+        self,
+        proxy_url: str,
+        provider_name: Optional[str],
+        success: bool,
+        latency: Optional[float] = None,
+        error_type: Optional[str] = None
+    ):
+        """Record the outcome of a request through a proxy.
+        
+        Args:
+            proxy_url: Proxy URL returned by select
+            provider_name: Provider the request went to
+            success: Whether the request succeeded
+            latency: Seconds the request took
+            error_type: Classified error on failure
+        """
+        with self._lock:
+            self._reload()
+            entry = self._entries.get(proxy_url)
+            if entry is None:
+                return
+            
+            entry.stats.record(success, latency)
+            if provider_name:
+                entry.providers.setdefault(provider_name, ProxyStats()).record(success, latency)
+            
+            if success:
+                entry.consecutive_failures = 0
+                return
+            
+            entry.consecutive_failures += 1
+            entry.last_error = error_type
+            if entry.consecutive_failures >= self.eject_after:
+                self._eject(entry, f"{entry.consecutive_failures} consecutive failures ({error_type})")
+    
+    def _eject(self, entry: ProxyEntry, reason: str):
+        """Skip a proxy for the ejection cooldown (lock held)."""
+        entry.ejected_until = time.monotonic() + self.eject_cooldown
+        entry.consecutive_failures = 0
+        logger.warning(
+            f"Proxy {entry.config.get('ip')}:{entry.config.get('port')} ejected "
+            f"for {self.eject_cooldown:.0f}s after {reason}"
+        )
+    
+    async def probe(self, timeout: Optional[float] = None) -> Dict[str, bool]:
+        """Check that every proxy accepts connections, and eject those that do not.
+        
+        HTTP proxies must accept a CONNECT to the probe target; SOCKS5
+        proxies must answer the SOCKS greeting; others only a TCP connect.
+        
+        Args:
+            timeout: Seconds per proxy (defaults to probe_timeout)
+        
+        Returns:
+            Dictionary of proxy URL to reachability
+        """
+        with self._lock:
+            self._reload()
+            urls = list(self._entries)
+        
+        timeout = timeout or self.probe_timeout
+        results = await asyncio.gather(*(self._probe_one(url, timeout) for url in urls))
+        
+        with self._lock:
+            for url, (ok, error) in zip(urls, results):
+                entry = self._entries.get(url)
+                if entry is None:
+                    continue
+                if ok:
+                    entry.ejected_until = 0.0
+                else:
+                    entry.last_error = error
+                    self._eject(entry, f"failed connectivity probe: {error}")
+        return {url: ok for url, (ok, _) in zip(urls, results)}
+    
+    async def _probe_one(self, proxy_url: str, timeout: float) -> Tuple[bool, Optional[str]]:
+        """Probe one proxy; returns (reachable, error message)."""
+        parts = urlsplit(proxy_url)
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(parts.hostname, parts.port), timeout
+            )
+            scheme = parts.scheme.lower()
+            if scheme in ("http", "https"):
+                request = f"CONNECT {self.probe_target} HTTP/1.1\r\nHost: {self.probe_target}\r\n"
+                if parts.username:
+                    credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+                    request += f"Proxy-Authorization: Basic {base64.b64encode(credentials.encode()).decode()}\r\n"
+                writer.write(f"{request}\r\n".encode())
+                await writer.drain()
+                status_line = await asyncio.wait_for(reader.readline(), timeout)
+                status = status_line.split()
+                if len(status) < 2 or status[1] != b"200":
+                    return False, status_line.decode(errors="replace").strip() or "no response"
+            elif scheme.startswith("socks5"):
+                writer.write(b"\x05\x02\x00\x02")  # No auth or username/password
+                await writer.drain()
+                reply = await asyncio.wait_for(reader.readexactly(2), timeout)
+                if reply[0] != 5 or reply[1] == 0xFF:
+                    return False, "SOCKS5 handshake rejected"
+            return True, None
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            return False, str(e) or type(e).__name__
+        finally:
+            if writer is not None:
+                writer.close()
+    
+    def get_status(self) -> List[Dict[str, Any]]:
+        """Get health of every proxy (credentials excluded)."""
+        with self._lock:
+            self._reload()
+            now = time.monotonic()
+            return [
+                {
+                    "proxy": f"{entry.config.get('protocol')}://{entry.config.get('ip')}:{entry.config.get('port')}",
+                    "success_count": entry.stats.success_count,
+                    "failure_count": entry.stats.failure_count,
+                    "latency": entry.stats.latency,
+                    "providers": {
+                        name: {"success_rate": stats.success_rate, "latency": stats.latency}
+                        for name, stats in entry.providers.items()
+                    },
+                    "last_error": entry.last_error,
+                    "ejected_remaining": max(0.0, entry.ejected_until - now)
+                }
+                for entry in self._entries.values()
+            ]
@@ -0,0 +1,82 @@
+"""Query building and result snippets for full-text search of chat history."""
+
+import hashlib
+import re
+from typing import List, Tuple
+
+_TERM_PATTERN = re.compile(r"\w+")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+def parse_query(query: str, max_terms: int = 16) -> Tuple[str, List[str]]:
+    """Turn free text into an FTS5 query matching messages with every word.
+    
+    Words are quoted, so FTS5 operators and syntax typed by users are
+    searched for literally instead of failing the query.
+    
+    Args:
+        query: Search text
+        max_terms: Words used at most
+    
+    Returns:
+        Tuple of (FTS5 MATCH expression, lowercased terms); the expression
+        is empty if the query has no words
+    """
+    terms = []
+    for term in _TERM_PATTERN.findall(query.casefold()):
+        if term not in terms:
+            terms.append(term)
+    terms = terms[:max_terms]
+    return " ".join(f'"{term}"' for term in terms), terms
+
+def owner_token(username: str) -> str:
+    """Get the search index token standing for a message's owner.
+    
+    Usernames may contain characters the FTS5 tokenizer splits on, so the
+    owner is indexed as a single alphanumeric token derived from its name.
+    
+    Args:
+        username: Username
+    
+    Returns:
+        Owner token
+    """
+    return "u" + hashlib.blake2b(username.encode("utf-8"), digest_size=10).hexdigest()
+
+def scope_query(match: str, username: str) -> str:
+    """Restrict an FTS5 query built by parse_query to one owner's messages.
+    
+    Args:
+        match: FTS5 MATCH expression
+        username: Owner of the messages to search
+    
+    Returns:
+        FTS5 MATCH expression
+    """
+    return f'owner:"{owner_token(username)}" AND content:({match})'
+
+def make_snippet(text: str, terms: List[str], width: int = 160) -> str:
+    """Cut the part of a message around the first search term.
+    
+    Args:
+        text: Message content
+        terms: Lowercased search terms
+        width: Snippet length in characters
+    
+    Returns:
+        Snippet with "..." where text was cut
+    """
+    text = _WHITESPACE_PATTERN.sub(" ", text).strip()
+    if len(text) <= width:
+        return text
+    
+    folded = text.casefold()
+    positions = [
+        match.start() for term in terms
+        for match in [re.search(rf"\b{re.escape(term)}", folded)] if match
+    ]
+    # casefold() can change lengths (e.g. "ß"); fall back to the start then
+    first = min(positions) if positions and len(folded) == len(text) else 0
+    
+    start = max(0, min(first - width // 4, len(text) - width))
+    end = start + width
+    return ("..." if start else "") + text[start:end].strip() + ("..." if end < len(text) else "")
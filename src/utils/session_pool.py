@@ -0,0 +1,176 @@
+"""Pool of keep-alive upstream connections shared across requests."""
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+import aiohttp
+
+from .logging import logger
+
+try:
+    from aiohttp_socks import ProxyConnector
+except ImportError:  # SOCKS support is optional
+    ProxyConnector = None
+
+class _NoopAwaitable:
+    """Awaitable that completes immediately."""
+    
+    def __await__(self):
+        return iter(())
+
+class _PooledConnectorMixin:
+    """Keep a connector open when a provider closes the session that borrowed it.
+    
+    g4f providers typically wrap the connector in ``async with ClientSession(...)``,
+    which closes the connector on exit. Pooled connectors ignore that close and
+    are only really closed by the pool.
+    """
+    _pool_release = False
+    
+    def close(self, *args, **kwargs):
+        if not self._pool_release:
+            return _NoopAwaitable()
+        return super().close(*args, **kwargs)
+
+class PooledTCPConnector(_PooledConnectorMixin, aiohttp.TCPConnector):
+    """TCP connector owned by the session pool."""
+
+if ProxyConnector is not None:
+    class PooledProxyConnector(_PooledConnectorMixin, ProxyConnector):
+        """SOCKS/HTTP proxy connector owned by the session pool."""
+else:
+    PooledProxyConnector = None
+
+@dataclass
+class _PoolEntry:
+    """Pooled connector with usage bookkeeping."""
+    connector: aiohttp.BaseConnector
+    last_used: float
+
+class SessionPool:
+    """Keep-alive connectors keyed by provider and proxy.
+    
+    The pool is bound to the event loop it is first used on; connectors are
+    never handed out to other loops.
+    """
+    
+    def __init__(self, max_size: int = 32, idle_timeout: float = 90.0, limit_per_host: int = 8):
+        """Initialize session pool.
+        
+        Args:
+            max_size: Maximum number of pooled connectors
+            idle_timeout: Seconds after which an unused connector is closed
+            limit_per_host: Maximum simultaneous connections per upstream host
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.limit_per_host = limit_per_host
+        self._entries: "OrderedDict[Tuple[str, Optional[str]], _PoolEntry]" = OrderedDict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing: Set[asyncio.Future] = set()
+        self.hits = 0
+        self.misses = 0
+    
+    def _create_connector(self, proxy: Optional[str]) -> Optional[aiohttp.BaseConnector]:
+        """Create a pooled connector, tunnelling through a SOCKS proxy if needed."""
+        options = {
+            "limit": 0,
+            "limit_per_host": self.limit_per_host,
+            "keepalive_timeout": self.idle_timeout,
+            "ttl_dns_cache": 300
+        }
+        if proxy and proxy.startswith("socks"):
+            if PooledProxyConnector is None:
+                logger.debug("aiohttp_socks not installed, SOCKS connections are not pooled")
+                return None
+            return PooledProxyConnector.from_url(proxy, **options)
+        return PooledTCPConnector(**options)
+    
+    def get_connector(self, provider_name: str, proxy: Optional[str] = None) -> Optional[aiohttp.BaseConnector]:
+        """Get a keep-alive connector for a provider and proxy.
+        
+        Must be called from a coroutine running on the pool's event loop.
+        
+        Args:
+            provider_name: Provider name
+            proxy: Proxy URL or None
+        
+        Returns:
+            Pooled connector, or None if pooling is unavailable here
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        elif loop is not self._loop:
+            return None
+        
+        self._close_idle()
+        key = (provider_name, proxy)
+        entry = self._entries.get(key)
+        if entry is not None and not entry.connector.closed:
+            self.hits += 1
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(key)
+            return entry.connector
+        
+        connector = self._create_connector(proxy)
+        if connector is None:
+            return None
+        
+        self.misses += 1
+        self._entries[key] = _PoolEntry(connector=connector, last_used=time.monotonic())
+        while len(self._entries) > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self._release(evicted.connector)
+        return connector
+    
+    def _close_idle(self):
+        """Close connectors that have not been used within the idle timeout."""
+        deadline = time.monotonic() - self.idle_timeout
+        for key in [key for key, entry in self._entries.items() if entry.last_used < deadline]:
+            self._release(self._entries.pop(key).connector)
+    
+    def _release(self, connector: aiohttp.BaseConnector):
+        """Really close a pooled connector in the background."""
+        async def close_connector():
+            connector._pool_release = True
+            await connector.close()
+        
+        task = asyncio.ensure_future(close_connector())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+    
+    async def prewarm(self, urls: Dict[str, str], timeout: float = 5.0):
+        """Open connections to provider hosts ahead of the first request.
+        
+        Args:
+            urls: Mapping of provider name to provider base URL
+            timeout: Seconds to spend on each warm-up request
+        """
+        async def warm(provider_name: str, url: str):
+            connector = self.get_connector(provider_name)
+            if connector is None:
+                return
+            try:
+                async with aiohttp.ClientSession(connector=connector, connector_owner=False) as session:
+                    async with session.head(url, timeout=aiohttp.ClientTimeout(total=timeout), allow_redirects=False):
+                        pass
+                logger.debug(f"Pre-warmed connection to {provider_name}")
+            except Exception as e:
+                logger.debug(f"Could not pre-warm connection to {provider_name}: {e}")
+        
+        await asyncio.gather(*(warm(name, url) for name, url in urls.items() if url))
+    
+    async def close(self):
+        """Close every pooled connector."""
+        while self._entries:
+            _, entry = self._entries.popitem()
+            entry.connector._pool_release = True
+            await entry.connector.close()
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Get pool usage statistics."""
+        return {"connectors": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,217 @@
+"""Near-duplicate text detection with MinHash signatures and LSH banding."""
+
+import hashlib
+import re
+import struct
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from .lru import LRUCache
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# "n't" is spelled out before apostrophes are dropped, so negations stay words
+_CONTRACTION_PATTERN = re.compile(r"n['\u2019]t\b")
+# Sentence punctuation and quotes; a period between digits is a decimal point
+_PUNCTUATION_PATTERN = re.compile(r"[,!?;:'\"`\u00a1\u00bf\u00ab\u00bb\u2018\u2019\u201c\u201d]|(?<!\d)\.|\.(?!\d)")
+# Operators, brackets and other symbols, which change the meaning of a prompt
+_SYMBOL_PATTERN = re.compile(r"([^\w\s.])")
+# Numbers, symbols and negations, which must match exactly
+_EXACT_TOKEN_PATTERN = re.compile(
+    r"\b(?:not|no|never|without|nor|neither|none|nothing|nobody|nowhere|cannot)\b|\d+(?:\.\d+)?|[^\w\s]"
+)
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """Normalize text for similarity comparison.
+    
+    Case, sentence punctuation, quotes, unicode presentation forms and runs
+    of whitespace are ignored. Operators and other symbols are kept as
+    separate tokens, and "n't" is written out as " not".
+    
+    Args:
+        text: Input text
+    
+    Returns:
+        Normalized text
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _CONTRACTION_PATTERN.sub(" not", text)
+    text = _PUNCTUATION_PATTERN.sub(" ", text)
+    text = _SYMBOL_PATTERN.sub(r" \1 ", text)
+    return _WHITESPACE_PATTERN.sub(" ", text).strip()
+
+def exact_tokens(text: str) -> Tuple[str, ...]:
+    """Get the numbers, symbols and negations of normalized text, which must match exactly.
+    
+    Args:
+        text: Normalized text
+    
+    Returns:
+        Numbers, symbols and negation words in order of appearance
+    """
+    return tuple(_EXACT_TOKEN_PATTERN.findall(text))
+
+def shingle_hashes(text: str, size: int = 4) -> Set[int]:
+    """Hash the overlapping character shingles of normalized text.
+    
+    Args:
+        text: Normalized text
+        size: Shingle length in characters
+    
+    Returns:
+        Set of 32-bit shingle hashes
+    """
+    if len(text) <= size:
+        text = text.ljust(size)
+    return {
+        struct.unpack("<I", hashlib.blake2b(text[i:i + size].encode("utf-8"), digest_size=4).digest())[0]
+        for i in range(len(text) - size + 1)
+    }
+
+class MinHashIndex:
+    """Bounded in-memory LSH index of MinHash signatures.
+    
+    Entries live in named scopes; only entries in the same scope are
+    compared, and only texts with the same numbers, symbols and negations
+    match.
+    Texts shorter than min_chars once normalized are never matched.
+    The least recently matched entries are evicted first.
+    """
+    
+    def __init__(self, threshold: float = 0.85, max_entries: int = 4096, num_perm: int = 64, seed: int = 1,
+                 min_chars: int = 12):
+        """Initialize MinHash index.
+        
+        Args:
+            threshold: Minimum estimated Jaccard similarity for a match
+            max_entries: Maximum number of indexed texts
+            num_perm: Number of hash permutations per signature
+            seed: Seed for the permutation coefficients
+            min_chars: Shortest normalized text that is indexed or matched
+        """
+        self.threshold = threshold
+        self.min_chars = min_chars
+        self.num_perm = num_perm
+        self.bands, self.rows = self._choose_bands(threshold, num_perm)
+        
+        coefficients = hashlib.shake_256(f"minhash-{seed}".encode()).digest(num_perm * 16)
+        self._perms = [
+            (int.from_bytes(coefficients[i * 16:i * 16 + 8], "little") % (_MERSENNE_PRIME - 1) + 1,
+             int.from_bytes(coefficients[i * 16 + 8:i * 16 + 16], "little") % _MERSENNE_PRIME)
+            for i in range(num_perm)
+        ]
+        
+        self._lock = threading.RLock()
+        self._buckets: Dict[Tuple[Hashable, int, Tuple[int, ...]], Set[Hashable]] = defaultdict(set)
+        self._entries = LRUCache(max_entries=max_entries, on_evict=self._unindex)
+    
+    @staticmethod
+    def _choose_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+        """Pick the banding whose LSH threshold sits just below the match threshold."""
+        best = (num_perm, 1)
+        for rows in range(1, num_perm + 1):
+            if num_perm % rows:
+                continue
+            bands = num_perm // rows
+            if (1 / bands) ** (1 / rows) <= threshold:
+                best = (bands, rows)
+        return best
+    
+    def signature(self, text: str) -> Tuple[int, ...]:
+        """Compute the MinHash signature of a text.
+        
+        Args:
+            text: Raw text (normalized internally)
+        
+        Returns:
+            Signature tuple of num_perm values
+        """
+        return self._minhash(normalize_text(text))
+    
+    def _minhash(self, normalized: str) -> Tuple[int, ...]:
+        hashes = shingle_hashes(normalized)
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        )
+    
+    def _band_keys(self, scope: Hashable, signature: Tuple[int, ...]) -> List[Tuple[Hashable, int, Tuple[int, ...]]]:
+        return [
+            (scope, band, signature[band * self.rows:(band + 1) * self.rows])
+            for band in range(self.bands)
+        ]
+    
+    def _unindex(self, key: Hashable, entry: Tuple[Hashable, Tuple[int, ...], Tuple[str, ...]]):
+        """Drop an entry from its LSH buckets."""
+        scope, signature, _ = entry
+        for band_key in self._band_keys(scope, signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+    
+    def add(self, scope: Hashable, text: str, key: Hashable):
+        """Index a text.
+        
+        Args:
+            scope: Scope the text belongs to
+            text: Raw text
+            key: Value returned when the text is matched
+        """
+        normalized = normalize_text(text)
+        with self._lock:
+            previous = self._entries.pop(key)
+            if previous is not None:
+                self._unindex(key, previous)
+            if len(normalized) < self.min_chars:
+                return
+            signature = self._minhash(normalized)
+            self._entries.put(key, (scope, signature, exact_tokens(normalized)))
+            for band_key in self._band_keys(scope, signature):
+                self._buckets[band_key].add(key)
+    
+    def remove(self, key: Hashable):
+        """Remove an indexed text."""
+        with self._lock:
+            entry = self._entries.pop(key)
+            if entry is not None:
+                self._unindex(key, entry)
+    
+    def query(self, scope: Hashable, text: str) -> Optional[Tuple[Hashable, float]]:
+        """Find the most similar indexed text in a scope.
+        
+        Args:
+            scope: Scope to search
+            text: Raw text
+        
+        Returns:
+            Tuple of (key, estimated similarity) or None if nothing reaches the threshold
+        """
+        normalized = normalize_text(text)
+        if len(normalized) < self.min_chars:
+            return None
+        signature, exact = self._minhash(normalized), exact_tokens(normalized)
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(scope, signature):
+                candidates.update(self._buckets.get(band_key, ()))
+            
+            best = None
+            for key in candidates:
+                _, other, other_exact = self._entries.peek(key)
+                if other_exact != exact:
+                    continue
+                score = sum(1 for x, y in zip(signature, other) if x == y) / self.num_perm
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (key, score)
+            
+            if best is not None:
+                self._entries.get(best[0])  # Mark as recently used
+            return best
+    
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -4,6 +4,11 @@ import re
 from typing import Optional, Dict, Any
 from werkzeug.datastructures import FileStorage
 
+_UUID4_PATTERN = re.compile(
+    r'^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}$',
+    re.IGNORECASE
+)
+
 def validate_proxy_format(proxy: str) -> bool:
     """Validate proxy format.
     
@@ -27,11 +32,7 @@ def validate_token_format(token: str) -> bool:
     Returns:
         True if valid UUID4, False otherwise
     """
-    uuid_pattern = re.compile(
-        r'^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}$',
-        re.IGNORECASE
-    )
-    return bool(uuid_pattern.match(token))
+    return bool(_UUID4_PATTERN.match(token))
 
 def validate_username(username: str) -> tuple[bool, Optional[str]]:
     """Validate username.
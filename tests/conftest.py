@@ -0,0 +1,15 @@
+"""Shared test setup."""
+
+import sys
+import os
+import tempfile
+
+# Add src to Python path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import config
+
+# Module-level instances (db_manager and everything built on it) open the
+# default settings file on import; keep them off the tracked src/data/settings.db
+_data_dir = tempfile.TemporaryDirectory()
+config.database.settings_file = os.path.join(_data_dir.name, "settings.db")
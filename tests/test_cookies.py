@@ -0,0 +1,128 @@
+"""Tests for cookie file loading."""
+
+import sys
+import os
+import json
+
+# Add src to Python path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.cookies import CookieStore, parse_cookie_data
+
+
+class TestCookieStore:
+    """Test cached cookie jars and per-provider cookie sets."""
+    
+    def test_file_read_only_when_changed(self, tmp_path, monkeypatch):
+        """Unchanged files are served from memory; edits are picked up."""
+        cookie_file = tmp_path / "cookies.json"
+        cookie_file.write_text(json.dumps({"session": "one"}))
+        store = CookieStore(check_interval=0)
+        
+        reads = []
+        original_load = store._load
+        monkeypatch.setattr(store, "_load", lambda path: reads.append(path) or original_load(path))
+        
+        assert store.get_jar(str(cookie_file)).for_provider("Bing") == {"session": "one"}
+        assert store.get_jar(str(cookie_file)).for_provider("Bing") == {"session": "one"}
+        assert len(reads) == 1
+        
+        cookie_file.write_text(json.dumps({"session": "second"}))
+        assert store.get_jar(str(cookie_file)).for_provider("Bing") == {"session": "second"}
+        assert len(reads) == 2
+    
+    def test_missing_file_uses_dummy_cookies(self, tmp_path):
+        """A missing cookie file falls back to dummy cookies."""
+        store = CookieStore()
+        assert store.get_jar(str(tmp_path / "missing.json")).for_provider("Bing") == {"dummy": "value"}
+        assert store.get_jar(None).for_provider("Bing") == {"dummy": "value"}
+    
+    def test_per_provider_sets(self):
+        """Providers get their own set, others the default set."""
+        jar = parse_cookie_data({
+            "OpenaiChat": [{"name": "__Secure-next-auth", "value": "abc", "domain": ".chatgpt.com"}],
+            "default": {"common": "1"}
+        })
+        
+        assert jar.for_provider("OpenaiChat") == {"__Secure-next-auth": "abc"}
+        assert jar.for_provider("Bing") == {"common": "1"}
+
+
+class TestCookiePool:
+    """Test rotation across account cookie sets."""
+    
+    def _make_pool(self, tmp_path, accounts):
+        from utils.cookies import CookiePool
+        
+        for name, provider in accounts:
+            (tmp_path / f"{name}.json").write_text(json.dumps({"provider": provider, "cookies": {"session": name}}))
+        return CookiePool(str(tmp_path), check_interval=0)
+    
+    def test_rotates_least_recently_used(self, tmp_path):
+        """Consecutive requests spread over the provider's accounts."""
+        pool = self._make_pool(tmp_path, [("a", "OpenaiChat"), ("b", "OpenaiChat"), ("c", "Gemini")])
+        
+        used = []
+        for _ in range(4):
+            cookie_set = pool.acquire("OpenaiChat")
+            used.append(cookie_set.cookies["session"])
+            pool.release(cookie_set)
+        
+        assert sorted(used[:2]) == ["a", "b"]
+        assert used[2:] == used[:2]
+        assert pool.acquire("Bing") is None
+    
+    def test_cooldown_skips_account(self, tmp_path):
+        """A rate-limited account rests while the others keep serving."""
+        pool = self._make_pool(tmp_path, [("a", "OpenaiChat"), ("b", "OpenaiChat")])
+        
+        limited = pool.acquire("OpenaiChat")
+        pool.release(limited, error_type="rate_limited", cooldown=60)
+        
+        for _ in range(3):
+            cookie_set = pool.acquire("OpenaiChat")
+            assert cookie_set.name != limited.name
+            pool.release(cookie_set)
+        
+        status = {entry["name"]: entry for entry in pool.get_status()}
+        assert status[limited.name]["last_error"] == "rate_limited"
+        assert status[limited.name]["cooldown_remaining"] > 0
+    
+    def test_provider_call_uses_pooled_account(self, tmp_path, monkeypatch):
+        """A 429 through one account cools that account down, not the provider."""
+        import asyncio
+        import ai_service as ai_service_module
+        from ai_service import AIService
+        from database import DatabaseManager
+        from utils.provider_monitor import ProviderMonitor
+        
+        class _RateLimitError(Exception):
+            status = 429
+        
+        class FakeProvider:
+            @staticmethod
+            async def create_async(model, messages, **kwargs):
+                pass
+        
+        async def fake_create_async(cookies=None, **kwargs):
+            if cookies["session"] == "a":
+                raise _RateLimitError("429 Too Many Requests")
+            return f"answer from {cookies['session']}"
+        
+        monitor = ProviderMonitor()
+        monkeypatch.setattr(ai_service_module, "provider_monitor", monitor)
+        monkeypatch.setattr(ai_service_module.g4f.ChatCompletion, "create_async", fake_create_async)
+        
+        service = AIService()
+        service.db = DatabaseManager(str(tmp_path / "settings.db"))
+        service.cookie_pool = self._make_pool(tmp_path, [("a", "OpenaiChat"), ("b", "OpenaiChat")])
+        
+        async def call():
+            return await service._make_api_call(
+                [{"role": "user", "content": "hi"}], FakeProvider, "gpt-4", {}, None, "OpenaiChat"
+            )
+        
+        results = [asyncio.run(call()) for _ in range(3)]
+        
+        assert results.count("answer from b") == 2
+        assert monitor.is_available("OpenaiChat")
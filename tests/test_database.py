@@ -0,0 +1,560 @@
+"""Tests for database caching and storage."""
+
+import sys
+import os
+
+# Add src to Python path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import pytest
+
+from database import DatabaseManager
+
+
+class TestSettingsCache:
+    """Test the cached settings snapshot and its invalidation."""
+    
+    def test_repeated_reads_skip_settings_query(self, tmp_path):
+        """Unchanged settings are served from the snapshot."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        first = db.get_settings()
+        
+        loads = []
+        original_load = db._load_settings
+        db._load_settings = lambda: loads.append(1) or original_load()
+        
+        assert db.get_settings() is first
+        assert loads == []
+        
+        with pytest.raises(TypeError):
+            first["keyword"] = "changed"
+    
+    def test_update_invalidates_snapshot(self, tmp_path):
+        """Local writes are visible on the next read."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        db.get_settings()
+        db.update_settings({"keyword": "question"})
+        assert db.get_settings()["keyword"] == "question"
+    
+    def test_other_process_changes_are_noticed(self, tmp_path):
+        """A settings change committed through another manager reloads the snapshot."""
+        path = str(tmp_path / "settings.db")
+        reader, writer = DatabaseManager(path), DatabaseManager(path)
+        snapshot = reader.get_settings()
+        
+        writer.save_chat_history("admin", "[]")
+        assert reader.get_settings() is snapshot
+        
+        writer.update_settings({"model": "gpt-4o"})
+        assert reader.get_settings()["model"] == "gpt-4o"
+
+
+class TestTokenIndex:
+    """Test resolving tokens from the in-memory token index."""
+    
+    def test_index_follows_user_changes(self, tmp_path):
+        """Creating, renaming, re-tokening and deleting users keeps the index exact."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        db.update_settings({"token": "11111111-1111-4111-8111-111111111111"})
+        token = db.create_user("alice")
+        
+        assert db.get_username_by_token("11111111-1111-4111-8111-111111111111") == "admin"
+        assert db.get_username_by_token(token) == "alice"
+        
+        db.update_user_settings("alice", {"username": "bob"})
+        assert db.get_username_by_token(token) == "bob"
+        
+        db.update_user_settings("bob", {"token": "22222222-2222-4222-8222-222222222222"})
+        assert db.get_username_by_token(token) is None
+        assert db.get_username_by_token("22222222-2222-4222-8222-222222222222") == "bob"
+        
+        db.delete_user("bob")
+        assert db.get_username_by_token("22222222-2222-4222-8222-222222222222") is None
+    
+    def test_lookups_do_not_query_users(self, tmp_path):
+        """Once built, the index answers without reading user rows."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        token = db.create_user("alice")
+        db.get_username_by_token(token)
+        
+        builds = []
+        original_load = db._load_token_index
+        db._load_token_index = lambda: builds.append(1) or original_load()
+        
+        token_2 = db.create_user("carol")
+        assert db.get_username_by_token(token) == "alice"
+        assert db.get_username_by_token(token_2) == "carol"
+        assert builds == []
+    
+    def test_other_process_users_are_noticed(self, tmp_path):
+        """Users created through another manager resolve after their commit."""
+        path = str(tmp_path / "settings.db")
+        reader, writer = DatabaseManager(path), DatabaseManager(path)
+        assert reader.get_username_by_token("33333333-3333-4333-8333-333333333333") is None
+        
+        token = writer.create_user("dave")
+        assert reader.get_username_by_token(token) == "dave"
+
+
+class TestMessages:
+    """Test the append-only message table."""
+    
+    def test_legacy_history_is_migrated(self, tmp_path):
+        """JSON histories stored on user rows move into the message table once."""
+        import json
+        
+        path = str(tmp_path / "settings.db")
+        db = DatabaseManager(path)
+        db.create_user("alice")
+        legacy = [
+            {"role": "system", "content": "be brief"},
+            {"role": "user", "content": "hi"},
+            {"role": "assistant", "content": "hello"}
+        ]
+        with db.get_connection() as (conn, cursor):
+            cursor.execute("UPDATE personal SET chat_history = ? WHERE username = 'alice'", (json.dumps(legacy),))
+            cursor.execute("UPDATE settings SET chat_history = ? WHERE id = 1", (json.dumps(legacy[1:2]),))
+            conn.commit()
+        
+        migrated = DatabaseManager(path)
+        assert [(m["seq"], m["role"]) for m in migrated.get_messages("alice")] == [(1, "user"), (2, "assistant")]
+        assert migrated.get_chat_history("admin") == json.dumps(legacy[1:2])
+        with migrated.get_connection() as (conn, cursor):
+            cursor.execute("SELECT chat_history FROM personal WHERE username = 'alice'")
+            assert cursor.fetchone()[0] == ""
+        
+        DatabaseManager(path)
+        assert len(migrated.get_messages("alice")) == 2
+    
+    def test_compressed_and_plain_messages(self, tmp_path, monkeypatch):
+        """Long messages are stored compressed, and plain rows are compressed in place."""
+        from config import config
+        
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        long_text = "The quick brown fox jumps over the lazy dog. " * 50
+        monkeypatch.setattr(config.history, "compression", "none")
+        db.append_messages("alice", [{"role": "user", "content": long_text}])
+        monkeypatch.setattr(config.history, "compression", "zlib")
+        db.append_messages("alice", [{"role": "assistant", "content": long_text}, {"role": "user", "content": "ok"}])
+        
+        def stored_types():
+            with db.get_connection() as (conn, cursor):
+                cursor.execute("SELECT typeof(content) FROM messages ORDER BY seq")
+                return [row[0] for row in cursor.fetchall()]
+        
+        assert stored_types() == ["text", "blob", "text"]
+        assert [m["content"] for m in db.get_messages("alice")] == [long_text, long_text, "ok"]
+        
+        count, before, after = db.compress_messages(batch_size=1)
+        assert count == 1 and after < before / 10
+        assert stored_types() == ["blob", "blob", "text"]
+        assert [m["content"] for m in db.get_messages("alice")] == [long_text, long_text, "ok"]
+    
+    def test_recent_messages_and_user_changes(self, tmp_path):
+        """Recent messages come back in order; renames carry messages and deletes remove them."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        db.create_user("alice")
+        for number in range(5):
+            db.append_messages("alice", [{"role": "user", "content": str(number)}])
+        
+        assert [m["content"] for m in db.get_messages("alice", limit=2)] == ["3", "4"]
+        assert [m["content"] for m in db.get_messages("alice", after_seq=3)] == ["3", "4"]
+        
+        db.update_user_settings("alice", {"username": "bob"})
+        assert db.get_messages("alice") == []
+        assert len(db.get_messages("bob")) == 5
+        
+        db.delete_user("bob")
+        assert db.get_messages("bob") == []
+
+
+class TestMessageSearch:
+    """Test full-text search of stored messages."""
+    
+    def test_ranked_scoped_and_paginated(self, tmp_path):
+        """Matches are ranked, limited to the user, paginated and snippeted."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        db.append_messages("alice", [
+            {"role": "user", "content": "How do I bake sourdough bread?"},
+            {"role": "assistant", "content": "Sourdough needs a starter. " + "Flour and water. " * 40 + "Bake bread hot."},
+            {"role": "user", "content": "And rye bread? (NEAR \"quotes\" AND OR)"}
+        ])
+        db.append_messages("bob", [{"role": "user", "content": "sourdough bread for bob"}])
+        
+        results, has_more = db.search_messages("alice", "sourdough BREAD")
+        assert [r["seq"] for r in results] == [1, 2] and not has_more
+        assert results[0]["snippet"] == "How do I bake sourdough bread?"
+        assert results[1]["snippet"].startswith("Sourdough needs") and results[1]["snippet"].endswith("...")
+        
+        page, has_more = db.search_messages("alice", "bread", limit=2)
+        assert len(page) == 2 and has_more
+        rest, has_more = db.search_messages("alice", "bread", limit=2, offset=2)
+        assert len(rest) == 1 and not has_more
+        
+        assert [r["seq"] for r in db.search_messages("alice", 'NEAR "quotes')[0]] == [3]
+        assert db.search_messages("alice", "?!") == ([], False)
+    
+    def test_search_reads_only_own_entries(self, tmp_path):
+        """Other users' matching messages are filtered out by the index itself."""
+        from utils.search import scope_query
+        
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        db.append_messages("bob", [{"role": "user", "content": f"needle {i}"} for i in range(2000)])
+        db.append_messages("alice", [{"role": "user", "content": "needle in alice's stack"}])
+        
+        results, has_more = db.search_messages("alice", "needle", limit=5)
+        assert [r["snippet"] for r in results] == ["needle in alice's stack"] and not has_more
+        
+        with db.get_connection() as (conn, cursor):
+            cursor.execute("SELECT COUNT(*) FROM messages_fts WHERE messages_fts MATCH ?", (scope_query('"needle"', "alice"),))
+            assert cursor.fetchone()[0] == 1
+    
+    def test_index_follows_changes(self, tmp_path):
+        """Replaced, renamed and deleted messages are found where they now are."""
+        path = str(tmp_path / "settings.db")
+        db = DatabaseManager(path)
+        db.create_user("alice")
+        db.append_messages("alice", [{"role": "user", "content": "x" * 300 + " compressed needle"}])
+        db.save_chat_history("admin", '[{"role": "user", "content": "old needle"}]')
+        db.save_chat_history("admin", '[{"role": "user", "content": "new haystack"}]')
+        assert db.search_messages("admin", "needle") == ([], False)
+        
+        db.update_user_settings("alice", {"username": "carol"})
+        assert [r["role"] for r in db.search_messages("carol", "needle")[0]] == ["user"]
+        
+        # Existing messages are indexed when the index is created, or rebuilt without owners
+        with db.get_connection() as (conn, cursor):
+            cursor.execute("DROP TABLE messages_fts")
+            cursor.execute("CREATE VIRTUAL TABLE messages_fts USING fts5(content, content='')")
+            conn.commit()
+        db = DatabaseManager(path)
+        assert len(db.search_messages("carol", "needle")[0]) == 1
+        
+        db.delete_user("carol")
+        with db.get_connection() as (conn, cursor):
+            cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('integrity-check')")
+            cursor.execute("SELECT COUNT(*) FROM messages_fts")
+            assert cursor.fetchone()[0] == 1
+
+
+class TestRetention:
+    """Test pruning of old chat history and compaction of the database file."""
+    
+    def test_prune_limits(self, tmp_path):
+        """Each limit deletes the oldest messages, and their search entries, in batches."""
+        import time
+        
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        db.append_messages("alice", [{"role": "user", "content": f"old alice {i}"} for i in range(5)])
+        with db.get_connection() as (conn, cursor):
+            cursor.execute("UPDATE messages SET created_at = ?", (time.time() - 10 * 86400,))
+            conn.commit()
+        db.append_messages("alice", [{"role": "user", "content": f"new alice {i}"} for i in range(5)])
+        db.append_messages("bob", [{"role": "user", "content": "b" * 100} for i in range(10)])
+        
+        assert db.prune_messages(max_age=86400, batch_size=2) == 5
+        assert [m["content"] for m in db.get_messages("alice")][0] == "new alice 0"
+        assert db.search_messages("alice", "old") == ([], False)
+        
+        assert db.prune_messages(max_messages_per_user=3, batch_size=2) == 2 + 7
+        assert [m["seq"] for m in db.get_messages("bob")] == [8, 9, 10]
+        
+        # 3 alice messages of 11 bytes, then bob's 3 of 100: keep at most 250 bytes
+        assert db.prune_messages(max_total_bytes=250, batch_size=2) == 4
+        assert [m["seq"] for m in db.get_messages("bob")] == [9, 10]
+        assert db.prune_messages(max_messages_per_user=3, max_age=86400, max_total_bytes=250) == 0
+    
+    def test_total_bytes_tracked_incrementally(self, tmp_path):
+        """The stored byte total follows inserts, updates and deletes without rescanning."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        db.append_messages("alice", [{"role": "user", "content": "x" * 1000}, {"role": "user", "content": "abc"}])
+        
+        def total():
+            with db.get_connection() as (conn, cursor):
+                tracked = cursor.execute("SELECT total_bytes FROM message_stats").fetchone()[0]
+                actual = cursor.execute("SELECT SUM(LENGTH(CAST(content AS BLOB))) FROM messages").fetchone()[0]
+                assert tracked == (actual or 0)
+                return tracked
+        
+        assert total() < 1003  # The long message is compressed
+        db.prune_messages(max_messages_per_user=1)
+        assert total() == 3
+    
+    def test_maintenance_needs_a_limit(self, tmp_path):
+        """Without retention limits no maintenance thread is started."""
+        from config import HistoryConfig
+        from history_maintenance import HistoryMaintenance
+        
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        maintenance = HistoryMaintenance(db, HistoryConfig())
+        maintenance.start()
+        assert maintenance._thread is None
+        
+        maintenance = HistoryMaintenance(db, HistoryConfig(max_age_days=30))
+        maintenance.start()
+        assert maintenance._thread.is_alive()
+        maintenance.stop()
+    
+    def test_compact_releases_free_pages(self, tmp_path):
+        """Pages freed by pruning are returned to the filesystem; older databases are converted explicitly."""
+        path = tmp_path / "settings.db"
+        db = DatabaseManager(str(path))
+        with db.get_connection() as (conn, cursor):
+            cursor.execute("PRAGMA auto_vacuum = NONE")
+            cursor.execute("VACUUM")
+        db.compact()
+        with db.get_connection() as (conn, cursor):
+            assert cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+        db.compress_messages()
+        with db.get_connection() as (conn, cursor):
+            assert cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        
+        db.append_messages("alice", [{"role": "user", "content": os.urandom(2000).hex()} for i in range(200)])
+        with db.get_connection() as (conn, cursor):
+            pages_before = cursor.execute("PRAGMA page_count").fetchone()[0]
+        db.prune_messages(max_messages_per_user=1, batch_size=50)
+        assert db.compact() > 100
+        with db.get_connection() as (conn, cursor):
+            assert cursor.execute("PRAGMA freelist_count").fetchone()[0] == 0
+            assert cursor.execute("PRAGMA page_count").fetchone()[0] < pages_before / 2
+        assert len(db.get_messages("alice")) == 1
+
+
+class TestProjectedQueries:
+    """Test that user and settings reads fetch only the requested columns."""
+    
+    def test_fields_limit_columns(self, tmp_path):
+        """Only requested user columns are returned; unknown ones are rejected."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        token = db.create_user("alice")
+        
+        assert db.get_user_by_username("alice", fields=("token",)) == {"token": token}
+        assert db.get_user_by_token(token, fields=("username", "message_history")) == {
+            "username": "alice", "message_history": False
+        }
+        assert db.get_all_users(fields=("username",)) == [{"username": "alice"}]
+        assert "chat_history" not in db.get_user_by_username("alice")
+        assert "chat_history" not in db.get_settings()
+        
+        with pytest.raises(ValueError):
+            db.get_user_by_username("alice", fields=("chat_history",))
+
+
+class TestConnections:
+    """Test pooled WAL connections under concurrent use."""
+    
+    def test_connections_are_reused(self, tmp_path):
+        """Queries reuse pooled connections, nested uses share one, and uncommitted writes roll back."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        db.create_user("alice")
+        
+        opened = []
+        original_connect = db._connect
+        db._connect = lambda: opened.append(1) or original_connect()
+        
+        for _ in range(10):
+            db.get_user_by_username("alice")
+        assert opened == []
+        
+        with db.get_connection() as (conn, cursor):
+            cursor.execute("PRAGMA journal_mode")
+            assert cursor.fetchone()[0] == "wal"
+            with db.get_connection() as (inner_conn, _):
+                assert inner_conn is conn
+            cursor.execute("UPDATE personal SET model = 'uncommitted' WHERE username = 'alice'")
+        assert db.get_user_by_username("alice")["model"] != "uncommitted"
+    
+    def test_readers_never_wait_for_writer(self, tmp_path):
+        """Reads complete immediately while another connection holds the write lock."""
+        import sqlite3
+        import threading
+        import time
+        
+        path = str(tmp_path / "settings.db")
+        db = DatabaseManager(path)
+        db.create_user("alice")
+        db.append_messages("alice", [{"role": "user", "content": "hi"}])
+        
+        writer = sqlite3.connect(path)
+        writer.execute("BEGIN EXCLUSIVE")
+        writer.execute("UPDATE messages SET content = 'changed' WHERE username = 'alice'")
+        
+        latencies, errors = [], []
+        
+        def read():
+            try:
+                for _ in range(50):
+                    started = time.monotonic()
+                    assert db.get_messages("alice")[0]["content"] == "hi"
+                    db.get_user_by_username("alice")
+                    latencies.append(time.monotonic() - started)
+            except Exception as e:
+                errors.append(e)
+        
+        readers = [threading.Thread(target=read) for _ in range(8)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        writer.commit()
+        writer.close()
+        
+        assert errors == []
+        assert len(latencies) == 400
+        assert max(latencies) < 0.5
+        assert db.get_messages("alice")[0]["content"] == "changed"
+    
+    def test_concurrent_writers_do_not_fail(self, tmp_path):
+        """Writes from many threads wait for the lock instead of failing with 'database is locked'."""
+        import threading
+        
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        usernames = [f"user{i}" for i in range(8)]
+        for username in usernames:
+            db.create_user(username)
+        errors = []
+        
+        def write(username):
+            try:
+                for turn in range(25):
+                    db.append_messages(username, [{"role": "user", "content": str(turn)}])
+                    db.get_settings()
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=write, args=(username,)) for username in usernames]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert errors == []
+        for username in usernames:
+            assert [msg["seq"] for msg in db.get_messages(username)] == list(range(1, 26))
+
+
+class TestAsyncDatabase:
+    """Test that coroutines never run database calls on the event loop."""
+    
+    def test_slow_reads_do_not_stall_event_loop(self, tmp_path, monkeypatch):
+        """A request with slow history reads leaves other coroutines running."""
+        import asyncio
+        import threading
+        import time
+        from ai_service import AIService
+        from database import AsyncDatabaseManager
+        from history_cache import HistoryCache
+        from request_context import resolve_request_context
+        from response_cache import ResponseCache
+        
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        db.create_user("alice")
+        db.update_user_settings("alice", {"message_history": True, "provider": "Auto"})
+        
+        service = AIService()
+        service.db = db
+        service.async_db = AsyncDatabaseManager(db, max_workers=2)
+        service.history_cache = HistoryCache(db)
+        service.response_cache = ResponseCache(db=db)
+        
+        reader_threads = []
+        original_get_messages = db.get_messages
+        
+        def slow_get_messages(*args, **kwargs):
+            reader_threads.append(threading.current_thread().name)
+            time.sleep(0.3)
+            return original_get_messages(*args, **kwargs)
+        
+        async def fake_call_ai_api(**kwargs):
+            return "answer"
+        
+        monkeypatch.setattr(db, "get_messages", slow_get_messages)
+        monkeypatch.setattr(service, "_call_ai_api", fake_call_ai_api)
+        monkeypatch.setattr(type(service.config), "available_providers", property(lambda self: {"Auto": ""}))
+        
+        async def run():
+            context = await service.async_db.run(resolve_request_context, "alice", use_history=True, db=db)
+            assert await service.async_db.get_user_by_username("alice", fields=("username",)) == {"username": "alice"}
+            
+            gaps = []
+            
+            async def ticker():
+                last = time.monotonic()
+                while not request.done():
+                    await asyncio.sleep(0.01)
+                    now = time.monotonic()
+                    gaps.append(now - last)
+                    last = now
+            
+            request = asyncio.ensure_future(service.generate_response_with_meta("hi", context=context))
+            await ticker()
+            return request.result(), max(gaps)
+        
+        result, max_gap = asyncio.run(run())
+        service.async_db.shutdown()
+        
+        assert result.text == "answer"
+        assert max_gap < 0.2
+        assert reader_threads and all(name.startswith("db") for name in reader_threads)
+
+
+class TestRequestQueries:
+    """Test how many SQL statements one chat request costs."""
+    
+    def test_virtual_user_request_query_count(self, tmp_path, monkeypatch):
+        """Token check, context resolution and history save use a fixed number of statements."""
+        import asyncio
+        import sqlite3
+        import database
+        from ai_service import AIService
+        from auth import AuthService
+        from history_cache import HistoryCache
+        from request_context import resolve_request_context
+        from response_cache import ResponseCache
+        
+        statements = []
+        real_connect = sqlite3.connect
+        
+        def traced_connect(*args, **kwargs):
+            conn = real_connect(*args, **kwargs)
+            conn.set_trace_callback(statements.append)
+            return conn
+        
+        monkeypatch.setattr(database.sqlite3, "connect", traced_connect)
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        token = db.create_user("alice")
+        db.update_user_settings("alice", {"message_history": True, "provider": "Auto"})
+        
+        auth = AuthService()
+        auth.db = db
+        service = AIService()
+        service.db = db
+        service.history_cache = HistoryCache(db)
+        service.response_cache = ResponseCache(db=db)
+        
+        async def fake_call_ai_api(**kwargs):
+            return "answer"
+        
+        monkeypatch.setattr(service, "_call_ai_api", fake_call_ai_api)
+        monkeypatch.setattr(type(service.config), "available_providers", property(lambda self: {"Auto": ""}))
+        
+        def handle_request(question):
+            username = auth.verify_token_access(token, private_mode=True)
+            context = resolve_request_context(username, use_history=True, db=db)
+            return asyncio.run(service.generate_response_with_meta(question, context=context))
+        
+        handle_request("warm up")
+        statements.clear()
+        
+        assert handle_request("second question").text == "answer"
+        # Statements run inside the full-text index module are traced with a leading "--", and
+        # triggers (the stored byte total) repeat the statement that fired them
+        queries = [
+            s for i, s in enumerate(statements)
+            if not s.startswith(("BEGIN", "COMMIT", "--")) and (i == 0 or s != statements[i - 1])
+        ]
+        # Version check (2), user row, messages added since the last turn, one insert for the new
+        # turn and one for its search index entries
+        assert len(queries) <= 6, statements
+        assert not any("SELECT *" in query or "password" in query for query in queries), queries
+        assert [m["content"] for m in db.get_messages("alice")] == ["warm up", "answer", "second question", "answer"]
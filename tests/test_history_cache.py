@@ -0,0 +1,148 @@
+"""Tests for the chat-history cache."""
+
+import sys
+import os
+
+import pytest
+
+# Add src to Python path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import HistoryConfig
+from database import DatabaseManager
+from history_cache import HistoryCache
+from history_writer import HistoryWriter
+from utils.exceptions import DatabaseError
+
+
+def _turn(number):
+    return [{"role": "user", "content": f"q{number} \"quoted\""}, {"role": "assistant", "content": f"a{number}"}]
+
+
+class TestHistoryCache:
+    """Test cached conversations kept in step with the messages table."""
+    
+    def test_append_and_read_back(self, tmp_path):
+        """Appended turns are returned in order, from memory and from a fresh cache."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        cache = HistoryCache(db, HistoryConfig())
+        conversation = []
+        for number in range(3):
+            assert cache.get_messages("alice") == conversation
+            cache.append("alice", _turn(number))
+            conversation.extend(_turn(number))
+        
+        assert cache.get_messages("alice") == conversation
+        assert HistoryCache(db, HistoryConfig()).get_messages("alice") == conversation
+    
+    def test_reads_only_new_rows(self, tmp_path):
+        """A cached conversation is topped up with rows written by another process."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        cache = HistoryCache(db, HistoryConfig())
+        cache.append("alice", _turn(0))
+        cache.get_messages("alice")
+        
+        DatabaseManager(db.db_path).append_messages("alice", _turn(1))
+        
+        reads = []
+        original_get = db.get_messages
+        db.get_messages = lambda *args, **kwargs: reads.append(kwargs) or original_get(*args, **kwargs)
+        
+        assert cache.get_messages("alice") == _turn(0) + _turn(1)
+        assert reads == [{"after_seq": 2, "anchor_seq": 1}]
+    
+    def test_replaced_history_is_reread(self, tmp_path):
+        """A conversation replaced or trimmed behind the cache's back is read again."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        cache = HistoryCache(db, HistoryConfig())
+        cache.append("alice", _turn(0) + _turn(1))
+        cache.get_messages("alice")
+        
+        db.save_chat_history("alice", '[{"role": "user", "content": "fresh start"}]')
+        assert cache.get_messages("alice") == [{"role": "user", "content": "fresh start"}]
+        
+        db.save_chat_history("alice", "")
+        assert cache.get_messages("alice") == []
+    
+    def test_bounded_by_size(self, tmp_path):
+        """Large histories push older users out of the cache."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        cache = HistoryCache(db, HistoryConfig(cache_max_bytes=1000))
+        for name in ("alice", "bob"):
+            cache.append(name, [{"role": "user", "content": "x" * 600}])
+            cache.get_messages(name)
+        
+        assert ("alice", "default") not in cache._entries
+        assert ("bob", "default") in cache._entries
+
+
+class TestHistoryWriter:
+    """Test write-behind batching of appended messages."""
+    
+    def test_reads_see_queued_messages(self, tmp_path):
+        """Queued turns are read back before and after they are written, once each."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        writer = HistoryWriter(db, HistoryConfig(flush_interval_ms=60000, flush_messages=1000))
+        cache = HistoryCache(db, HistoryConfig(), writer=writer)
+        
+        cache.append("alice", _turn(0))
+        cache.append("alice", _turn(1))
+        assert db.get_messages("alice") == []
+        assert cache.get_messages("alice") == _turn(0) + _turn(1)
+        
+        cache.flush()
+        cache.append("alice", _turn(2))
+        assert [row["content"] for row in db.get_messages("alice")] == ["q0 \"quoted\"", "a0", "q1 \"quoted\"", "a1"]
+        assert cache.get_messages("alice") == _turn(0) + _turn(1) + _turn(2)
+        writer.stop()
+    
+    def test_batches_in_one_transaction(self, tmp_path):
+        """Messages of several conversations are written together, and on stop."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        writer = HistoryWriter(db, HistoryConfig(flush_interval_ms=60000, flush_messages=1000))
+        batches = []
+        original_batch = db.append_message_batch
+        db.append_message_batch = lambda batch: batches.append(dict(batch)) or original_batch(batch)
+        
+        for name in ("alice", "bob"):
+            writer.enqueue((name, "default"), _turn(0))
+        writer.stop()
+        
+        assert len(batches) == 1
+        assert db.get_messages("bob") and db.get_messages("alice")
+    
+    def test_threshold_and_bound(self, tmp_path):
+        """Enough pending messages trigger a write, and enqueueing never outgrows the bound."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        writer = HistoryWriter(db, HistoryConfig(flush_interval_ms=60000, flush_messages=4, max_pending_messages=4))
+        for number in range(10):
+            writer.enqueue(("alice", "default"), _turn(number))
+            assert writer._pending_count <= 4 + 2
+        writer.stop()
+        
+        assert len(db.get_messages("alice")) == 20
+    
+    def test_failing_database_does_not_block_forever(self, tmp_path):
+        """A full queue fails after enqueue_timeout, and a failing batch is dropped after max_write_attempts."""
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        writer = HistoryWriter(db, HistoryConfig(
+            flush_interval_ms=60000, flush_messages=1000, max_pending_messages=2,
+            enqueue_timeout=0.1, max_write_attempts=2
+        ))
+        original_batch = db.append_message_batch
+        
+        def failing_batch(batch):
+            raise DatabaseError("disk I/O error")
+        
+        db.append_message_batch = failing_batch
+        writer.enqueue(("alice", "default"), _turn(0))
+        with pytest.raises(DatabaseError):
+            writer.enqueue(("alice", "default"), _turn(1))
+        
+        assert writer.flush() == 0 and writer._pending_count == 2
+        assert writer.flush() == 0 and writer._pending_count == 0
+        
+        db.append_message_batch = original_batch
+        writer.enqueue(("alice", "default"), _turn(2))
+        writer.stop()
+        assert [m["content"] for m in db.get_messages("alice")] == [m["content"] for m in _turn(2)]
@@ -0,0 +1,390 @@
+"""Tests for provider health monitoring and routing."""
+
+import sys
+import os
+import time
+
+# Add src to Python path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.provider_monitor import ProviderMonitor, AdaptiveLimit
+from utils.http_utils import classify_error, extract_retry_after
+
+
+class TestAdaptiveConcurrency:
+    """Test AIMD concurrency limits learned per provider."""
+    
+    def test_limit_grows_additively_on_success(self):
+        """Successful calls slowly raise the limit."""
+        limit = AdaptiveLimit(limit=4.0)
+        for _ in range(8):
+            limit.on_success(latency=1.0)
+        assert 5.0 < limit.limit < 7.0
+    
+    def test_limit_starts_unlimited(self):
+        """Until the first congestion signal only max_limit bounds a provider."""
+        limit = AdaptiveLimit()
+        for _ in range(8):
+            limit.on_success(latency=1.0)
+        assert limit.limit is None
+        assert limit.headroom == 64
+    
+    def test_limit_shrinks_on_congestion(self):
+        """Timeouts and rate limits halve the load in flight, down to the floor."""
+        monitor = ProviderMonitor()
+        monitor.get_provider_health("TestProvider").concurrency.in_flight = 4
+        monitor.record_failure("TestProvider", "timeout")
+        assert monitor.get_provider_health("TestProvider").concurrency.limit == 2.0
+        
+        for _ in range(5):
+            monitor.record_failure("TestProvider", "rate_limited")
+        assert monitor.get_provider_health("TestProvider").concurrency.limit == 1.0
+    
+    def test_one_cut_per_congestion_window(self):
+        """Calls started before the last cut do not cut again, and the limit keeps the earlier load."""
+        import time
+        
+        limit = AdaptiveLimit()
+        for _ in range(6):
+            limit.acquire()
+        started = time.monotonic()
+        
+        for _ in range(6):
+            limit.on_congestion(started)
+        assert limit.limit == 6.0
+        
+        limit.limit = 12.0
+        assert limit.on_congestion(time.monotonic())
+        assert not limit.on_congestion(started)
+        assert limit.limit == 6.0
+    
+    def test_lone_timeout_keeps_observed_load(self):
+        """A single timeout does not throttle a provider below what it already carried."""
+        monitor = ProviderMonitor()
+        for _ in range(3):
+            assert monitor.try_acquire("TestProvider")
+        for _ in range(3):
+            monitor.release("TestProvider")
+        
+        assert monitor.try_acquire("TestProvider")
+        monitor.record_failure("TestProvider", "timeout")
+        monitor.release("TestProvider")
+        assert monitor.get_headroom("TestProvider") == 3
+    
+    def test_limit_relaxes_without_congestion(self):
+        """A limit not cut for relax_after seconds is lifted."""
+        limit = AdaptiveLimit(relax_after=0.0)
+        limit.on_congestion()
+        assert limit.limit == 1.0
+        assert limit.headroom == 64 and limit.limit is None
+    
+    def test_non_congestion_errors_keep_limit(self):
+        """Errors unrelated to load do not change the limit."""
+        monitor = ProviderMonitor()
+        monitor.record_failure("TestProvider", "unauthorized")
+        assert monitor.get_provider_health("TestProvider").concurrency.limit is None
+    
+    def test_latency_does_not_shrink_limit(self):
+        """Slow answers (e.g. long outputs) are not taken for congestion."""
+        limit = AdaptiveLimit(limit=8.0)
+        limit.on_success(latency=1.0)
+        for _ in range(10):
+            limit.on_success(latency=5.0)
+        assert limit.limit > 8.0
+    
+    def test_retries_cut_limit_once(self, tmp_path, monkeypatch):
+        """A call whose attempts all time out counts as one congestion signal."""
+        import asyncio
+        import ai_service as ai_service_module
+        from ai_service import AIService
+        from database import DatabaseManager
+        
+        class FakeProvider:
+            pass
+        
+        async def timing_out(**kwargs):
+            raise asyncio.TimeoutError()
+        
+        monitor = ProviderMonitor()
+        monitor.get_provider_health("Slow").concurrency.limit = 8.0
+        monkeypatch.setattr(ai_service_module, "provider_monitor", monitor)
+        monkeypatch.setattr(ai_service_module.g4f.ChatCompletion, "create_async", timing_out)
+        
+        service = AIService()
+        service.db = DatabaseManager(str(tmp_path / "settings.db"))
+        result = asyncio.run(service._make_api_call(
+            [{"role": "user", "content": "hi"}], FakeProvider(), "gpt-4", {}, None, provider_name="Slow"
+        ))
+        
+        health = monitor.get_provider_health("Slow")
+        assert result is None
+        assert health.failure_count == 2
+        assert health.concurrency.limit == 4.0
+    
+    def test_acquire_respects_headroom(self):
+        """Slots are refused once the provider is at its limit."""
+        monitor = ProviderMonitor()
+        monitor.get_provider_health("TestProvider").concurrency.limit = 2.0
+        
+        assert monitor.try_acquire("TestProvider")
+        assert monitor.try_acquire("TestProvider")
+        assert not monitor.try_acquire("TestProvider")
+        assert monitor.get_headroom("TestProvider") == 0
+        
+        monitor.release("TestProvider")
+        assert monitor.get_headroom("TestProvider") == 1
+    
+    def test_healthy_providers_sorted_by_headroom(self):
+        """Routing prefers providers with more spare capacity."""
+        monitor = ProviderMonitor()
+        monitor.get_provider_health("Busy").concurrency.in_flight = 3
+        
+        healthy = monitor.get_healthy_providers({"Auto": "", "Busy": None, "Idle": None})
+        assert healthy == ["Idle", "Busy"]
+
+
+class _RateLimitError(Exception):
+    """Stand-in for an HTTP client error carrying response headers."""
+    
+    def __init__(self, message, headers=None, status=None):
+        super().__init__(message)
+        self.headers = headers or {}
+        self.status = status
+
+
+class TestRateLimitRouting:
+    """Test recognition of upstream rate limits and routing cooldowns."""
+    
+    def test_rate_limit_errors_classified(self):
+        """429 and quota errors are recognized as rate limits."""
+        assert classify_error(Exception("Response 429: Too Many Requests")) == "rate_limited"
+        assert classify_error(Exception("You exceeded your current quota")) == "rate_limited"
+        assert classify_error(_RateLimitError("boom", status=429)) == "rate_limited"
+        assert classify_error(Exception("401 Unauthorized")) == "unauthorized"
+        assert classify_error(Exception("HTTP 429")) == "rate_limited"
+        assert classify_error(Exception("429: slow down")) == "rate_limited"
+        assert classify_error(Exception("Model gpt-4-0429 not found")) == "unknown"
+        assert classify_error(Exception("Prompt has 14293 tokens, conversation 429f8c failed")) == "unknown"
+        assert classify_error(Exception("Connection refused on port 4290")) == "network"
+    
+    def test_retry_after_from_headers(self):
+        """Retry-After headers are honored, in seconds or as a reset timestamp."""
+        assert extract_retry_after(_RateLimitError("429", {"Retry-After": "30"})) == 30.0
+        
+        reset = extract_retry_after(_RateLimitError("429", {"X-RateLimit-Reset": str(int(time.time()) + 120)}))
+        assert 100 < reset <= 120
+    
+    def test_retry_after_from_message(self):
+        """Wait hints embedded in the error message are parsed with units."""
+        assert extract_retry_after(Exception("Rate limit reached, try again in 2 minutes")) == 120.0
+        assert extract_retry_after(Exception("429, retry after 500ms")) == 0.5
+        assert extract_retry_after(Exception("429 Too Many Requests")) is None
+    
+    def test_cooldown_excludes_provider_from_routing(self):
+        """A rate-limited provider is skipped until its window expires."""
+        monitor = ProviderMonitor()
+        monitor.mark_unavailable("Limited", 60, reason="429")
+        
+        assert not monitor.is_available("Limited")
+        assert monitor.get_healthy_providers({"Limited": None, "Other": None}) == ["Other"]
+        
+        monitor.mark_unavailable("Expired", 0)
+        assert monitor.is_available("Expired")
+    
+    def test_proxy_cooldown_is_scoped(self):
+        """A rate limit seen through one proxy does not block the provider elsewhere."""
+        monitor = ProviderMonitor()
+        monitor.mark_unavailable("Limited", 60, proxy="http://u:p@1.2.3.4:8080")
+        
+        assert not monitor.is_available("Limited", "http://u:p@1.2.3.4:8080")
+        assert monitor.is_available("Limited", "http://u:p@5.6.7.8:8080")
+        assert monitor.is_available("Limited")
+    
+    def test_auto_is_never_cooled_down(self, tmp_path, monkeypatch):
+        """A rate limit surfacing through Auto neither cools Auto down nor cuts its limit."""
+        import asyncio
+        import ai_service as ai_service_module
+        from ai_service import AIService
+        from database import DatabaseManager
+        
+        async def rate_limited(**kwargs):
+            raise _RateLimitError("Too Many Requests", status=429)
+        
+        monitor = ProviderMonitor()
+        monkeypatch.setattr(ai_service_module, "provider_monitor", monitor)
+        monkeypatch.setattr(ai_service_module.g4f.ChatCompletion, "create_async", rate_limited)
+        
+        service = AIService()
+        service.db = DatabaseManager(str(tmp_path / "settings.db"))
+        result = asyncio.run(service._make_api_call(
+            [{"role": "user", "content": "hi"}], None, "gpt-4", {}, None, provider_name="Auto"
+        ))
+        
+        assert result is None
+        assert monitor.get_provider_health("Auto").failure_count == 1
+        assert monitor.is_available("Auto")
+        assert monitor.get_provider_health("Auto").concurrency.limit is None
+
+
+class TestHealthProbes:
+    """Test synthetic health probes and how they are recorded."""
+    
+    def test_probe_results_not_counted_as_user_traffic(self):
+        """Probe outcomes drive health status but not user call counters."""
+        monitor = ProviderMonitor()
+        for _ in range(5):
+            monitor.record_failure("Probed", "timeout", probe=True)
+        
+        health = monitor.get_provider_health("Probed")
+        assert health.failure_count == 0
+        assert health.probe_failure_count == 5
+        assert health.status.value == "unhealthy"
+        assert health.concurrency.limit is None
+        
+        monitor.record_success("Probed", probe=True)
+        assert health.success_count == 0
+        assert health.consecutive_failures == 0
+    
+    def test_probe_leaves_accounts_and_slots_alone(self, tmp_path, monkeypatch):
+        """A probe uses no pooled account or concurrency slot and starts no cooldown."""
+        import asyncio
+        import json
+        import ai_service as ai_service_module
+        from ai_service import AIService
+        from database import DatabaseManager
+        from utils.cookies import CookiePool
+        
+        class _RateLimitError(Exception):
+            status = 429
+        
+        class FakeProvider:
+            pass
+        
+        seen_cookies = []
+        
+        async def fake_create_async(cookies=None, **kwargs):
+            seen_cookies.append(cookies)
+            raise _RateLimitError("Too Many Requests")
+        
+        monitor = ProviderMonitor()
+        monkeypatch.setattr(ai_service_module, "provider_monitor", monitor)
+        monkeypatch.setattr(ai_service_module.g4f.ChatCompletion, "create_async", fake_create_async)
+        (tmp_path / "a.json").write_text(json.dumps({"provider": "Probed", "cookies": {"session": "a"}}))
+        
+        service = AIService()
+        service.db = DatabaseManager(str(tmp_path / "settings.db"))
+        service.cookie_pool = CookiePool(str(tmp_path), check_interval=0)
+        acquired = []
+        monkeypatch.setattr(monitor, "try_acquire", lambda name: acquired.append(name) or True)
+        
+        result = asyncio.run(service._make_api_call(
+            [{"role": "user", "content": "ping"}], FakeProvider, "gpt-4", {"dummy": "1"}, None, "Probed", probe=True
+        ))
+        
+        assert result is None
+        assert seen_cookies == [{"dummy": "1"}]
+        assert acquired == []
+        assert monitor.is_available("Probed")
+        assert monitor.get_provider_health("Probed").probe_failure_count == 1
+        status = service.cookie_pool.get_status()[0]
+        assert status["last_error"] is None and status["cooldown_remaining"] == 0
+    
+    def test_prober_runs_round_on_idle_providers(self, monkeypatch):
+        """A probe round calls every eligible provider once with probe tagging."""
+        import asyncio
+        from types import SimpleNamespace
+        from config import ProbeConfig
+        from health_prober import HealthProber
+        import health_prober as prober_module
+        
+        calls = []
+        
+        class FakeService:
+            config = SimpleNamespace(
+                available_providers={"Auto": "", "Idle": object(), "OpenaiChat": object()},
+                api=SimpleNamespace(default_model="gpt-4")
+            )
+            
+            async def _make_api_call(self, messages, ai_provider, model, cookies, proxy, provider_name, **kwargs):
+                calls.append((provider_name, kwargs.get("probe")))
+                return "OK"
+        
+        monkeypatch.setattr(prober_module, "provider_monitor", ProviderMonitor())
+        prober = HealthProber(FakeService(), ProbeConfig(max_probes_per_minute=0))
+        results = asyncio.run(prober.run_round())
+        
+        assert results == {"Idle": True}
+        assert calls == [("Idle", True)]
+
+
+class TestProviderStatePersistence:
+    """Test snapshotting provider health to the database and restoring it."""
+    
+    def test_snapshot_round_trip(self, tmp_path):
+        """Health counters, limits and statuses survive a restart."""
+        from database import DatabaseManager
+        from provider_state import ProviderStateStore
+        
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        monitor = ProviderMonitor()
+        for _ in range(5):
+            monitor.record_failure("Down", "timeout")
+        for _ in range(4):
+            monitor.record_success("Up", latency=0.5)
+        ProviderStateStore(db=db, monitor=monitor).save()
+        
+        restored = ProviderMonitor()
+        assert ProviderStateStore(db=db, monitor=restored).restore() == 2
+        
+        assert restored.get_provider_health("Down").status.value == "unhealthy"
+        assert restored.get_provider_health("Down").error_types == {"timeout"}
+        assert restored.get_provider_health("Down").concurrency.limit < 4.0
+        assert restored.get_provider_health("Up").success_count == 4
+        assert restored.get_healthy_providers({"Down": None, "Up": None}) == ["Up"]
+    
+    def test_old_state_is_decayed(self):
+        """Counters from old snapshots are trusted less, and very old ones dropped."""
+        monitor = ProviderMonitor()
+        for _ in range(8):
+            monitor.record_failure("Flaky", "network")
+        rows = monitor.export_state()
+        rows[0]["updated_at"] -= 3600
+        
+        restored = ProviderMonitor()
+        restored.restore_state(rows, half_life=3600, max_age=86400)
+        assert restored.get_provider_health("Flaky").failure_count == 4
+        assert restored.get_provider_health("Flaky").consecutive_failures == 4
+        
+        rows[0]["updated_at"] -= 86400
+        assert ProviderMonitor().restore_state(rows, half_life=3600, max_age=86400) == 0
+    
+    def test_shared_state_between_workers(self, tmp_path):
+        """A failure streak seen by one worker is visible to another after a sync."""
+        from config import MonitorConfig
+        from database import DatabaseManager
+        from provider_state import ProviderStateStore
+        
+        db_path = str(tmp_path / "settings.db")
+        shared = MonitorConfig(shared=True)
+        worker_a, worker_b = ProviderMonitor(), ProviderMonitor()
+        store_a = ProviderStateStore(db=DatabaseManager(db_path), monitor=worker_a, monitor_config=shared)
+        store_b = ProviderStateStore(db=DatabaseManager(db_path), monitor=worker_b, monitor_config=shared)
+        worker_a.track_deltas = worker_b.track_deltas = True
+        
+        for _ in range(3):
+            worker_a.record_failure("Flaky", "network")
+        for _ in range(2):
+            worker_b.record_failure("Flaky", "network")
+        worker_a.mark_unavailable("Limited", 60, reason="429")
+        store_a.sync()
+        store_b.sync()
+        
+        assert worker_b.get_provider_health("Flaky").failure_count == 5
+        assert worker_b.get_provider_health("Flaky").status.value == "unhealthy"
+        assert not worker_b.is_available("Limited")
+        
+        worker_b.record_success("Flaky")
+        store_b.sync()
+        store_a.sync()
+        assert worker_a.get_provider_health("Flaky").consecutive_failures == 0
+        assert worker_a.get_provider_health("Flaky").success_count == 1
@@ -0,0 +1,385 @@
+"""Tests for the response cache."""
+
+import sys
+import os
+import time
+
+# Add src to Python path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.lru import LRUCache
+
+
+class TestLRUCache:
+    """Test the bounded LRU utility."""
+    
+    def test_evicts_least_recently_used(self):
+        """The oldest untouched entry is evicted first."""
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        
+        assert "a" in cache and "c" in cache
+        assert "b" not in cache
+    
+    def test_byte_budget(self):
+        """Entries are evicted to stay within the size budget."""
+        cache = LRUCache(max_entries=100, max_bytes=10, sizeof=len)
+        cache.put("a", "xxxxxx")
+        cache.put("b", "yyyyyy")
+        
+        assert "a" not in cache
+        assert cache.total_bytes == 6
+        
+        cache.put("huge", "z" * 11)
+        assert "huge" not in cache
+
+
+class TestResponseCache:
+    """Test the two-tier response cache."""
+    
+    def _make_cache(self, tmp_path, **overrides):
+        from config import CacheConfig
+        from database import DatabaseManager
+        from response_cache import ResponseCache
+        
+        db = DatabaseManager(str(tmp_path / "settings.db"))
+        return ResponseCache(db=db, cache_config=CacheConfig(**{"enabled": True, **overrides})), db
+    
+    def test_key_depends_on_request(self):
+        """Different providers, models or prompts never share a key."""
+        from response_cache import ResponseCache
+        
+        messages = [{"role": "user", "content": "hi"}]
+        key = ResponseCache.make_key(messages, "Auto", "gpt-4", True)
+        
+        assert key == ResponseCache.make_key(list(messages), "Auto", "gpt-4", True)
+        assert key != ResponseCache.make_key(messages, "Bing", "gpt-4", True)
+        assert key != ResponseCache.make_key(messages, "Auto", "gpt-4", False)
+        assert key != ResponseCache.make_key([{"role": "user", "content": "hey"}], "Auto", "gpt-4", True)
+    
+    def test_persistent_tier_survives_restart(self, tmp_path):
+        """An answer cached by one instance is served from disk by the next."""
+        from response_cache import ResponseCache
+        
+        cache, db = self._make_cache(tmp_path)
+        cache.put("key", "answer", "Auto", "gpt-4")
+        
+        restarted = ResponseCache(db=db, cache_config=cache.config)
+        assert restarted.get("key").response == "answer"
+        assert restarted.get("key").response == "answer"
+        assert restarted.stats["disk_hits"] == 1
+        assert restarted.stats["memory_hits"] == 1
+    
+    def test_expired_entries_miss_and_are_pruned(self, tmp_path):
+        """Entries older than the TTL are not served and get pruned."""
+        cache, db = self._make_cache(tmp_path, ttl=60, prune_every=1, stale_while_revalidate=0, stale_if_error=0)
+        db.put_cached_response("old", "stale", "Auto", "gpt-4", time.time() - 120)
+        
+        assert cache.get("old") is None
+        cache.put("new", "fresh", "Auto", "gpt-4")
+        assert db.get_cached_response("old") is None
+        assert db.get_cached_response("new")["response"] == "fresh"
+    
+    def test_service_serves_repeated_prompt_from_cache(self, tmp_path, monkeypatch):
+        """A second identical stateless prompt does not reach the provider."""
+        import asyncio
+        from ai_service import AIService
+        
+        calls = []
+        
+        async def fake_call_ai_api(**kwargs):
+            calls.append(kwargs["chat_history"])
+            return "answer"
+        
+        from history_cache import HistoryCache
+        
+        service = AIService()
+        service.response_cache, _ = self._make_cache(tmp_path)
+        service.db = service.response_cache.db
+        service.history_cache = HistoryCache(service.db)
+        monkeypatch.setattr(service, "_call_ai_api", fake_call_ai_api)
+        monkeypatch.setattr(type(service.config), "available_providers", property(lambda self: {"Auto": ""}))
+        
+        first = asyncio.run(service.generate_response_with_meta("What is 2+2?", provider="Auto", model="gpt-4"))
+        second = asyncio.run(service.generate_response_with_meta("What is 2+2?", provider="Auto", model="gpt-4"))
+        bypass = asyncio.run(service.generate_response_with_meta("What is 2+2?", provider="Auto", model="gpt-4", read_cache=False))
+        
+        assert (first.cache_status, second.cache_status, bypass.cache_status) == ("MISS", "HIT", "BYPASS")
+        assert second.text == "answer"
+        assert len(calls) == 2
+        
+        service.response_cache.config.enabled = False
+        disabled = asyncio.run(service.generate_response_with_meta("What is 3+3?", provider="Auto", model="gpt-4"))
+        assert disabled.cache_status == "BYPASS"
+
+
+class TestRequestCoalescing:
+    """Test sharing one upstream call among identical in-flight requests."""
+    
+    def _make_service(self, tmp_path, monkeypatch, fake_call):
+        from ai_service import AIService
+        from config import CacheConfig
+        from database import DatabaseManager
+        from history_cache import HistoryCache
+        from response_cache import ResponseCache
+        
+        service = AIService()
+        service.db = DatabaseManager(str(tmp_path / "settings.db"))
+        service.response_cache = ResponseCache(db=service.db, cache_config=CacheConfig(enabled=False))
+        service.history_cache = HistoryCache(service.db)
+        monkeypatch.setattr(service, "_call_ai_api", fake_call)
+        monkeypatch.setattr(type(service.config), "available_providers", property(lambda self: {"Auto": ""}))
+        return service
+    
+    def test_identical_requests_share_one_call(self, tmp_path, monkeypatch):
+        """A burst of identical prompts reaches the provider once."""
+        import asyncio
+        
+        calls = []
+        
+        async def slow_call(**kwargs):
+            calls.append(kwargs["chat_history"][-1]["content"])
+            await asyncio.sleep(0.1)
+            return "answer"
+        
+        service = self._make_service(tmp_path, monkeypatch, slow_call)
+        
+        async def burst():
+            same = [service.generate_response_with_meta("Same?", provider="Auto", model="gpt-4") for _ in range(5)]
+            other = service.generate_response_with_meta("Other?", provider="Auto", model="gpt-4")
+            return await asyncio.gather(*same, other)
+        
+        results = asyncio.run(burst())
+        
+        assert sorted(calls) == ["Other?", "Same?"]
+        assert all(result.text == "answer" for result in results)
+        assert sum(result.coalesced for result in results) == 4
+    
+    def test_requests_on_separate_loops_share_one_call(self, tmp_path, monkeypatch):
+        """Identical prompts from different request threads, each with its own loop, share a call."""
+        import asyncio
+        import threading
+        
+        calls = []
+        
+        async def slow_call(**kwargs):
+            calls.append(threading.current_thread().name)
+            await asyncio.sleep(0.2)
+            return "answer"
+        
+        service = self._make_service(tmp_path, monkeypatch, slow_call)
+        results = []
+        
+        def request():
+            results.append(asyncio.run(service.generate_response_with_meta("Same?", provider="Auto", model="gpt-4")))
+        
+        threads = [threading.Thread(target=request) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert len(calls) == 1
+        assert [result.text for result in results] == ["answer"] * 3
+        assert sum(result.coalesced for result in results) == 2
+        assert service._inflight == {}
+    
+    def test_waiters_recover_when_leader_loop_closes(self, tmp_path, monkeypatch):
+        """Waiters make the call themselves when the first request ends and its loop closes."""
+        import asyncio
+        import threading
+        
+        calls = []
+        
+        async def call(**kwargs):
+            calls.append(threading.current_thread().name)
+            await asyncio.sleep(1.0 if len(calls) == 1 else 0.05)
+            return "answer"
+        
+        service = self._make_service(tmp_path, monkeypatch, call)
+        
+        async def abandoned():
+            try:
+                await asyncio.wait_for(
+                    service.generate_response_with_meta("Same?", provider="Auto", model="gpt-4"), timeout=0.2
+                )
+            except asyncio.TimeoutError:
+                pass
+        
+        leader = threading.Thread(target=asyncio.run, args=(abandoned(),), name="leader")
+        leader.start()
+        while not calls:
+            threading.Event().wait(0.01)
+        result = asyncio.run(service.generate_response_with_meta("Same?", provider="Auto", model="gpt-4"))
+        leader.join()
+        
+        assert result.text == "answer" and not result.coalesced
+        assert calls == ["leader", threading.current_thread().name]
+        assert service._inflight == {}
+    
+    def test_errors_are_shared(self, tmp_path, monkeypatch):
+        """Every waiter sees the failure of the shared call."""
+        import asyncio
+        from utils.exceptions import AIProviderError
+        
+        async def failing_call(**kwargs):
+            await asyncio.sleep(0.05)
+            raise AIProviderError("All providers failed to generate a response")
+        
+        service = self._make_service(tmp_path, monkeypatch, failing_call)
+        
+        async def burst():
+            return await asyncio.gather(
+                *(service.generate_response_with_meta("Q", provider="Auto", model="gpt-4") for _ in range(3)),
+                return_exceptions=True
+            )
+        
+        results = asyncio.run(burst())
+        assert all(isinstance(result, AIProviderError) for result in results)
+        assert service._inflight == {}
+
+
+class TestSimilarityCache:
+    """Test near-duplicate prompt matching."""
+    
+    def test_near_duplicates_match_within_scope(self):
+        """Casing, punctuation and small wording changes still match, other scopes do not."""
+        from utils.similarity import MinHashIndex
+        
+        index = MinHashIndex(threshold=0.7)
+        index.add("gpt-4", "What is the capital city of France?", "k1")
+        
+        key, score = index.query("gpt-4", "what is the capital city of   france")
+        assert key == "k1" and score == 1.0
+        
+        key, score = index.query("gpt-4", "What's the capital city of France?")
+        assert key == "k1" and 0.7 <= score < 1.0
+        
+        assert index.query("other-model", "What is the capital city of France?") is None
+        assert index.query("gpt-4", "How do I bake sourdough bread at home?") is None
+    
+    def test_operators_numbers_and_short_prompts_do_not_match(self):
+        """Prompts differing in a symbol or number, and very short prompts, are never similar."""
+        from utils.similarity import MinHashIndex
+        
+        index = MinHashIndex(threshold=0.5)
+        index.add("gpt-4", "Please calculate the result of 2+3", "plus")
+        index.add("gpt-4", "hi", "short")
+        
+        assert index.query("gpt-4", "Please calculate the result of 2*3") is None
+        assert index.query("gpt-4", "Please calculate the result of 2+4") is None
+        assert index.query("gpt-4", "please calculate the result of 2 + 3")[0] == "plus"
+        assert index.query("gpt-4", "hi") is None
+        assert index.query("gpt-4", "") is None
+        assert len(index) == 1
+    
+    def test_negations_do_not_match(self):
+        """A prompt asking the opposite of an indexed one is not served its answer."""
+        from utils.similarity import MinHashIndex
+        
+        prompt = "Write a long product description for our new hiking boots that should mention the price"
+        index = MinHashIndex(threshold=0.5)
+        index.add("gpt-4", prompt, "k1")
+        
+        assert index.query("gpt-4", prompt.replace("should", "should not")) is None
+        assert index.query("gpt-4", prompt.replace("should", "shouldn't")) is None
+        assert index.query("gpt-4", prompt.replace("the price", "no price")) is None
+        assert index.query("gpt-4", prompt + "!")[0] == "k1"
+    
+    def test_index_is_bounded(self):
+        """Old signatures are evicted along with their buckets."""
+        from utils.similarity import MinHashIndex
+        
+        index = MinHashIndex(max_entries=2)
+        for i, text in enumerate(["alpha beta gamma", "delta epsilon zeta", "eta theta iota"]):
+            index.add("scope", text, i)
+        
+        assert len(index) == 2
+        assert index.query("scope", "alpha beta gamma") is None
+        assert all(0 not in bucket for bucket in index._buckets.values())
+    
+    def test_cache_serves_similar_prompt(self, tmp_path):
+        """A near-duplicate prompt is answered with the cached response and its score."""
+        from config import CacheConfig
+        from database import DatabaseManager
+        from response_cache import ResponseCache
+        
+        cache = ResponseCache(
+            db=DatabaseManager(str(tmp_path / "settings.db")),
+            cache_config=CacheConfig(enabled=True, similarity=True, similarity_threshold=0.8)
+        )
+        cache.put("key", "Paris", "Auto", "gpt-4", scope="scope", prompt="What is the capital of France?")
+        
+        entry, score = cache.get_similar("scope", "what is the capital of france")
+        assert entry.response == "Paris"
+        assert score >= 0.8
+        assert cache.get_stats()["similar_hits"] == 1
+
+
+class TestStaleServing:
+    """Test serving expired answers while refreshing or when providers fail."""
+    
+    def _make_service(self, tmp_path, monkeypatch, fake_call):
+        from ai_service import AIService
+        from config import CacheConfig
+        from database import DatabaseManager
+        from history_cache import HistoryCache
+        from response_cache import ResponseCache
+        
+        service = AIService()
+        service.db = DatabaseManager(str(tmp_path / "settings.db"))
+        service.response_cache = ResponseCache(
+            db=service.db,
+            cache_config=CacheConfig(enabled=True, ttl=60, stale_while_revalidate=60, stale_if_error=3600)
+        )
+        service.history_cache = HistoryCache(service.db)
+        monkeypatch.setattr(service, "_call_ai_api", fake_call)
+        monkeypatch.setattr(type(service.config), "available_providers", property(lambda self: {"Auto": ""}))
+        return service
+    
+    def _cache_old_answer(self, service, age):
+        key = service.response_cache.make_key(
+            [{"role": "user", "content": "Q"}], "Auto", "gpt-4", True
+        )
+        service.db.put_cached_response(key, "old answer", "Auto", "gpt-4", time.time() - age)
+        return key
+    
+    def test_stale_answer_served_while_revalidating(self, tmp_path, monkeypatch):
+        """A recently expired answer is returned at once and refreshed in the background."""
+        import asyncio
+        
+        async def fresh_call(**kwargs):
+            return "new answer"
+        
+        service = self._make_service(tmp_path, monkeypatch, fresh_call)
+        key = self._cache_old_answer(service, 90)
+        
+        result = asyncio.run(service.generate_response_with_meta("Q", provider="Auto", model="gpt-4"))
+        assert (result.text, result.cache_status, result.stale_reason) == ("old answer", "STALE", "revalidating")
+        
+        for _ in range(50):
+            if service.db.get_cached_response(key)["response"] == "new answer":
+                break
+            time.sleep(0.02)
+        assert service.response_cache.get(key).response == "new answer"
+    
+    def test_stale_answer_served_when_providers_fail(self, tmp_path, monkeypatch):
+        """An old answer replaces the error when every provider fails."""
+        import asyncio
+        import pytest
+        from utils.exceptions import AIProviderError
+        
+        async def failing_call(**kwargs):
+            raise AIProviderError("All providers failed to generate a response")
+        
+        service = self._make_service(tmp_path, monkeypatch, failing_call)
+        self._cache_old_answer(service, 600)
+        
+        result = asyncio.run(service.generate_response_with_meta("Q", provider="Auto", model="gpt-4"))
+        assert (result.text, result.cache_status, result.stale_reason) == ("old answer", "STALE", "error")
+        
+        with pytest.raises(AIProviderError):
+            asyncio.run(service.generate_response_with_meta("Never asked", provider="Auto", model="gpt-4"))
@@ -0,0 +1,128 @@
+"""Tests for pooled upstream connections."""
+
+import asyncio
+import sys
+import os
+
+import aiohttp
+
+# Add src to Python path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.session_pool import SessionPool
+
+
+class TestSessionPool:
+    """Test keep-alive connector pooling keyed by provider and proxy."""
+    
+    def test_connector_reused_per_provider_and_proxy(self):
+        """The same provider/proxy pair gets the same connector back."""
+        async def scenario():
+            pool = SessionPool()
+            first = pool.get_connector("Provider")
+            assert pool.get_connector("Provider") is first
+            assert pool.get_connector("Provider", "http://u:p@1.2.3.4:8080") is not first
+            assert pool.get_stats() == {"connectors": 2, "hits": 1, "misses": 2}
+            await pool.close()
+            assert first.closed
+        
+        asyncio.run(scenario())
+    
+    def test_borrowing_session_does_not_close_connector(self):
+        """Providers closing their session leave the pooled connector open."""
+        async def scenario():
+            pool = SessionPool()
+            connector = pool.get_connector("Provider")
+            async with aiohttp.ClientSession(connector=connector):
+                pass
+            assert not connector.closed
+            assert pool.get_connector("Provider") is connector
+            await pool.close()
+        
+        asyncio.run(scenario())
+    
+    def test_size_limit_and_idle_eviction(self):
+        """The pool evicts least recently used and idle connectors."""
+        async def scenario():
+            pool = SessionPool(max_size=2)
+            oldest = pool.get_connector("A")
+            pool.get_connector("B")
+            idle = pool.get_connector("C")
+            await asyncio.sleep(0)
+            assert oldest.closed
+            
+            pool.idle_timeout = 0
+            pool.get_connector("D")
+            await asyncio.sleep(0)
+            assert idle.closed
+            await pool.close()
+        
+        asyncio.run(scenario())
+    
+    def test_other_event_loops_get_no_connector(self):
+        """Connectors are never handed to a loop other than the pool's own."""
+        pool = SessionPool()
+        
+        async def get():
+            return pool.get_connector("Provider")
+        
+        assert asyncio.run(get()) is not None
+        assert asyncio.run(get()) is None
+
+
+class TestServiceLoop:
+    """Test which event loop upstream calls run on."""
+    
+    def _run_call(self, tmp_path, monkeypatch, provider, shared_loop):
+        import threading
+        import ai_service as ai_service_module
+        from ai_service import AIService
+        from database import DatabaseManager
+        from utils.provider_monitor import ProviderMonitor
+        
+        seen = []
+        
+        async def fake_create_async(**kwargs):
+            seen.append((threading.current_thread().name, "connector" in kwargs))
+            return "answer"
+        
+        monkeypatch.setattr(ai_service_module, "provider_monitor", ProviderMonitor())
+        monkeypatch.setattr(ai_service_module.g4f.ChatCompletion, "create_async", fake_create_async)
+        service = AIService()
+        service.db = DatabaseManager(str(tmp_path / "settings.db"))
+        monkeypatch.setattr(service.config.session_pool, "shared_loop", shared_loop)
+        
+        async def call():
+            return await service._make_api_call(
+                [{"role": "user", "content": "hi"}], provider, "gpt-4", {}, None, "Provider"
+            )
+        
+        try:
+            assert asyncio.run(call()) == "answer"
+        finally:
+            service.shutdown()
+        return seen
+    
+    def test_calls_stay_on_request_loop_by_default(self, tmp_path, monkeypatch):
+        """Without the shared loop, calls run on the caller's loop without a pooled connector."""
+        class ConnectorProvider:
+            @staticmethod
+            async def create_async(model, messages, connector=None, **kwargs):
+                pass
+        
+        assert self._run_call(tmp_path, monkeypatch, ConnectorProvider, False) == [("MainThread", False)]
+    
+    def test_shared_loop_only_for_connector_providers(self, tmp_path, monkeypatch):
+        """With the shared loop, only providers taking a connector are moved onto it."""
+        class ConnectorProvider:
+            @staticmethod
+            async def create_async(model, messages, connector=None, **kwargs):
+                pass
+        
+        class PlainProvider:
+            @staticmethod
+            async def create_async(model, messages, **kwargs):
+                pass
+        
+        assert self._run_call(tmp_path, monkeypatch, ConnectorProvider, True) == [("ai-service-loop", True)]
+        assert self._run_call(tmp_path, monkeypatch, PlainProvider, True) == [("MainThread", False)]